@@ -0,0 +1,39 @@
+# coding=utf-8
+"""Benchmarks of bottleneck throttles"""
+
+import math
+import os
+
+from sznqalibs import _clock
+from sznqalibs import bottleneck
+
+from benchmarks.harness import measured, timed
+
+
+def _cpu():
+    times = os.times()
+    return times[0] + times[1]
+
+
+@measured('Throttle.accuracy')
+def bench_throttle_accuracy(load=50, frame=0.05, frames=5):
+    """Take permits for `frames` frames; measure how far from the ideal
+    the total time is (as fraction of frame) and CPU used per wall time"""
+    throttle = bottleneck.Throttle(load, frame)
+    permits = load * frames
+    start, cpu_start = _clock.monotonic(), _cpu()
+    for _ in range(permits):
+        throttle.wait()
+    elapsed = _clock.monotonic() - start
+    cpu = _cpu() - cpu_start
+    expected = (int(math.ceil(float(permits) / load)) - 1) * frame
+    return {
+        'timing_error': abs(elapsed - expected) / frame,
+        'cpu_ratio': cpu / elapsed if elapsed else 0,
+    }
+
+
+@timed('Throttle.open')
+def bench_throttle_open():
+    throttle = bottleneck.Throttle(10 ** 9, 60)
+    return throttle.wait
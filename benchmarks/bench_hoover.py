@@ -0,0 +1,248 @@
+# coding=utf-8
+"""Benchmarks of hoover hot paths"""
+
+import operator
+
+from sznqalibs import hoover
+
+from benchmarks.harness import timed
+
+
+def _cartman(width, depth, leaves=3):
+    """Make source and scheme with `leaves` iterables of `width` values
+    on each of `depth` levels"""
+    source = {}
+    scheme = {}
+    for n in range(leaves):
+        source['k%d' % n] = range(width)
+        scheme['k%d' % n] = hoover.Cartman.Iterable
+    source['const'] = 'x'
+    scheme['const'] = hoover.Cartman.Scalar
+    if depth > 1:
+        source['sub'], scheme['sub'] = _cartman(width, depth - 1, leaves)
+    return source, scheme
+
+
+def _consume(iterable):
+    for _ in iterable:
+        pass
+
+
+@timed('cartman.flat')
+def bench_cartman_flat():
+    cm = hoover.Cartman(*_cartman(10, 1))
+    return lambda: _consume(cm)
+
+
+@timed('cartman.deep')
+def bench_cartman_deep():
+    cm = hoover.Cartman(*_cartman(2, 4))
+    return lambda: _consume(cm)
+
+
+@timed('cartman.large')
+def bench_cartman_large():
+    cm = hoover.Cartman(*_cartman(40, 1))
+    return lambda: _consume(cm)
+
+
+@timed('cartman.large_compact')
+def bench_cartman_large_compact():
+    source, scheme = _cartman(40, 1)
+    cm = hoover.Cartman(source, scheme, compact=True)
+    return lambda: _consume(cm)
+
+
+def _payload(width, depth):
+    if depth == 0:
+        return {'f': 1 / 3.0, 's': 'string', 'n': None, 'l': range(5)}
+    return dict(('key%d' % n, _payload(width, depth - 1))
+                for n in range(width))
+
+
+@timed('dataMatch')
+def bench_datamatch():
+    pattern = {'oname': 'OracleDriver',
+               'argset': {'op': 'div', 'flags': ['a', 'b']}}
+    data = {'oname': 'OracleDriver', 'rname': 'ResultDriver',
+            'argset': {'op': 'div', 'a': 1, 'b': 2,
+                       'flags': ['x', 'a', 'y', 'b', 'z']},
+            'oracle': _payload(3, 2), 'result': _payload(3, 2)}
+    return lambda: hoover.dataMatch(pattern, data)
+
+
+@timed('dictpath.get_set')
+def bench_dictpath():
+    case = hoover.TinyCase({'oracle': _payload(3, 3)})
+
+    def run():
+        value = case.getpath('/oracle/key2/key1/key0/f')
+        case.setpath('/oracle/key2/key1/key0/f', value)
+
+    return run
+
+
+def _case():
+    return hoover.TinyCase({
+        'argset': {'op': 'div', 'a': 1, 'b': 2},
+        'oracle': _payload(3, 2),
+        'result': _payload(3, 2),
+        'oname': 'OracleDriver',
+        'rname': 'ResultDriver',
+    })
+
+
+# (actions are idempotent, so that hacking the same cases repeatedly
+# does the same work)
+RULESET = [
+    {'drivers': [{'rname': 'ResultDriver'}],
+     'round': {3: ['/oracle/key0/key1/f', '/result/key0/key1/f']}},
+    {'argsets': [{'argset': {'op': 'div'}}],
+     'round': {2: ['/oracle/key1/key1/f', '/result/key1/key1/f']}},
+    {'drivers': [{'oname': 'OracleDriver'}],
+     'exchange': {(None, 'null'): ['/oracle/key2/key0/n',
+                                   '/result/key2/key0/n']}},
+    {'argsets': [{'argset': {'op': 'mul'}}],
+     'remove': ['/oracle/key0', '/result/key0']},
+    {'even_up': [('/oracle/key1', '/result/key1')]},
+]
+
+
+@timed('TinyCase.hack')
+def bench_tinycase_hack():
+    ruleset = hoover.TinyCase.compile_ruleset(RULESET)
+    cases = [_case() for _ in range(10)]
+
+    def run():
+        for case in cases:
+            case.hack(ruleset)
+
+    return run
+
+
+@timed('CaseBatch.hack')
+def bench_casebatch_hack():
+    ruleset = hoover.TinyCase.compile_ruleset(RULESET)
+    batch = hoover.CaseBatch([_case() for _ in range(10)])
+    return lambda: batch.hack(ruleset)
+
+
+def _diffed(width, depth):
+    a = _payload(width, depth)
+    b = _payload(width, depth)
+    b['key0']['changed'] = True
+    return a, b
+
+
+@timed('jsDiff.small')
+def bench_jsdiff_small():
+    a, b = _diffed(2, 1)
+    return lambda: hoover.jsDiff(a, b)
+
+
+@timed('jsDiff.large')
+def bench_jsdiff_large():
+    a, b = _diffed(30, 2)
+    return lambda: hoover.jsDiff(a, b)
+
+
+@timed('jsDiff.deep')
+def bench_jsdiff_deep():
+    a, b = _diffed(2, 8)
+    return lambda: hoover.jsDiff(a, b)
+
+
+@timed('Tracker.update')
+def bench_tracker_update():
+    errors = ["error number %d\n%s" % (n, "x" * 200) for n in range(1000)]
+    argset = {'a': 1, 'b': 2}
+
+    def run():
+        tracker = hoover.Tracker()
+        for error in errors:
+            tracker.update(error, argset)
+        for error in errors:
+            tracker.update(None, argset)
+
+    return run
+
+
+class _NoopDriver(hoover.BaseTestDriver):
+
+    def _get_data(self):
+        self.data['x'] = self._args['x']
+
+
+class _OtherNoopDriver(_NoopDriver):
+    pass
+
+
+@timed('regression_test.loop')
+def bench_regression_test():
+    argsrc = [{'x': n} for n in range(100)]
+    tests = [(operator.eq, _NoopDriver, _OtherNoopDriver)]
+    return lambda: hoover.regression_test(argsrc, tests, {})
+
+
+@timed('regression_test.hacked')
+def bench_regression_test_hacked():
+    argsrc = [{'x': n} for n in range(100)]
+    tests = [(operator.eq, _NoopDriver, _OtherNoopDriver)]
+    hacks = [[{'round': {3: ['/oracle/x', '/result/x']}}]]
+    return lambda: hoover.regression_test(argsrc, tests, {},
+                                          apply_hacks=hacks)
+
+
+# with data of realistic size, copying and comparing them matters
+class _PayloadDriver(hoover.BaseTestDriver):
+
+    def _get_data(self):
+        for n in range(50):
+            self.data['key%d' % n] = {'v': self._args['x'] / 3.0,
+                                      'l': [1, 2, 3]}
+
+
+class _OtherPayloadDriver(_PayloadDriver):
+    pass
+
+
+class _ThirdPayloadDriver(_PayloadDriver):
+    pass
+
+
+PAYLOAD_TESTS = [(operator.eq, _PayloadDriver, _OtherPayloadDriver),
+                 (operator.eq, _PayloadDriver, _ThirdPayloadDriver)]
+
+
+@timed('regression_test.payload')
+def bench_regression_test_payload():
+    argsrc = [{'x': n} for n in range(100)]
+    return lambda: hoover.regression_test(argsrc, PAYLOAD_TESTS, {})
+
+
+@timed('regression_test.payload_hacked')
+def bench_regression_test_payload_hacked():
+    argsrc = [{'x': n} for n in range(100)]
+    hacks = [[{'round': {3: ['/oracle/key0/v', '/result/key0/v']}}]]
+    return lambda: hoover.regression_test(argsrc, PAYLOAD_TESTS, {},
+                                          apply_hacks=hacks)
+
+
+# hack touching only one driver, where sharing data pays off
+FEW_HACKS = [[{'drivers': [{'rname': '_OtherPayloadDriver'}],
+               'remove': ['/result/key0/junk']}]]
+
+
+@timed('regression_test.few_hacked')
+def bench_regression_test_few_hacked():
+    argsrc = [{'x': n} for n in range(100)]
+    return lambda: hoover.regression_test(argsrc, PAYLOAD_TESTS, {},
+                                          apply_hacks=FEW_HACKS)
+
+
+@timed('regression_test.few_hacked_shared')
+def bench_regression_test_few_hacked_shared():
+    argsrc = [{'x': n} for n in range(100)]
+    return lambda: hoover.regression_test(argsrc, PAYLOAD_TESTS, {},
+                                          apply_hacks=FEW_HACKS,
+                                          share_data=True)
@@ -0,0 +1,143 @@
+# coding=utf-8
+"""Minimal harness for benchmarks of sznqalibs hot paths.
+
+Benchmarks are registered using decorators:
+
+    @timed('name')
+    def bench_something():
+        data = prepare()            # not measured
+        return lambda: work(data)   # measured
+
+    @measured('name')
+    def bench_other():
+        return {'metric': value}    # measured by the benchmark itself
+
+Timed benchmarks report "sec_per_call", the best of several repeats of
+the callable (number of calls per repeat is calibrated so that a repeat
+takes at least `MIN_REPEAT_TIME`).  For all metrics, lower is better.
+
+Results are dicts `{name: {metric: value}}` and can be saved as JSON to
+serve as baseline for later comparison with `compare()`.
+"""
+
+import json
+import platform
+import sys
+import timeit
+
+
+MIN_REPEAT_TIME = 0.05
+REPEATS = 5
+
+BENCHMARKS = []
+
+
+def timed(name):
+    """Register benchmark returning callable to be timed."""
+    def decorator(fn):
+        BENCHMARKS.append((name, _timer(fn)))
+        return fn
+    return decorator
+
+
+def measured(name):
+    """Register benchmark returning dict of metrics."""
+    def decorator(fn):
+        BENCHMARKS.append((name, fn))
+        return fn
+    return decorator
+
+
+def _timer(setup):
+    def run():
+        timer = timeit.Timer(setup())
+        number = 1
+        while timer.timeit(number) < MIN_REPEAT_TIME:
+            number *= 2
+        best = min(timer.repeat(REPEATS, number))
+        return {'sec_per_call': best / number}
+    return run
+
+
+def run(pattern=None, log=None):
+    """Run benchmarks with `pattern` in name (all if None)."""
+    results = {}
+    for name, fn in BENCHMARKS:
+        if pattern and pattern not in name:
+            continue
+        results[name] = fn()
+        if log:
+            log("%-32s %s\n" % (name, _fmt_metrics(results[name])))
+    return results
+
+
+def _fmt_metrics(metrics):
+    return ", ".join("%s=%.6g" % (k, v) for k, v in sorted(metrics.items()))
+
+
+def save(results, fname):
+    """Save results as a baseline."""
+    with open(fname, 'w') as fh:
+        json.dump({'python': sys.version.split()[0],
+                   'platform': platform.platform(),
+                   'results': results}, fh, sort_keys=True, indent=4)
+
+
+def load(fname):
+    """Load results saved by `save()`."""
+    with open(fname) as fh:
+        return json.load(fh)['results']
+
+
+def compare(baseline, results, tolerance=0.1):
+    """Compare results to baseline; return list of rows.
+
+    Each row is tuple `(name, metric, base, current, ratio, verdict)`,
+    where verdict is "slower" or "faster" if the ratio is out of the
+    `tolerance`, "same" otherwise, or "new"/"gone" if the metric is only
+    in one of the result sets."""
+    rows = []
+    for name in sorted(set(baseline) | set(results)):
+        base = baseline.get(name, {})
+        cur = results.get(name, {})
+        for metric in sorted(set(base) | set(cur)):
+            if metric not in base:
+                rows.append((name, metric, None, cur[metric], None, 'new'))
+                continue
+            if metric not in cur:
+                rows.append((name, metric, base[metric], None, None, 'gone'))
+                continue
+            ratio = cur[metric] / base[metric] if base[metric] else None
+            if ratio is None:
+                verdict = 'same' if not cur[metric] else 'slower'
+            elif ratio > 1 + tolerance:
+                verdict = 'slower'
+            elif ratio < 1 / (1 + tolerance):
+                verdict = 'faster'
+            else:
+                verdict = 'same'
+            rows.append((name, metric, base[metric], cur[metric], ratio,
+                         verdict))
+    return rows
+
+
+def format_comparison(rows):
+    """Format rows from `compare()` as a text table."""
+
+    def num(value):
+        return '-' if value is None else '%.4g' % value
+
+    lines = ["%-32s %-14s %12s %12s %7s"
+             % ('benchmark', 'metric', 'baseline', 'current', 'ratio')]
+    for name, metric, base, cur, ratio, verdict in rows:
+        lines.append(("%-32s %-14s %12s %12s %7s  %s"
+                      % (name, metric, num(base), num(cur),
+                         '-' if ratio is None else '%.2f' % ratio,
+                         '' if verdict == 'same' else verdict.upper()))
+                     .rstrip())
+    slower = sum(1 for row in rows if row[-1] == 'slower')
+    faster = sum(1 for row in rows if row[-1] == 'faster')
+    lines.append("")
+    lines.append("%d slower, %d faster, %d total" % (slower, faster,
+                                                      len(rows)))
+    return "\n".join(lines)
@@ -0,0 +1,49 @@
+# coding=utf-8
+"""Run benchmarks and compare them to a baseline.
+
+    python -m benchmarks.run                      # just run
+    python -m benchmarks.run --save FILE          # store new baseline
+    python -m benchmarks.run --compare FILE       # compare to baseline
+
+When comparing, exit status is 1 if any metric got slower than
+baseline by more than tolerance (20% by default).  Note that baselines
+are only comparable when taken on the same machine.
+"""
+
+import argparse
+import sys
+
+from benchmarks import bench_bottleneck     # noqa (registers benchmarks)
+from benchmarks import bench_hoover         # noqa (registers benchmarks)
+from benchmarks import harness
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--save', metavar='FILE',
+                        help="save results as baseline")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="compare results to baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="relative difference to ignore")
+    parser.add_argument('--filter', metavar='STR',
+                        help="only run benchmarks with STR in name")
+    args = parser.parse_args(argv)
+
+    results = harness.run(args.filter, log=sys.stderr.write)
+    if args.save:
+        harness.save(results, args.save)
+    if args.compare:
+        baseline = harness.load(args.compare)
+        if args.filter:
+            baseline = dict((k, v) for k, v in baseline.items()
+                            if args.filter in k)
+        rows = harness.compare(baseline, results, args.tolerance)
+        print(harness.format_comparison(rows))
+        if any(row[-1] == 'slower' for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
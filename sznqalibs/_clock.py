@@ -0,0 +1,38 @@
+"""Clocks used for measurements in sznqalibs.
+
+Where available (Python 3.3+ / 3.7+), monotonic and high-resolution
+clocks are used so that measurements are not affected by system time
+adjustments (e.g. NTP).  On older Pythons, the best available clock
+is used instead.
+"""
+
+import time
+
+NS_PER_SEC = 1000000000
+
+# monotonic seconds, e.g. for frames and ages
+monotonic = getattr(time, 'monotonic', time.time)
+
+try:
+    perf_ns = time.perf_counter_ns
+except AttributeError:
+    _perf = getattr(time, 'perf_counter', time.time)
+
+    def perf_ns():
+        """Current value of performance counter in integer nanoseconds."""
+        return int(_perf() * NS_PER_SEC)
+
+
+def ns2s(ns):
+    """Convert nanoseconds to fractional seconds."""
+    return float(ns) / NS_PER_SEC
+
+
+def s2ns(seconds):
+    """Convert fractional seconds to integer nanoseconds."""
+    return int(round(seconds * NS_PER_SEC))
+
+
+def ns2ms(ns):
+    """Convert nanoseconds to milliseconds, rounded to microseconds."""
+    return round(float(ns) / 1000000, 3)
@@ -1,5 +1,7 @@
 import time
 
+from sznqalibs import _clock
+
 
 class FrameState(object):
     """Abstraction and tracking of frame state"""
@@ -17,13 +19,13 @@ class FrameState(object):
         self.__reset()
 
     def __reset(self):
-        self.start = time.time()
+        self.start = _clock.monotonic()
         self.pos = 0
         self.load = 0
         self.allows = True
 
     def __update(self):
-        self.pos = time.time() - self.start
+        self.pos = _clock.monotonic() - self.start
         self.time_ok = self.pos <= self.SIZE
         self.load_ok = self.load <= self.MAX_LOAD - 1
 
@@ -44,6 +46,10 @@ class FrameState(object):
     def is_closed(self):
         return not self.is_open()
 
+    def remaining(self):
+        """Seconds left till end of the frame, as of last check"""
+        return max(0, self.SIZE - self.pos)
+
     def is_open(self):
         self.__update()
         if self.allows:
@@ -51,6 +57,74 @@ class FrameState(object):
         return self.allows
 
 
+class ThrottleStats(object):
+    """Cheap counters describing how much a throttle held its callers.
+
+    Tracks number of permits granted, how many of them had to wait,
+    total and maximum wait time, a histogram of wait times in fixed
+    buckets (upper bounds in seconds, see `BUCKETS`) and the fraction
+    of time the throttle was closed, i.e. spent by callers waiting.
+
+    Stats from several throttles (e.g. in several worker processes)
+    can be combined using `merge()`.
+    """
+
+    BUCKETS = (0.001, 0.01, 0.1, 1, 10)
+
+    def __init__(self):
+        self.permits = 0
+        self.waits = 0
+        self.wait_total = 0
+        self.wait_max = 0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+        self._born = _clock.monotonic()
+        self._merged_elapsed = 0
+
+    def _bucket(self, waited):
+        for n, bound in enumerate(self.BUCKETS):
+            if waited <= bound:
+                return n
+        return len(self.BUCKETS)
+
+    def elapsed(self):
+        """Time covered by these stats in seconds."""
+        return _clock.monotonic() - self._born + self._merged_elapsed
+
+    def record(self, waited):
+        """Record one permit granted after waiting `waited` seconds."""
+        self.permits += 1
+        if waited:
+            self.waits += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        self.histogram[self._bucket(waited)] += 1
+
+    def merge(self, other):
+        """Add counters from other ThrottleStats to self; return self."""
+        self.permits += other.permits
+        self.waits += other.waits
+        self.wait_total += other.wait_total
+        self.wait_max = max(self.wait_max, other.wait_max)
+        self.histogram = [a + b for a, b in zip(self.histogram,
+                                                other.histogram)]
+        self._merged_elapsed += other.elapsed()
+        return self
+
+    def getstats(self):
+        """Return the stats as a dict."""
+        labels = ['<=%s' % b for b in self.BUCKETS]
+        labels.append('>%s' % self.BUCKETS[-1])
+        elapsed = self.elapsed()
+        return {
+            'permits': self.permits,
+            'waits': self.waits,
+            'wait_total': self.wait_total,
+            'wait_max': self.wait_max,
+            'wait_histogram': dict(zip(labels, self.histogram)),
+            'closed_ratio': (self.wait_total / elapsed if elapsed else 0),
+        }
+
+
 class Throttle(object):
     """Throttle to allow only certain amount of iteration per given time.
 
@@ -75,6 +149,10 @@ class Throttle(object):
     per 10 minutes, all loops will happen in the first second, and the last
     call will block for 599 seconds.
 
+    The throttle keeps `ThrottleStats` in `stats`; call `getstats()` to
+    see how many permits were granted and how much time was spent
+    waiting, e.g. to tell if a run was bound by the throttle or by
+    the service itself.
     """
 
     def __init__(self, max_load, frame_size=60, debug=False):
@@ -92,6 +170,7 @@ class Throttle(object):
         self.waiting = True
         self.frame = FrameState(max_load=self.max_load, size=self.frame_size,
                                 debug=self.debug)
+        self.stats = ThrottleStats()
 
     def is_closed(self):
         """True if throttle is closed."""
@@ -101,9 +180,102 @@ class Throttle(object):
         """True if throttle is open."""
         return self.frame.is_open()
 
+    def getstats(self):
+        """Return dict with `ThrottleStats` of this throttle."""
+        return self.stats.getstats()
+
     def wait(self):
-        """Return now if throttle is open, otherwise block until it is."""
+        """Return now if throttle is open, otherwise block until it is.
+
+        When closed, the throttle can only open with a new frame, so
+        the caller sleeps until then instead of keeping the CPU busy."""
         self.frame.debug()
         self.waiting = self.is_closed()
+        if not self.waiting:
+            self.stats.record(0)
+            return
+        start = _clock.monotonic()
         while self.waiting:
+            time.sleep(self.frame.remaining())
             self.waiting = self.is_closed()
+        self.stats.record(_clock.monotonic() - start)
+
+
+class AdaptiveThrottle(Throttle):
+    """Throttle that adapts its load to observed latency and errors.
+
+    Usage:
+
+        t = bottleneck.AdaptiveThrottle(target_latency=0.2)
+
+        while True:
+            t.wait()
+            start = time.time()
+            try:
+                call_a_load_sensitive_service()
+            except ServiceError:
+                t.feedback(time.time() - start, ok=False)
+            else:
+                t.feedback(time.time() - start)
+
+    The permitted load is controlled in AIMD (additive increase,
+    multiplicative decrease) fashion: each successful call that took
+    no longer than `target_latency` raises the load by `increase`,
+    while a failed or slower call multiplies it by `decrease`.  The
+    decrease is applied at most once per frame, so that a burst of
+    slow responses (all caused by the same overload) does not cut
+    the load down to the minimum at once.
+
+    Current rate (permitted calls per second) is available as `rate`
+    for logging.
+    """
+
+    def __init__(self, target_latency, min_load=1, max_load=1000,
+                 initial_load=None, frame_size=1, increase=1,
+                 decrease=0.5, debug=False):
+        """Create new AdaptiveThrottle.
+
+        `target_latency` is the latency in seconds the throttle tries to
+        hold.  The load per frame will always stay between `min_load`
+        and `max_load`, starting at `initial_load` (defaults to
+        `min_load`).  `frame_size`, in seconds, defaults to 1 so that
+        the load is effectively a rate per second.  `increase` and
+        `decrease` are the additive and multiplicative factors.
+        """
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1: %r"
+                             % decrease)
+        self.target_latency = target_latency
+        self.min_load = min_load
+        self.max_load_limit = max_load
+        self.increase = increase
+        self.decrease = decrease
+        self._last_decrease = None
+        load = min_load if initial_load is None else initial_load
+        super(AdaptiveThrottle, self).__init__(
+            max(min_load, min(max_load, load)), frame_size, debug)
+
+    def _set_load(self, load):
+        self.max_load = max(self.min_load, min(self.max_load_limit, load))
+        self.frame.MAX_LOAD = self.max_load
+
+    @property
+    def rate(self):
+        """Currently permitted calls per second."""
+        return float(self.max_load) / self.frame_size
+
+    def feedback(self, latency, ok=True):
+        """Adapt the load after a call that took `latency` seconds.
+
+        Pass `ok=False` if the call failed; the load is then decreased
+        regardless of latency.
+        """
+        if ok and latency <= self.target_latency:
+            self._set_load(self.max_load + self.increase)
+            return
+        now = _clock.monotonic()
+        recent = (self._last_decrease is not None
+                  and now - self._last_decrease < self.frame_size)
+        if not recent:
+            self._last_decrease = now
+            self._set_load(self.max_load * self.decrease)
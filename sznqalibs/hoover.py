@@ -1,23 +1,52 @@
 # coding=utf-8
 
+import ast
+import atexit
 import collections
+import cProfile
 import csv
 import difflib
 import hashlib
+import httplib
 import inspect
 import itertools
 import json
+import math
+import mmap
 import operator
-import time
+import os
+import Queue
+import socket
+import subprocess
+import sys
+import threading
+import urllib
+import urlparse
 from copy import deepcopy
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from sznqalibs import _clock
+from sznqalibs import bottleneck
+
 
 # ########################################################################### #
 # ## The Motor                                                             ## #
 # ########################################################################### #
 
 def regression_test(argsrc, tests, driver_settings, cleanup_hack=None,
-                    apply_hacks=None, on_next=None):
+                    apply_hacks=None, on_next=None, driver_limits=None,
+                    perf_ratio=None, perf_threshold=0, listeners=None,
+                    progress=None, batch_size=1, profile=None, memory=None,
+                    warmup=None, share_data=False):
     """Perform regression test with argsets from `argsrc`.
 
     For each argset pulled from source, performs one comparison
@@ -32,6 +61,34 @@ def regression_test(argsrc, tests, driver_settings, cleanup_hack=None,
     dict, and gets a copy of the dict with settings only intended
     for itself (and the "DriverName" part stripped).
 
+    Two settings are also understood by the engine itself: with
+    "DriverName.max_rps", calls of the driver are throttled to
+    given number per second, and "DriverName.max_concurrency" limits
+    number of calls of the driver in progress at the same time.  Other
+    drivers are not affected, so e.g. fast local drivers can run flat
+    out while a remote system is paced.
+
+    Similarly, "DriverName.call_timeout" sets maximum number of seconds
+    a call of the driver can take.  If the call takes longer, the driver
+    instance is cancelled (see `BaseTestDriver.cancel()`) and abandoned,
+    `hoover.DriverTimeout` is recorded in the tracker as an error of the
+    argset (once per driver class, see `Tracker.add_error()`), tests
+    involving the driver on the argset are skipped (and not counted in
+    "tests_done") and the timeout is counted as "timeouts".  (With
+    `batch_size`, this applies to all argsets of the batch.)
+
+    Instead of these settings, you can pass
+    `driver_limits`, a dict of `hoover.DriverLimits` instances keyed
+    by driver class, e.g. to share the limits between several tests
+    running in parallel threads.  Time spent waiting for the limits
+    is counted as "throttle_wait", separately from "duration" and
+    "overhead".
+
+    All times are measured using high-resolution clock (monotonic where
+    Python provides one) and accumulated as integer nanoseconds; the
+    stats computed from them are in milliseconds, rounded to
+    microseconds.
+
     If comparison fails, report is generated using `hoover.jsDiff()`,
     and along with affected arguments stored in `hoover.Tracker`
     instance, which is finally used as a return value.  This instance
@@ -48,12 +105,82 @@ def regression_test(argsrc, tests, driver_settings, cleanup_hack=None,
     A function can be provided as `on_next` argument, that will be
     called after pulling each argument set, with last argument set
     (or `None`) as first argument and current one as second argument.
+
+    If `perf_ratio` is given, durations of each driver pair are compared
+    as well, and every argset where result driver took longer than
+    `perf_ratio` times the oracle duration plus `perf_threshold` seconds
+    is recorded as a performance error (see `Tracker.update_perf()`).
+    Mean durations of each pair over the whole run are compared the same
+    way and stored in `Tracker.perf_summary`.
+
+    To keep slow first calls (JIT, cold caches...) from skewing the
+    timing stats, pass `warmup`, either number of first calls of each
+    driver to consider warm-up, or a `hoover.Warmup` instance to also
+    wait until the latency stabilises (it is copied for each driver).
+    Durations of warm-up calls are then reported separately as
+    "warmup_duration" (see `hoover.StatCounter`), and argsets where any
+    driver of the pair was warming up are left out of the `perf_ratio`
+    comparison.
+
+    For detailed tracing of where the time goes, pass `listeners`, a list
+    of functions to be called at start and end of each stage of the
+    loop with arguments `name`, `phase` ("B" for begin, "E" for end),
+    `ts` (timestamp in seconds from the performance counter, which is
+    monotonic where Python provides one, but wall clock on Python 2, so
+    only use differences) and `args` (dict with details, or `None`).
+    Stage names are "argset", "call:DriverName", "hacks", "match",
+    "cleanup", "diff" and "tracker".  See `hoover.ChromeTraceExporter`
+    for a listener that can save the trace for a trace viewer.  Without
+    listeners, tracing costs nothing.
+
+    To watch progress of long runs, pass `progress`, an instance of
+    `hoover.ProgressReporter`.  If `argsrc` is sized (e.g. a `Cartman`
+    with sized iterables, or a list), total number of argsets is passed
+    to the reporter so that it can estimate remaining time.
+
+    With `batch_size` greater than 1, argsets are pulled from `argsrc`
+    in groups of that size and drivers that implement `_get_data_batch`
+    (see `hoover.BaseTestDriver`) are called only once per group.  The
+    duration of such call is split evenly among the argsets.  Hacks are
+    then applied to all cases of the group at once (see
+    `hoover.CaseBatch`).
+
+    When a pair does not match, data of both drivers are digested (see
+    `hoover.jsDigest()`) first, and if the digests are the same, the
+    expensive `jsDiff()` is skipped (its result would be empty anyway).
+    Number of such shortcuts is counted as "diffs_skipped".
+
+    Without `apply_hacks`, driver data are not copied for each test pair:
+    pairs share them, and a copy is only made before `cleanup_hack` is
+    applied.  With `apply_hacks`, data are copied for each pair, unless
+    `share_data` is true: then a copy is only made when a hack modifies
+    the data, and reused by other pairs getting the same hacks (see
+    `hoover.SharedCaseBatch`).  This pays off with big data and hacks
+    modifying only few of them, but costs more than it saves when most
+    data get hacked.  Copies made are counted as "copies", reuses as
+    "views_reused" and "copies_avoided" tells how many copies were saved
+    compared to copying data for each pair.
+
+    To find out where the time goes, pass `profile`, an instance of
+    `hoover.RunProfiler`.  It profiles the engine and optionally each
+    driver class separately, and the time of the whole run is split to
+    stages, which is added to stats as "stage_drivers", "stage_copy",
+    "stage_hacks", "stage_match", "stage_cleanup", "stage_diff",
+    "stage_tracker" and "stage_other" (in ms).  Note that with
+    "call_timeout" set, drivers run in helper threads, which the profiler
+    does not see (see `hoover.RunProfiler`).
+
+    Similarly, to find out what takes memory, pass `memory`, an instance
+    of `hoover.MemoryAccountant`; its stats are added to the stats, too.
     """
 
     # TODO: do not parse driver_settings thousands of times (use a view class?)
 
     on_next = on_next if on_next else lambda a, b: None
     apply_hacks = apply_hacks if apply_hacks else []
+    apply_hacks = [TinyCase.compile_ruleset(h) for h in apply_hacks]
+    if cleanup_hack:
+        cleanup_hack = TinyCase.compile_ruleset(cleanup_hack)
 
     tracker = Tracker()
     last_argset = None
@@ -61,87 +188,406 @@ def regression_test(argsrc, tests, driver_settings, cleanup_hack=None,
     all_classes = set(reduce(lambda a, b: a+b,
                              [triple[1:] for triple in tests]))
 
+    if driver_limits is None:
+        driver_limits = dict((aclass, DriverLimits.from_settings(
+            aclass, driver_settings)) for aclass in all_classes)
+
+    if warmup is not None and not isinstance(warmup, Warmup):
+        warmup = Warmup(calls=warmup)
+    warmups = dict((aclass, warmup.copy() if warmup else Warmup())
+                   for aclass in all_classes)
+
     counter = StatCounter()
+    perf_sums = {}
+    if profile:
+        listeners = list(listeners or []) + [profile]
+        profile.start()
+    if memory:
+        listeners = list(listeners or []) + [memory]
+        memory.start()
+    trace = _make_tracer(listeners)
+
+    try:
+        if progress:
+            try:
+                total = len(argsrc)
+            except TypeError:
+                total = None
+            progress.start(total)
+
+        for chunk in _chunked(argsrc, batch_size):
+
+            if trace:
+                trace('argset', 'B', {'n': tracker.argsets_done,
+                                      'size': len(chunk)})
+
+            for argset in chunk:
+                on_start = _clock.perf_ns()
+                on_next(argset, last_argset)
+                counter.add('on_next', _clock.perf_ns() - on_start)
+                last_argset = argset
+
+            # # load the data first, only once for each driver
+            #
+            data = [{} for argset in chunk]
+            durations = [{} for argset in chunk]
+            warming = [set() for argset in chunk]
+            for aclass in all_classes:
+                todo = []
+                for n, argset in enumerate(chunk):
+                    try:
+                        aclass.check_values(argset)
+                    except NotImplementedError:     # let them bail out
+                        counter.count_for(aclass, 'bailouts')
+                    else:
+                        todo.append(n)
+                if not todo:
+                    continue
+                tname = 'call:' + aclass.__name__
+                limits = driver_limits.get(aclass)
+                if batch_size > 1 and hasattr(aclass, '_get_data_batch'):
+                    if trace:
+                        trace(tname, 'B', {'argsets': len(todo)})
+                    try:
+                        results = _run_driver_batch(aclass,
+                                                    [chunk[n] for n in todo],
+                                                    driver_settings, limits)
+                    except DriverTimeout as e:
+                        results = [e] * len(todo)
+                    if trace:
+                        trace(tname, 'E')
+                    counter.count_for(aclass, 'batches')
+                else:
+                    results = []
+                    for n in todo:
+                        if trace:
+                            trace(tname, 'B')
+                        try:
+                            results.append(_run_driver(
+                                aclass, chunk[n], driver_settings, limits))
+                        except DriverTimeout as e:
+                            results.append(e)
+                        if trace:
+                            last = results[-1]
+                            trace(tname, 'E', (
+                                {'timeout': True}
+                                if isinstance(last, DriverTimeout)
+                                else {'duration': _clock.ns2s(last[1])}))
+                for n, result in zip(todo, results):
+                    if isinstance(result, DriverTimeout):
+                        # tests with this class are skipped as with bailout
+                        counter.count_for(aclass, 'timeouts')
+                        tracker.add_error(result, chunk[n])
+                        continue
+                    (adata, duration_ns, overhead_ns, waited_ns,
+                     timings) = result
+                    data[n][aclass] = adata
+                    durations[n][aclass] = _clock.ns2s(duration_ns)
+                    prefix = ''
+                    if warmups[aclass].update(durations[n][aclass]):
+                        warming[n].add(aclass)
+                        prefix = 'warmup_'
+                        counter.count_for(aclass, 'warmup_calls')
+                    counter.count_for(aclass, 'calls')
+                    counter.add_for(aclass, prefix + 'duration', duration_ns)
+                    counter.record_for(aclass, prefix + 'duration',
+                                       durations[n][aclass])
+                    counter.add_for(aclass, 'overhead', overhead_ns)
+                    counter.add_for(aclass, 'throttle_wait', waited_ns)
+                    for timing_name, value in timings.iteritems():
+                        counter.record_for(aclass, prefix + timing_name, value)
+
+            tasks = [[] for argset in chunk]
+            cases = []
+            keys = []
+            for n, argset in enumerate(chunk):
+                case_argset = argset
+                if isinstance(argset, CompactArgset) and (apply_hacks
+                                                          or cleanup_hack):
+                    case_argset = argset.to_dict()      # let hacks modify it
+                for match_op, oclass, rclass in tests:
+
+                    # skip test if one of classes bailed out on the argset
+                    if oclass not in data[n] or rclass not in data[n]:
+                        continue
+
+                    case = TinyCase({
+                        'argset': case_argset,
+                        'oracle': data[n][oclass],
+                        'result': data[n][rclass],
+                        'oname': oclass.__name__,
+                        'rname': rclass.__name__
+                    })
+                    tasks[n].append((match_op, oclass, rclass, len(cases)))
+                    cases.append(case)
+                    keys.append({'oracle': (n, oclass), 'result': (n, rclass)})
+
+            # # apply hacks to all cases at once
+            #
+            if trace:
+                trace('hacks', 'B')
+            batch = SharedCaseBatch(cases, keys,
+                                    lazy=share_data or not apply_hacks)
+            hacks_per_case = [0] * len(cases)
+            for h in apply_hacks:
+                hacks_per_case = map(operator.add, hacks_per_case,
+                                     batch.hack(h))
+            if trace:
+                trace('hacks', 'E', {'applied': sum(hacks_per_case)})
+            if profile:
+                profile.add_stage('hacks', -batch.copy_ns)
+
+            # digests of data of failed pairs, computed once per view
+            digests = {}
+
+            def digest_of(view):
+                if id(view) not in digests:
+                    digests[id(view)] = jsDigest(view)
+                return digests[id(view)]
+
+            for n, argset in enumerate(chunk):
+
+                for match_op, oclass, rclass, cn in tasks[n]:
+
+                    diff = None
+                    case = cases[cn]
+
+                    hd = hacks_per_case[cn]
+                    counter.add_for(oclass, 'ohacks', hd)
+                    counter.add_for(rclass, 'rhacks', hd)
+                    counter.add('hacks', hd)
+                    counter.add('hacked_cases', (1 if hd else 0))
+
+                    if trace:
+                        trace('match', 'B')
+                    matched = match_op(case['oracle'], case['result'])
+                    if trace:
+                        trace('match', 'E', {'matched': bool(matched)})
+
+                    if not matched:
+
+                        # try to clean up so that normally ignored items
+                        # do not clutter up the report
+                        cleaned = False
+                        if not match_op == operator.eq:
+                            if cleanup_hack:
+                                if trace:
+                                    trace('cleanup', 'B')
+                                copy_ns = batch.copy_ns
+                                batch.privatize(cn)
+                                if profile:     # already in 'copy' stage
+                                    profile.add_stage(
+                                        'cleanup', copy_ns - batch.copy_ns)
+                                case.hack(cleanup_hack)
+                                cleaned = True
+                                # but panic if that "removed" the error
+                                # condition
+                                if match_op(case['oracle'], case['result']):
+                                    raise RuntimeError("cleanup ate error")
+                                if trace:
+                                    trace('cleanup', 'E')
+
+                        if cleaned:
+                            odigest = jsDigest(case['oracle'])
+                            rdigest = jsDigest(case['result'])
+                        else:
+                            odigest = digest_of(case['oracle'])
+                            rdigest = digest_of(case['result'])
+
+                        # identical dumps can only give empty diff
+                        if odigest is not None and odigest == rdigest:
+                            counter.count('diffs_skipped')
+                        else:
+                            if trace:
+                                trace('diff', 'B')
+                            diff = jsDiff(dira=case['oracle'],
+                                          dirb=case['result'],
+                                          namea=case['oname'],
+                                          nameb=case['rname'])
+                            if trace:
+                                trace('diff', 'E')
+
+                    if trace:
+                        trace('tracker', 'B')
+                    tracker.update(diff, argset)
+
+                    if perf_ratio is not None and not (
+                            oclass in warming[n] or rclass in warming[n]):
+                        odur = durations[n][oclass]
+                        rdur = durations[n][rclass]
+                        sums = perf_sums.setdefault((oclass, rclass),
+                                                    [0, 0, 0])
+                        sums[0] += odur
+                        sums[1] += rdur
+                        sums[2] += 1
+                        slowdown = None
+                        if rdur > odur * perf_ratio + perf_threshold:
+                            slowdown = _fmt_slowdown(oclass, rclass,
+                                                     perf_ratio,
+                                                     perf_threshold)
+                        tracker.update_perf(slowdown, argset, {
+                            oclass.__name__: odur,
+                            rclass.__name__: rdur,
+                        })
+
+                    if trace:
+                        trace('tracker', 'E')
+
+                    counter.count('cases')
+
+                tracker.argsets_done += 1
+
+                counter.count('argsets')
+
+                if progress:
+                    progress.update(tracker, counter)
+
+            counter.add('copies', batch.copies)
+            counter.add('views_reused', batch.reused)
+            if profile:
+                profile.add_stage('copy', batch.copy_ns)
+
+            if trace:
+                trace('argset', 'E')
+
+        for (oclass, rclass), (osum, rsum, n) in perf_sums.iteritems():
+            # as means, with threshold applying to each argset
+            tracker.perf_summary[_fmt_slowdown(oclass, rclass, perf_ratio,
+                                               perf_threshold)] = {
+                'ratio': (rsum / osum if osum else None),
+                'slower': rsum > osum * perf_ratio + perf_threshold * n,
+            }
+    finally:
+        if profile:
+            profile.stop()
+        if memory:
+            memory.stop()
 
-    for argset in argsrc:
+    if profile:
+        for stage, ns in profile.stage_stats().iteritems():
+            counter.add('stage_' + stage, _clock.ns2ms(ns))
 
-        on_start = time.time()
-        on_next(argset, last_argset)
-        counter.add('on_next', time.time() - on_start)
+    if memory:
+        for key, value in memory.getstats().iteritems():
+            counter.add(key, value)
 
-        # # load the data first, only once for each driver
-        #
-        data = {}
-        for aclass in all_classes:
-            try:
-                aclass.check_values(argset)
-            except NotImplementedError:         # let them bail out
-                counter.count_for(aclass, 'bailouts')
-                pass
-            else:
-                data[aclass], duration, overhead = get_data_and_stats(
-                    aclass, argset, driver_settings)
-                counter.count_for(aclass, 'calls')
-                counter.add_for(aclass, 'duration', duration)
-                counter.add_for(aclass, 'overhead', overhead)
+    if progress:
+        progress.finish(tracker, counter)
 
-        for match_op, oclass, rclass in tests:
+    tracker.driver_stats = counter.all_stats()
+    return tracker
 
-            # skip test if one of classes bailed out on the argset
-            if oclass not in data or rclass not in data:
-                continue
 
-            diff = None
+def _make_tracer(listeners):
+    """Return function passing trace events to listeners, or None"""
+    if not listeners:
+        return None
 
-            case = TinyCase({
-                'argset': argset,
-                'oracle': deepcopy(data[oclass]),
-                'result': deepcopy(data[rclass]),
-                'oname': oclass.__name__,
-                'rname': rclass.__name__
-            })
+    def trace(name, phase, args=None):
+        ts = _clock.ns2s(_clock.perf_ns())
+        for listener in listeners:
+            listener(name, phase, ts, args)
 
-            hacks_done = sum([case.hack(h) for h in apply_hacks])
-            counter.add_for(oclass, 'ohacks', hacks_done)
-            counter.add_for(rclass, 'rhacks', hacks_done)
-            counter.add('hacks', hacks_done)
-            counter.add('hacked_cases', (1 if hacks_done else 0))
+    return trace
 
-            if not match_op(case['oracle'], case['result']):
 
-                # try to clean up so that normally ignored items
-                # do not clutter up the report
-                if not match_op == operator.eq:
-                    case.hack(cleanup_hack)
-                    # but panic if that "removed" the error condition
-                    if match_op(case['oracle'], case['result']):
-                        raise RuntimeError("cleanup ate error")
+def _fmt_slowdown(oclass, rclass, ratio, threshold):
+    """Format performance error string for a driver pair"""
+    return ("%s slower than %s (limit: %sx + %ss)"
+            % (rclass.__name__, oclass.__name__, ratio, threshold))
 
-                diff = jsDiff(dira=case['oracle'],
-                              dirb=case['result'],
-                              namea=case['oname'],
-                              nameb=case['rname'])
 
-            tracker.update(diff, argset)
+def _chunked(iterable, size):
+    """Yield lists of up to `size` consecutive items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
-            counter.count('cases')
 
-        tracker.argsets_done += 1
-        last_argset = argset
+def _apportion(total, n):
+    """Split integer total to n integer parts"""
+    share, rest = divmod(total, n)
+    return [share + (1 if i < rest else 0) for i in range(n)]
 
-        counter.count('argsets')
 
-    tracker.driver_stats = counter.all_stats()
-    return tracker
+def _call(driver, method, args, limits=None):
+    """Call driver method within limits, return its result and
+    nanoseconds spent waiting for the permit
 
+    With timeout, the call is made in a new thread; if it does not
+    finish in time, the driver is cancelled and left behind, and
+    `hoover.DriverTimeout` is raised.  The abandoned call keeps its
+    permit until it actually ends, so it still counts against
+    max_concurrency."""
+    if not limits:
+        return method(args), 0
+    waited = limits.acquire()
+    if not limits.timeout:
+        try:
+            return method(args), waited
+        finally:
+            limits.release()
+    outcome = {}
 
-def get_data_and_stats(driverClass, argset, driver_settings):
-    """Run test with given driver"""
-    start = time.time()
+    def target():
+        try:
+            outcome['result'] = method(args)
+        except BaseException:
+            outcome['error'] = sys.exc_info()
+        finally:
+            limits.release()
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    thread.join(limits.timeout)
+    if thread.is_alive():
+        driver.cancel()
+        raise DriverTimeout(driver, limits.timeout)
+    if 'error' in outcome:
+        raise outcome['error'][0], outcome['error'][1], outcome['error'][2]
+    return outcome['result'], waited
+
+
+def _run_driver_batch(driverClass, argsets, driver_settings, limits=None):
+    """Run test with given driver on many argsets at once
+
+    Return list with tuple for each argset, as returned by `_run_driver`;
+    times of the whole batch are split evenly."""
+    start = _clock.perf_ns()
     d = driverClass()
     d.setup(driver_settings, only_own=True)
-    d.run(argset)
-    return (d.data, d.duration, time.time() - d.duration - start)
+    drivers, waited = _call(d, d.run_batch, argsets, limits)
+    waited += d.throttle_wait_ns
+    overhead = _clock.perf_ns() - start - d.duration_ns - waited
+    n = len(argsets)
+    return [(dd.data, dd.duration_ns, o, w, dd.timings) for dd, o, w
+            in zip(drivers, _apportion(overhead, n), _apportion(waited, n))]
+
+
+def _run_driver(driverClass, argset, driver_settings, limits=None):
+    """Run test with given driver, return data, duration, overhead, wait
+    and dict of other timings
+
+    Times are returned in integer nanoseconds, other timings as reported
+    by the driver (in seconds)."""
+    start = _clock.perf_ns()
+    d = driverClass()
+    d.setup(driver_settings, only_own=True)
+    waited = _call(d, d.run, argset, limits)[1]
+    waited += d.throttle_wait_ns
+    overhead = _clock.perf_ns() - start - d.duration_ns - waited
+    return (d.data, d.duration_ns, overhead, waited, d.timings)
+
+
+def get_data_and_stats(driverClass, argset, driver_settings):
+    """Run test with given driver"""
+    data, duration, overhead = _run_driver(driverClass, argset,
+                                           driver_settings)[:3]
+    return (data, _clock.ns2s(duration), _clock.ns2s(overhead))
 
 
 def get_data(driverClass, argset, driver_settings):
@@ -329,6 +775,29 @@ class DictPath():
 # ## The Case                                                              ## #
 # ########################################################################### #
 
+class CompiledRule(dict):
+    """Hack rule with its patterns compiled by `hoover.compilePattern`.
+
+    Behaves as the original rule dict, and adds `matches()` that tells
+    if patterns in the rule ('drivers' and 'argsets') match the data
+    as explained in `hoover.TinyCase`.
+    """
+
+    PATTERN_KEYS = ('drivers', 'argsets')
+
+    def __init__(self, rule):
+        super(CompiledRule, self).__init__(rule)
+        self._matchers = [[compilePattern(p) for p in self[key]]
+                          for key in self.PATTERN_KEYS if key in self]
+
+    def matches(self, data):
+        """True if for each pattern key present, any pattern matches."""
+        for matchers in self._matchers:
+            if not any(m(data) for m in matchers):
+                return False
+        return True
+
+
 class TinyCase(dict, DictPath):
     """Abstraction of the smallest unit of testing.
 
@@ -473,27 +942,30 @@ class TinyCase(dict, DictPath):
                      'exchange': a_exchange,
                      'round': a_round}
 
-    def hack(self, ruleset):
-        """Apply action from each rule, if patterns match."""
+    @staticmethod
+    def compile_ruleset(ruleset):
+        """Return ruleset with patterns compiled for repeated `hack()` calls.
 
-        def driver_matches():
-            if 'drivers' not in rule:
-                return True
-            else:
-                return any(dataMatch(p, self)
-                           for p in rule['drivers'])
+        Rules are converted to `hoover.CompiledRule`; rules that are
+        already compiled are kept as they are.
+        """
+        return [rule if isinstance(rule, CompiledRule) else CompiledRule(rule)
+                for rule in ruleset]
 
-        def argset_matches():
-            if 'argsets' not in rule:
-                return True
-            else:
-                return any(dataMatch(p, self)
-                           for p in rule['argsets'])
+    def hack(self, ruleset):
+        """Apply action from each rule, if patterns match.
+
+        If the same ruleset is used for many cases, pass it through
+        `TinyCase.compile_ruleset()` first to avoid compiling the
+        patterns on each call.
+        """
 
         matched = False
         cls = self.__class__
         for rule in ruleset:
-            if driver_matches() and argset_matches():
+            if not isinstance(rule, CompiledRule):
+                rule = CompiledRule(rule)
+            if rule.matches(self):
                 matched = True
                 for action_name in cls.known_actions:
                     if action_name in rule:
@@ -501,6 +973,280 @@ class TinyCase(dict, DictPath):
         return matched
 
 
+class CaseBatch(object):
+    """Batch of `TinyCase` instances to be hacked at once.
+
+    When many cases share the same structure (e.g. cases from a `Cartman`
+    sweep), applying a ruleset to them one by one repeats the same
+    work: parsing the paths, looking up the actions, etc.  `hack()`
+    of this class applies the ruleset "column-wise": each rule is
+    matched against all cases, giving a mask, and each action is then
+    applied to all matching cases at once, with each path resolved only
+    once per batch.
+
+    The result is the same as if `TinyCase.hack()` was called on each
+    case.  Actions that don't have batch version in `batch_actions`
+    (e.g. added by a `TinyCase` sub-class) are applied case by case.
+    """
+
+    def __init__(self, cases):
+        self.cases = list(cases)
+
+    def __len__(self):
+        return len(self.cases)
+
+    @staticmethod
+    def _keys(path):
+        """Resolve path to list of keys"""
+        return DictPath.Path(path, DictPath.DIV).stripped().split(
+            DictPath.DIV)
+
+    def _slots(self, path, mask):
+        """For each case, return `(container, key)` the path leads to
+
+        None is returned for cases not in mask or where path does not
+        exist."""
+        keys = self._keys(path)
+        parent_keys, last = keys[:-1], keys[-1]
+        slots = []
+        for case, ok in zip(self.cases, mask):
+            slot = None
+            if ok:
+                try:
+                    parent = case
+                    for key in parent_keys:
+                        parent = parent[key]
+                    parent[last]
+                except (TypeError, KeyError):
+                    pass
+                else:
+                    slot = (parent, last)
+            slots.append(slot)
+        return slots
+
+    def _existing(self, path, mask):
+        return [slot for slot in self._slots(path, mask) if slot]
+
+    def b_exchange(self, action, mask):
+        """Batch version of `TinyCase.a_exchange`"""
+        for (oldv, newv), paths in action.iteritems():
+            for path in paths:
+                for parent, key in self._existing(path, mask):
+                    if parent[key] == oldv:
+                        parent[key] = newv
+
+    def b_format_str(self, action, mask):
+        """Batch version of `TinyCase.a_format_str`"""
+        for fmt, paths in action.iteritems():
+            for path in paths:
+                slots = self._existing(path, mask)
+                values = [fmt % parent[key] for parent, key in slots]
+                for (parent, key), value in zip(slots, values):
+                    parent[key] = value
+
+    def b_even_up(self, action, mask):
+        """Batch version of `TinyCase.a_even_up`"""
+        for patha, pathb in action:
+            for slot_a, slot_b in zip(self._slots(patha, mask),
+                                      self._slots(pathb, mask)):
+                if not (slot_a and slot_b):
+                    continue
+                a = slot_a[0][slot_a[1]]
+                b = slot_b[0][slot_b[1]]
+                for key in set(a.keys()) | set(b.keys()):
+                    if key in a and key in b:
+                        pass    # nothing to do here
+                    elif key in a and a[key] is None:
+                        b[key] = None
+                    elif key in b and b[key] is None:
+                        a[key] = None
+
+    def b_remove(self, action, mask):
+        """Batch version of `TinyCase.a_remove`"""
+        for path in action:
+            for parent, key in self._existing(path, mask):
+                del parent[key]
+
+    def b_round(self, action, mask):
+        """Batch version of `TinyCase.a_round`"""
+        for ndigits, paths in action.iteritems():
+            for path in paths:
+                slots = self._existing(path, mask)
+                values = [round(parent[key], ndigits) for parent, key in slots]
+                for (parent, key), value in zip(slots, values):
+                    parent[key] = value
+
+    batch_actions = {'remove': b_remove,
+                     'even_up': b_even_up,
+                     'format_str': b_format_str,
+                     'exchange': b_exchange,
+                     'round': b_round}
+
+    def hack(self, ruleset):
+        """Apply ruleset to all cases; return list of per-case match flags."""
+        matched = [False] * len(self.cases)
+        if not self.cases:
+            return matched
+        for rule in TinyCase.compile_ruleset(ruleset):
+            mask = [rule.matches(case) for case in self.cases]
+            if not any(mask):
+                continue
+            matched = [a or b for a, b in zip(matched, mask)]
+            self._apply(rule, mask)
+        return matched
+
+    def _apply(self, rule, mask):
+        """Apply actions of the rule to cases in mask"""
+        known_actions = self.cases[0].__class__.known_actions
+        for action_name in known_actions:
+            if action_name not in rule:
+                continue
+            if action_name in self.batch_actions:
+                self.batch_actions[action_name](self, rule[action_name], mask)
+            else:
+                for case, ok in zip(self.cases, mask):
+                    if ok:
+                        known_actions[action_name](case, rule[action_name])
+
+
+class SharedCaseBatch(CaseBatch):
+    """Batch of cases sharing driver data instead of copying them.
+
+    Cases made by `regression_test()` for one argset often share data:
+    e.g. when one oracle is compared to five results, all five cases
+    contain the same oracle data.  Rather than deep-copying the data into
+    each case, cases of this batch refer to the original data, and a copy
+    ("view") is only made when a rule is about to modify it.  The view is
+    then cached under a key composed of the data origin and the rules
+    applied so far, so that another case getting the same rules applied
+    on the same data just reuses it.
+
+    `keys` is list of dicts `{'oracle': key, 'result': key}` for each
+    case, where key is a hashable identifying the origin of the data
+    (e.g. tuple of argset number and driver class).
+
+    Only rules whose actions touch just "/oracle" or just "/result" paths
+    can share a view.  Other rules (e.g. evening up oracle with result
+    or actions without batch version) make both sides of the affected
+    case private copies, which are then hacked in place.
+
+    Number of copies made is kept in `copies` (and time spent making
+    them in `copy_ns`), number of times a cached view was reused in
+    `reused`.  Note that since data may be shared,
+    it must not be modified outside `hack()`; see `privatize()`.
+
+    Keeping track of the views has its cost, which only pays off when
+    the data are big and most of them are left untouched by the hacks
+    (e.g. rules limited to few drivers).  When most cases get hacked
+    anyway, pass `lazy=False`: all cases are then made private right
+    away and hacked in place as in `CaseBatch`.
+    """
+
+    SIDES = ('oracle', 'result')
+
+    _PRIVATE = object()
+
+    def __init__(self, cases, keys, lazy=True):
+        super(SharedCaseBatch, self).__init__(cases)
+        self.lazy = lazy
+        self.views = {}
+        self.copies = 0
+        self.copy_ns = 0
+        self.reused = 0
+        self._hacks = 0
+        if lazy:
+            self.keys = [dict(k) for k in keys]
+        else:
+            # same as privatize() on each case, minus the per-copy overhead
+            self.keys = [dict.fromkeys(self.SIDES, self._PRIVATE)
+                         for case in self.cases]
+            start = _clock.perf_ns()
+            for case in self.cases:
+                for side in self.SIDES:
+                    case[side] = deepcopy(case[side])
+            self.copy_ns = _clock.perf_ns() - start
+            self.copies = len(self.SIDES) * len(self.cases)
+
+    def _copy(self, data):
+        start = _clock.perf_ns()
+        data = deepcopy(data)
+        self.copy_ns += _clock.perf_ns() - start
+        self.copies += 1
+        return data
+
+    def _sides(self, rule):
+        """Return set of sides the rule modifies, or None if not separable."""
+        paths = []
+        for action_name, action in rule.iteritems():
+            if action_name not in self.cases[0].__class__.known_actions:
+                continue
+            if action_name not in self.batch_actions:
+                return None
+            if action_name == 'even_up':
+                paths.extend(action)
+            elif action_name == 'remove':
+                paths.extend([path] for path in action)
+            else:
+                paths.extend([path] for group in action.values()
+                             for path in group)
+        sides = set()
+        for group in paths:
+            group_sides = set(self._keys(path)[0] for path in group)
+            if len(group_sides) > 1 or not group_sides <= set(self.SIDES):
+                return None
+            sides |= group_sides
+        return sides
+
+    def privatize(self, n):
+        """Make sure case `n` holds its own copies of the data."""
+        case = self.cases[n]
+        for side in self.SIDES:
+            if self.keys[n][side] is not self._PRIVATE:
+                case[side] = self._copy(case[side])
+                self.keys[n][side] = self._PRIVATE
+
+    def hack(self, ruleset):
+        """Apply ruleset to all cases; return list of per-case match flags."""
+        if not self.lazy:
+            return super(SharedCaseBatch, self).hack(ruleset)
+        matched = [False] * len(self.cases)
+        # views are keyed by position of the rule, as the compiled
+        # rules (and their ids) live only during this call
+        self._hacks += 1
+        for rn, rule in enumerate(TinyCase.compile_ruleset(ruleset)):
+            mask = [rule.matches(case) for case in self.cases]
+            if not any(mask):
+                continue
+            matched = [a or b for a, b in zip(matched, mask)]
+            sides = self._sides(rule)
+            targets = []
+            for n, case in enumerate(self.cases):
+                if not mask[n]:
+                    continue
+                if sides is None:
+                    self.privatize(n)
+                    targets.append(case)
+                    continue
+                target = case.__class__((k, v) for k, v in case.iteritems()
+                                        if k not in self.SIDES)
+                for side in sides:
+                    key = self.keys[n][side]
+                    if key is self._PRIVATE:
+                        target[side] = case[side]
+                        continue
+                    key = (key, self._hacks, rn)
+                    if key in self.views:
+                        self.reused += 1
+                    else:
+                        self.views[key] = self._copy(case[side])
+                        target[side] = self.views[key]
+                    case[side] = self.views[key]
+                    self.keys[n][side] = key
+                targets.append(target)
+            CaseBatch(targets)._apply(rule, [True] * len(targets))
+        return matched
+
+
 # ########################################################################### #
 # ## Drivers                                                               ## #
 # ########################################################################### #
@@ -544,11 +1290,96 @@ class DriverDataError(Exception):
                   "  data: %s\n"
                   % (self.exception.__class__.__name__, self.exception,
                      self.driver.__class__.__name__,
-                     json.dumps(self.driver._args, sort_keys=True, indent=4),
-                     json.dumps(self.driver.data, sort_keys=True, indent=4)))
+                     json.dumps(self.driver._args, sort_keys=True, indent=4,
+                                default=_json_default),
+                     json.dumps(self.driver.data, sort_keys=True, indent=4,
+                                default=_json_default)))
         return result
 
 
+class Bailout(NotImplementedError):
+    """Raised when a driver bails out of an argset.
+
+    Carries the bailout function in `fn`; its source code, which used to
+    be the message, is only looked up when the exception is converted
+    to string (or `source` is asked for), since bailouts are expected
+    to fire very often.
+    """
+
+    def __init__(self, fn):
+        super(Bailout, self).__init__()
+        self.fn = fn
+
+    @property
+    def source(self):
+        fn = getattr(self.fn, 'fn', self.fn)
+        try:
+            return inspect.getsource(fn)
+        except (IOError, TypeError):
+            return repr(fn)
+
+    def __str__(self):
+        return self.source
+
+
+class MemoBailout(object):
+    """Bailout function with decisions memoized by values of some keys.
+
+    `fn` is called only once for each combination of values of `keys`
+    in argsets; the decision is then reused.  Useful for bailouts that
+    are expensive or evaluated for millions of argsets, but only correct
+    if `fn` reads nothing else than `keys` from the argset.  Argsets with
+    unhashable values of the keys are not memoized.
+
+    Use `hoover.bailout_reads()` to create instances.
+    """
+
+    def __init__(self, fn, keys):
+        self.fn = fn
+        self.keys = tuple(keys)
+        self.memo = {}
+
+    def __call__(self, args):
+        try:
+            key = tuple(args.get(k) for k in self.keys)
+            return self.memo[key]
+        except (AttributeError, TypeError):
+            return self.fn(args)
+        except KeyError:
+            decision = self.memo[key] = self.fn(args)
+            return decision
+
+
+def bailout_reads(*keys):
+    """Decorator declaring that bailout function reads only given keys.
+
+        class MyDriver(hoover.BaseTestDriver):
+
+            @hoover.bailout_reads('op', 'b')
+            def no_div_zero(args):
+                return args['op'] == 'div' and args['b'] == 0
+
+            bailouts = [no_div_zero]
+
+    The decision is then memoized, see `hoover.MemoBailout`.
+    """
+    def decorator(fn):
+        return MemoBailout(fn, keys)
+    return decorator
+
+
+class DriverTimeout(Exception):
+    """Driver call did not finish within timeout"""
+
+    def __init__(self, driver, timeout):
+        self.driver = driver
+        self.timeout = timeout
+
+    def __str__(self):
+        return ("DriverTimeout: %s did not finish within %ss"
+                % (self.driver.__class__.__name__, self.timeout))
+
+
 class BaseTestDriver(object):
     """Base class for test drivers used by `hoover.regression_test` and others.
 
@@ -561,6 +1392,17 @@ class BaseTestDriver(object):
     `self._get_data` method that sets `self.data`.  Any exception from this
     method will be re-raised as DriverError with additional information.
 
+    If the driver has a `throttle`, time spent waiting for it is stored
+    in `self.throttle_wait_ns` and not included in `self.duration`.
+
+    Duration is also stored in `self.duration_ns`, in integer nanoseconds;
+    if measured for you, it comes from a high-resolution clock (monotonic
+    where Python provides one).
+
+    Other timings you want tracked (e.g. time to first byte of a network
+    response) can be stored in `self.timings` dict, in seconds.  The
+    `hoover.regression_test` records their distribution per driver.
+
     Also, you can set self.duration (in fractional seconds, as returned by
     standard time module) in the _get_data method, but if you don't, it is
     measured for you as time the method call took.  This is useful if you
@@ -600,7 +1442,25 @@ class BaseTestDriver(object):
     *   set "bailouts", a list of functions which, when passed "args"
         argument, return true to indicate that driver is not able to
         process these values (see below for explanation).  If any of
-        these functions returns true, NotImplementedError is raised.
+        these functions returns true, `hoover.Bailout` (a cheap sub-class
+        of NotImplementedError) is raised.  Bailouts reading only few
+        keys of args can be memoized using `hoover.bailout_reads()`.
+
+    *   implement `_get_data_batch`, which gets a list of argsets and
+        returns list of raw data (what `_get_data` would set as
+        `self.data`), one per argset.  This is useful if the system can
+        process many argsets in one call (e.g. a bulk endpoint), and is
+        used by `hoover.regression_test` when `batch_size` is set; see
+        `run_batch()`.
+
+    *   implement `cancel()` to interrupt running `_get_data` when the
+        call times out (see "call_timeout" in `regression_test`).
+
+    *   set "throttle", a `bottleneck.Throttle` instance shared by all
+        instances of the driver class.  `run()` then waits for the
+        throttle before calling `_get_data`, and if the throttle
+        accepts feedback (like `bottleneck.AdaptiveThrottle`), it is
+        fed with `self.duration` and whether `_get_data` succeeded.
 
     The expected workflow when using the driver is:
 
@@ -629,6 +1489,7 @@ class BaseTestDriver(object):
     """
 
     bailouts = []
+    throttle = None
 
     ##
     #  internal methods
@@ -637,6 +1498,9 @@ class BaseTestDriver(object):
     def __init__(self):
         self.data = {}
         self.duration = None
+        self.duration_ns = None
+        self.throttle_wait_ns = 0
+        self.timings = {}
         self._args = {}
         self._mandatory_args = []
         self._mandatory_settings = []
@@ -656,6 +1520,11 @@ class BaseTestDriver(object):
             if key.startswith("_"):
                 del self.data[key]
 
+    def __feed_throttle(self, latency, ok=True):
+        """pass call outcome to adaptive throttle, if any"""
+        if hasattr(self.throttle, 'feedback'):
+            self.throttle.feedback(latency, ok=ok)
+
     ##
     #  virtual methods
     #
@@ -672,6 +1541,14 @@ class BaseTestDriver(object):
         """Preare data for comparison (e.g. sort, split, trim...)"""
         pass
 
+    def cancel(self):
+        """Called from other thread if `run()` takes too long
+
+        The instance is then abandoned, but the call can't be stopped
+        from outside.  Override to make it fail soon (e.g. close a socket
+        it waits on)."""
+        pass
+
     ##
     #  public methods
     #
@@ -681,7 +1558,7 @@ class BaseTestDriver(object):
         """check args in advance before running or setting up anything"""
         for fn in cls.bailouts:
             if fn(args):
-                raise NotImplementedError(inspect.getsource(fn))
+                raise Bailout(fn)
 
     def setup(self, settings, only_own=False):
         """Load settings. only_own means that only settings that belong to us
@@ -696,20 +1573,30 @@ class BaseTestDriver(object):
             self._settings = settings
         self._setup_ok = True
 
-    def run(self, args):
-        """validate, run and store data"""
-
-        self._args = args
-        assert self._setup_ok, "run() before setup()?"
-        self.__class__.check_values(self._args)
-        self.__check_mandatory()
-        start = time.time()
+    def __fetch(self, get_data):
+        """wait for throttle, call get_data and measure duration"""
+        if self.throttle is not None:
+            wait_start = _clock.perf_ns()
+            self.throttle.wait()
+            self.throttle_wait_ns = _clock.perf_ns() - wait_start
+        start = _clock.perf_ns()
         try:
-            self._get_data()        # run the test, i.e. obtain raw data
+            result = get_data()     # run the test, i.e. obtain raw data
         except StandardError as e:
+            self.__feed_throttle(_clock.ns2s(_clock.perf_ns() - start),
+                                 ok=False)
             raise DriverError(e, self)
-        self.duration = (time.time() - start if self.duration is None
-                         else self.duration)
+        elapsed = _clock.perf_ns() - start
+        if self.duration is None:
+            self.duration_ns = elapsed
+            self.duration = _clock.ns2s(elapsed)
+        else:
+            self.duration_ns = _clock.s2ns(self.duration)
+        self.__feed_throttle(self.duration)
+        return result
+
+    def __process(self):
+        """decode, normalize, check and clean up raw data"""
         try:
             self._decode_data()     # decode raw data
             self._normalize_data()  # normalize decoded data
@@ -718,6 +1605,49 @@ class BaseTestDriver(object):
             raise DriverDataError(e, self)
         self.__cleanup_data()   # cleanup (remove data['_*'])
 
+    def run(self, args):
+        """validate, run and store data"""
+
+        self._args = args
+        assert self._setup_ok, "run() before setup()?"
+        self.__class__.check_values(self._args)
+        self.__check_mandatory()
+        self.__fetch(self._get_data)
+        self.__process()
+
+    def run_batch(self, argsets):
+        """validate, run with all argsets at once, return list of drivers
+
+        Requires `_get_data_batch` to be implemented.  Returned is one new
+        driver instance per argset, holding data and duration as if `run()`
+        was called on it, except that the duration of the batch call is
+        split evenly among them.  The batch duration and throttle wait are
+        stored in this instance."""
+
+        assert self._setup_ok, "run_batch() before setup()?"
+        for args in argsets:
+            self._args = args
+            self.__class__.check_values(self._args)
+            self.__check_mandatory()
+        self._args = argsets
+        raw = self.__fetch(lambda: self._get_data_batch(argsets))
+        if len(raw) != len(argsets):
+            raise DriverError(ValueError("_get_data_batch returned %d results"
+                                         " for %d argsets"
+                                         % (len(raw), len(argsets))), self)
+        drivers = []
+        for args, data, duration_ns in zip(
+                argsets, raw, _apportion(self.duration_ns, len(argsets))):
+            d = self.__class__()
+            d.setup(self._settings)
+            d._args = args
+            d.data = data
+            d.duration_ns = duration_ns
+            d.duration = _clock.ns2s(duration_ns)
+            d.__process()
+            drivers.append(d)
+        return drivers
+
 
 class MockDriverTrue(BaseTestDriver):
     """A simple mock driver, always returning True"""
@@ -726,18 +1656,722 @@ class MockDriverTrue(BaseTestDriver):
         self.data = True
 
 
+class ProcessPoolError(IOError):
+    """Error communicating with a worker of `hoover.ProcessPool`"""
+
+
+class ProcessPool(object):
+    """Pool of long-running child processes answering requests.
+
+    Each worker is started with command `cmd` (a list, as for `subprocess`)
+    and is expected to read requests from its stdin and write responses
+    to its stdout, one JSON document per line, in the same order.  For
+    example, a minimal worker in Python could be:
+
+        import json, sys
+        for line in iter(sys.stdin.readline, ''):
+            args = json.loads(line)
+            print(json.dumps({'result': compute(args)}))
+            sys.stdout.flush()
+
+    Up to `size` requests can be served at once (from different threads).
+    A worker found dead before a request is silently restarted; if it
+    dies while serving a request, it's restarted as well, but the request
+    fails with `hoover.ProcessPoolError` (it might be the cause).  The
+    same happens if the worker answers with something else than a JSON
+    line (the protocol would be out of sync), or if it does not answer
+    within `timeout` seconds (if given).  This is also how a request
+    taking too long can be interrupted: pass `started` callback to
+    `request()` to learn which worker serves it and `kill()` the worker.
+    `kill()` does nothing to a worker not serving any request.
+    """
+
+    def __init__(self, cmd, size=1, timeout=None):
+        self.cmd = list(cmd)
+        self.size = size
+        self.timeout = timeout
+        self.restarts = 0
+        self._workers = []
+        self._busy = {}
+        self._lock = threading.Lock()
+        self._idle = Queue.Queue()
+        for _ in range(size):
+            worker = self._start()
+            self._workers.append(worker)
+            self._idle.put(worker)
+
+    def _start(self):
+        return subprocess.Popen(self.cmd, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, close_fds=True)
+
+    def _replace(self, worker):
+        self._stop(worker)
+        self.restarts += 1
+        new = self._start()
+        self._workers[self._workers.index(worker)] = new
+        return new
+
+    def _stop(self, worker):
+        for pipe in worker.stdin, worker.stdout:
+            try:
+                pipe.close()
+            except (IOError, OSError):
+                pass
+        if worker.poll() is None:
+            worker.terminate()
+        worker.wait()
+
+    def request(self, payload, started=None):
+        """Send payload to an idle worker, return decoded response.
+
+        If given, `started` is called with the worker before sending, and
+        with None when the worker is done with the request (before it can
+        serve another one)."""
+        worker = self._idle.get()
+        token = object()
+        served = None
+        try:
+            if worker.poll() is not None:
+                worker = self._replace(worker)
+            with self._lock:
+                self._busy[worker] = token
+            served = worker
+            if started:
+                started(worker)
+            timer = None
+            if self.timeout:
+                timer = threading.Timer(self.timeout, self._kill,
+                                        [worker, token])
+                timer.daemon = True
+                timer.start()
+            try:
+                worker.stdin.write(json.dumps(payload) + "\n")
+                worker.stdin.flush()
+                line = worker.stdout.readline()
+            except (IOError, OSError):
+                line = None
+            finally:
+                if timer:
+                    timer.cancel()
+            if not line:
+                worker = self._replace(worker)
+                raise ProcessPoolError("worker %s died serving request: %r"
+                                       % (self.cmd, payload))
+            try:
+                return json.loads(line)
+            except ValueError:
+                worker = self._replace(worker)
+                raise ProcessPoolError("worker %s sent invalid response"
+                                       " to request: %r" % (self.cmd, payload))
+        finally:
+            if served is not None:
+                if started:
+                    started(None)
+                with self._lock:
+                    del self._busy[served]
+            self._idle.put(worker)
+
+    def _kill(self, worker, token=None):
+        """Kill the worker if busy (with request of `token`, if given)"""
+        with self._lock:
+            if worker not in self._busy:
+                return
+            if token is not None and self._busy[worker] is not token:
+                return
+            if worker.poll() is None:
+                worker.kill()
+
+    def kill(self, worker):
+        """Kill the worker, failing request it is serving (if any)."""
+        self._kill(worker)
+
+    def close(self):
+        """Stop all workers."""
+        for worker in self._workers:
+            self._stop(worker)
+        self._workers = []
+
+
+class PersistentProcessDriver(BaseTestDriver):
+    """Driver testing a system run as a pool of persistent processes.
+
+    Instead of starting a new process for each argset (which can take
+    way more time than the actual computation), the system is started
+    once as a `hoover.ProcessPool` and fed with requests on its stdin.
+    Pools are shared by all instances of the driver class with the same
+    settings, and stopped at exit (or by calling `close_pools()`).
+
+    Settings:
+
+        cmd         - command to start the worker, list of strings or
+                      a string (without arguments)
+        pool_size   - number of workers, default 1
+        timeout     - seconds to wait for a response before the worker
+                      is killed and restarted, default no limit
+
+    By default, `self._args` is sent as the request and response is
+    stored in `self.data`, which can be then post-processed the usual
+    way (`_decode_data`, `_normalize_data`...).  Override
+    `_make_request()` to send something else.
+
+    On `cancel()`, the worker serving the request is killed (and replaced
+    by the pool).
+    """
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self):
+        super(PersistentProcessDriver, self).__init__()
+        self._mandatory_settings = ['cmd']
+        self._pool_used = None
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    @classmethod
+    def close_pools(cls):
+        """Stop all pools of all persistent process drivers."""
+        with cls._pools_lock:
+            for pool in PersistentProcessDriver._pools.values():
+                pool.close()
+            PersistentProcessDriver._pools.clear()
+
+    def _pool(self):
+        cmd = self._settings['cmd']
+        cmd = (cmd,) if isinstance(cmd, basestring) else tuple(cmd)
+        size = int(self._settings.get('pool_size', 1))
+        timeout = self._settings.get('timeout')
+        key = (self.__class__, cmd, size, timeout)
+        with self._pools_lock:
+            if key not in self._pools:
+                self._pools[key] = ProcessPool(cmd, size,
+                                               float(timeout) if timeout
+                                               else None)
+            return self._pools[key]
+
+    def _make_request(self):
+        """Return request payload for current argset"""
+        return self._args
+
+    def _get_data(self):
+        self._pool_used = self._pool()
+        self.data = self._pool_used.request(self._make_request(),
+                                            started=self._started)
+
+    def _started(self, worker):
+        with self._worker_lock:
+            self._worker = worker
+
+    def cancel(self):
+        with self._worker_lock:
+            if self._worker is not None:
+                self._pool_used.kill(self._worker)
+
+
+atexit.register(PersistentProcessDriver.close_pools)
+
+
+class HttpConnectionPool(object):
+    """Pool of keep-alive HTTP connections to one server.
+
+    At most `size` connections are open at once; `get()` blocks if all
+    of them are in use, so the pool also limits concurrency of requests
+    from multiple threads.  Connections closed by either side are
+    re-opened automatically by `httplib` on next request.
+    """
+
+    def __init__(self, scheme, host, port=None, size=1, timeout=None):
+        cls = (httplib.HTTPSConnection if scheme == 'https'
+               else httplib.HTTPConnection)
+        self._idle = Queue.Queue()
+        for _ in range(size):
+            self._idle.put(cls(host, port, timeout=timeout))
+
+    def get(self):
+        """Take a connection, waiting for one if all are in use."""
+        return self._idle.get()
+
+    def put(self, conn):
+        """Return the connection to the pool."""
+        self._idle.put(conn)
+
+
+class HttpTestDriver(BaseTestDriver):
+    """Driver testing a system over HTTP, with keep-alive connections.
+
+    Instead of opening new connection (and paying for TCP setup, and
+    eventually running out of ephemeral ports) per argset, connections
+    are kept in a `hoover.HttpConnectionPool` shared by all instances of
+    the driver class within the process.
+
+    Settings:
+
+        uri         - base URI of the service (mandatory)
+        timeout     - socket timeout in seconds, default 10
+        retries     - how many times to retry request after connection
+                      error (not HTTP error status), default 1, which
+                      also covers keep-alive connection closed by server
+        pool_size   - maximum number of connections (and concurrent
+                      requests), default 1
+
+    By default, GET request is made to the URI with `self._args` as query
+    string; override `_make_request()` to change that.  Response is
+    stored in `self.data` as hidden keys "_status", "_headers" and
+    "_body", so that they are available to `_decode_data` and others,
+    but removed before the data is compared.  Any status not in
+    `ok_statuses` is an error.
+
+    Apart from duration of the whole request, time to first byte (until
+    the response headers arrive) is stored in `self.timings['ttfb']`.
+
+    Pipelining is not supported, as `httplib` does not support it; use
+    `pool_size` for concurrent requests.
+
+    On `cancel()`, the connection in use is shut down, so that the
+    request fails (without retries).
+    """
+
+    ok_statuses = (200,)
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self):
+        super(HttpTestDriver, self).__init__()
+        self._mandatory_settings = ['uri']
+        self._conn = None
+        self._cancelled = False
+
+    def _pool(self):
+        parsed = urlparse.urlparse(self._settings['uri'])
+        key = (os.getpid(), self.__class__, parsed.scheme, parsed.hostname,
+               parsed.port, self._settings.get('pool_size', 1),
+               self._settings.get('timeout', 10))
+        with self._pools_lock:
+            if key not in self._pools:
+                self._pools[key] = HttpConnectionPool(
+                    parsed.scheme, parsed.hostname, parsed.port,
+                    size=int(key[5]), timeout=key[6])
+            return self._pools[key]
+
+    def _make_request(self):
+        """Return tuple of method, path (with query), body and headers"""
+        path = urlparse.urlparse(self._settings['uri']).path or '/'
+        query = urllib.urlencode(sorted(self._args.items()))
+        return ('GET', path + '?' + query if query else path, None, {})
+
+    def _get_data(self):
+        method, path, body, headers = self._make_request()
+        pool = self._pool()
+        retries = int(self._settings.get('retries', 1))
+        for attempt in range(retries + 1):
+            conn = self._conn = pool.get()
+            try:
+                if self._cancelled:
+                    raise IOError("request cancelled")
+                start = _clock.perf_ns()
+                conn.request(method, path, body, headers)
+                resp = conn.getresponse()
+                ttfb = _clock.perf_ns() - start
+                content = resp.read()
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                if attempt == retries or self._cancelled:
+                    raise IOError("%s: %s" % (e.__class__.__name__, e))
+            else:
+                break
+            finally:
+                self._conn = None
+                pool.put(conn)
+        self.timings['ttfb'] = _clock.ns2s(ttfb)
+        if resp.status not in self.ok_statuses:
+            raise ValueError("HTTP status %s %s" % (resp.status, resp.reason))
+        self.data['_status'] = resp.status
+        self.data['_headers'] = dict(resp.getheaders())
+        self.data['_body'] = content
+
+    def cancel(self):
+        self._cancelled = True
+        conn = self._conn
+        sock = conn.sock if conn is not None else None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class ResultStore(object):
+    """Append-only file of driver data keyed by argset, with an index.
+
+    Data are stored in file `fname` as JSON, one record per line; the
+    index, mapping digest of canonical JSON of each argset (see
+    `hoover.jsDigest()`) to position of the record, is kept in
+    `fname + ".idx"` and loaded to memory when the store is opened.
+    Records can be added at any time (also to existing store), and a later
+    record for the same argset replaces the earlier one.
+
+    Data are read through `mmap`, so lookup costs a dict lookup plus
+    decoding of just one record, and is bounded by disk speed.  Records
+    (or index entries) not completely written, e.g. due to a crash, are
+    ignored.
+
+    Use `recorder()` to create driver class that records data of another
+    driver, and `hoover.ReplayDriver` to serve them.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.index_fname = fname + '.idx'
+        self._index = {}
+        self._lock = threading.Lock()
+        self._map = None
+        self._data_fh = None
+        self._index_fh = None
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_fname):
+            return
+        size = os.path.getsize(self.fname) if os.path.exists(self.fname) else 0
+        with open(self.index_fname) as fh:
+            for line in fh:
+                try:
+                    key, offset, length = line.split()
+                    offset, length = int(offset), int(length)
+                except ValueError:
+                    continue
+                if offset + length <= size:
+                    self._index[key] = (offset, length)
+
+    @staticmethod
+    def key(argset):
+        """Return key of the argset in the store"""
+        key = jsDigest(argset)
+        if key is None:
+            raise ValueError("argset not JSON serializable: %r" % argset)
+        return key
+
+    def __contains__(self, argset):
+        return self.key(argset) in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def put(self, argset, data):
+        """Append data for the argset"""
+        key = self.key(argset)
+        record = json.dumps(data, sort_keys=True, separators=(',', ':'),
+                            default=_json_default)
+        with self._lock:
+            if self._data_fh is None:
+                self._data_fh = open(self.fname, 'ab')
+                self._index_fh = open(self.index_fname, 'ab')
+            self._data_fh.seek(0, os.SEEK_END)
+            offset = self._data_fh.tell()
+            self._data_fh.write(record + "\n")
+            self._data_fh.flush()
+            self._index_fh.write("%s %d %d\n" % (key, offset, len(record)))
+            self._index_fh.flush()
+            self._index[key] = (offset, len(record))
+
+    def get(self, argset):
+        """Return data for the argset; KeyError if not recorded"""
+        offset, length = self._index[self.key(argset)]
+        with self._lock:
+            if self._map is None or len(self._map) < offset + length:
+                if self._map is not None:
+                    self._map.close()
+                with open(self.fname, 'rb') as fh:
+                    self._map = mmap.mmap(fh.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+            record = self._map[offset:offset + length]
+        return json.loads(record)
+
+    def close(self):
+        """Close files; the store can still be used after that."""
+        with self._lock:
+            for fh in self._map, self._data_fh, self._index_fh:
+                if fh is not None:
+                    fh.close()
+            self._map = self._data_fh = self._index_fh = None
+
+    def recorder(self, driverClass):
+        """Return sub-class of driverClass recording its data here.
+
+        The sub-class has the same name, so that it gets the same
+        settings and stats."""
+        store = self
+
+        def run(self, args):
+            driverClass.run(self, args)
+            store.put(args, self.data)
+
+        def run_batch(self, argsets):
+            drivers = driverClass.run_batch(self, argsets)
+            for d in drivers:
+                store.put(d._args, d.data)
+            return drivers
+
+        return type(driverClass.__name__, (driverClass,),
+                    {'run': run, 'run_batch': run_batch})
+
+
+class ReplayDriver(BaseTestDriver):
+    """Driver serving data recorded in a `hoover.ResultStore`.
+
+    Useful to replace slow or rarely available system (e.g. an oracle)
+    with data recorded from it:
+
+        store = hoover.ResultStore('oracle.jsonl')
+        hoover.regression_test(argsrc, [(operator.eq,
+                                         store.recorder(OracleDriver),
+                                         ResultDriver)], settings)
+
+        class OracleReplay(hoover.ReplayDriver):
+            pass
+
+        settings['OracleReplay.store'] = 'oracle.jsonl'
+        hoover.regression_test(argsrc, [(operator.eq, OracleReplay,
+                                         ResultDriver)], settings)
+
+    Settings:
+
+        store   - path to the store file
+
+    Stores are opened once per path and shared.  Argsets not found in the
+    store cause `DriverError`; to skip them instead, use a bailout, e.g.
+    `lambda args: args not in hoover.ReplayDriver.open_store(path)`.
+    """
+
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self):
+        super(ReplayDriver, self).__init__()
+        self._mandatory_settings = ['store']
+
+    @classmethod
+    def open_store(cls, fname):
+        """Return shared `hoover.ResultStore` for the path."""
+        with cls._stores_lock:
+            if fname not in ReplayDriver._stores:
+                ReplayDriver._stores[fname] = ResultStore(fname)
+            return ReplayDriver._stores[fname]
+
+    def _get_data(self):
+        self.data = self.open_store(self._settings['store']).get(self._args)
+
+
 # ########################################################################### #
 # ## Helpers                                                               ## #
 # ########################################################################### #
 
+class DriverLimits(object):
+    """Rate and concurrency limits for calls of one driver class.
+
+    `max_rps` is maximum number of calls per second (can be fractional,
+    e.g. 0.5 for one call per two seconds), `max_concurrency` maximum
+    number of calls in progress at the same time, and `timeout` maximum
+    time in seconds a call can take (see `regression_test()`).  Any can
+    be `None` to impose no limit.
+
+    The engine calls `acquire()` before each call of the driver and
+    `release()` after it ends; for a call abandoned after timeout that
+    is only when the call actually returns.  One instance can be shared
+    by threads: callers pass the rate limit one at a time.
+    """
+
+    def __init__(self, max_rps=None, max_concurrency=None, timeout=None):
+        self.throttle = None
+        self.semaphore = None
+        self.timeout = float(timeout) if timeout else None
+        if max_rps:
+            if max_rps >= 1:
+                self.throttle = bottleneck.Throttle(max_rps, 1)
+            else:
+                self.throttle = bottleneck.Throttle(1, 1.0 / max_rps)
+        if max_concurrency:
+            self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()   # Throttle is not thread-safe
+
+    def __nonzero__(self):
+        return bool(self.throttle or self.semaphore or self.timeout)
+
+    @classmethod
+    def from_settings(cls, dclass, driver_settings):
+        """Create from "DriverName.max_rps", "DriverName.max_concurrency"
+        and "DriverName.call_timeout" keys in `driver_settings`"""
+        dname = dclass.__name__
+        return cls(max_rps=driver_settings.get(dname + '.max_rps'),
+                   max_concurrency=driver_settings.get(
+                       dname + '.max_concurrency'),
+                   timeout=driver_settings.get(dname + '.call_timeout'))
+
+    def acquire(self):
+        """Block until call is permitted; return nanoseconds spent waiting."""
+        start = _clock.perf_ns()
+        if self.throttle:
+            with self._lock:
+                self.throttle.wait()
+        if self.semaphore:
+            self.semaphore.acquire()
+        return _clock.perf_ns() - start
+
+    def release(self):
+        """Mark the call as finished."""
+        if self.semaphore:
+            self.semaphore.release()
+
+
+class LatencyHistogram(object):
+    """Histogram of latencies in logarithmic buckets.
+
+    Similar to HDR histogram, values (in seconds) are counted in buckets
+    whose width grows with the value, so that each value is known with
+    relative error of at most `precision` (1 % by default) while the
+    number of buckets stays bounded no matter how many values are
+    recorded.  Values under `min_value` all fall into the first bucket.
+
+    Histograms can be combined with `merge()`, e.g. to sum up results
+    from several workers.
+    """
+
+    def __init__(self, min_value=1e-6, precision=0.01):
+        self.min_value = min_value
+        self.precision = precision
+        self.buckets = {}
+        self.count = 0
+        self.max = None
+        self._log_base = math.log(1 + precision)
+
+    def _index(self, value):
+        if value <= self.min_value:
+            return 0
+        return 1 + int(math.log(value / self.min_value) / self._log_base)
+
+    def _value(self, index):
+        return self.min_value * (1 + self.precision) ** index
+
+    def record(self, value):
+        """Count one value."""
+        idx = self._index(value)
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+        self.count += 1
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """Add counts from other histogram to self; return self."""
+        if (other.min_value, other.precision) != (self.min_value,
+                                                  self.precision):
+            raise ValueError("cannot merge histograms with different"
+                             " buckets")
+        for idx, n in other.buckets.iteritems():
+            self.buckets[idx] = self.buckets.get(idx, 0) + n
+        self.count += other.count
+        if other.max is not None:
+            self.max = (other.max if self.max is None
+                        else max(self.max, other.max))
+        return self
+
+    def percentile(self, pct):
+        """Return value under which `pct` percent of values fall."""
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(self.count * pct / 100.0)))
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen >= rank:
+                return min(self._value(idx), self.max)
+
+
+class Warmup(object):
+    """Tell warm-up calls of a driver from steady state ones.
+
+    First calls to a system (JIT-compiled, with cold caches...) can be
+    way slower than the rest; timing them together would skew means and
+    make them incomparable between runs.  This class is fed with duration
+    of each call (in seconds) and tells whether the call is still part of
+    the warm-up.
+
+    The first `calls` calls are always warm-up.  With `window`, warm-up
+    then lasts until the latency stabilises, i.e. until median of last
+    `window` durations differs from median of `window` durations before
+    them by at most `tolerance` (relative).  Warm-up never takes more
+    than `max_calls` calls, even if the latency does not stabilise.
+
+    Each driver needs its own instance; use `copy()` to get a fresh one
+    with the same criteria.
+    """
+
+    def __init__(self, calls=0, window=None, tolerance=0.1, max_calls=1000):
+        self.calls = calls
+        self.window = window
+        self.tolerance = tolerance
+        self.max_calls = max_calls
+        self.seen = 0
+        self.done = not calls and not window
+        self._recent = collections.deque(maxlen=2 * window if window else 0)
+
+    def copy(self):
+        """Return fresh instance with the same criteria."""
+        return Warmup(self.calls, self.window, self.tolerance,
+                      self.max_calls)
+
+    @staticmethod
+    def _median(values):
+        values = sorted(values)
+        return values[len(values) // 2]
+
+    def _stable(self):
+        if len(self._recent) < self._recent.maxlen:
+            return False
+        recent = list(self._recent)
+        older = self._median(recent[:self.window])
+        newer = self._median(recent[self.window:])
+        return abs(newer - older) <= self.tolerance * older
+
+    def update(self, duration):
+        """Count call of `duration`; return true if it is warm-up."""
+        if self.done:
+            return False
+        self.seen += 1
+        if self.window:
+            self._recent.append(duration)
+        if self.seen > self.calls and (not self.window or self._stable()):
+            self.done = True
+        elif self.seen > self.max_calls:
+            self.done = True
+        return not self.done
+
+
 class StatCounter(object):
-    """A simple counter with formulas support."""
+    """A simple counter with formulas support.
+
+    Apart from sums, distribution of values can be tracked using
+    `record_for()`: percentiles p50, p90, p99 and maximum of each
+    such value are then included in `all_stats()` (in ms, like other
+    times).
+
+    Times are expected to be added as integer nanoseconds (recorded into
+    histograms as seconds); computed stats are in milliseconds, rounded
+    to microseconds.
+
+    Durations of warm-up calls (see `hoover.Warmup`) are added as
+    "warmup_duration" and counted as "warmup_calls" (in addition to
+    "calls"), so that "duration" and "duration_per_call" only describe
+    the steady state.
+    """
+
+    PERCENTILES = (50, 90, 99)
 
     def __init__(self):
         self.generic_stats = {}
         self.driver_stats = {}
+        self.histograms = {}
         self.formulas = {}
-        self._born = time.time()
+        self._born = _clock.perf_ns()
 
     def _register(self, dname):
         self.driver_stats[dname] = {
@@ -745,45 +2379,72 @@ class StatCounter(object):
             'rhacks': 0,
             'ohacks': 0,
             'duration': 0,
-            'overhead': 0
+            'overhead': 0,
+            'throttle_wait': 0,
+            'warmup_calls': 0,
+            'warmup_duration': 0
         }
 
         ##
         # Formulas
         #
 
-        # cumulative duration/overhead; just round to ms
+        # cumulative duration/overhead; ns to ms
         self.add_formula(dname + '_overhead',
-                         lambda g, d: int(1000 * d[dname]['overhead']))
+                         lambda g, d: _clock.ns2ms(d[dname]['overhead']))
         self.add_formula(dname + '_duration',
-                         lambda g, d: int(1000 * d[dname]['duration']))
+                         lambda g, d: _clock.ns2ms(d[dname]['duration']))
+        self.add_formula(dname + '_throttle_wait',
+                         lambda g, d: _clock.ns2ms(d[dname]['throttle_wait']))
+        self.add_formula(
+            dname + '_warmup_duration',
+            lambda g, d: _clock.ns2ms(d[dname]['warmup_duration'])
+        )
 
         # average (per driver call) overhead/duration
         self.add_formula(
             dname + '_overhead_per_call',
-            lambda g, d: int(1000 * d[dname]['overhead'] / d[dname]['calls'])
+            lambda g, d: _clock.ns2ms(d[dname]['overhead'] / d[dname]['calls'])
         )
         self.add_formula(
             dname + '_duration_per_call',
-            lambda g, d: int(1000 * d[dname]['duration'] / d[dname]['calls'])
+            lambda g, d: _clock.ns2ms(d[dname]['duration']
+                                      / (d[dname]['calls']
+                                         - d[dname]['warmup_calls']))
         )
+        self.add_formula(
+            dname + '_warmup_duration_per_call',
+            lambda g, d: _clock.ns2ms(d[dname]['warmup_duration']
+                                      / d[dname]['warmup_calls'])
+        )
+
+        def drivertime_ns(d):
+            return (sum(s['overhead'] for s in d.values())
+                    + sum(s['duration'] for s in d.values())
+                    + sum(s['warmup_duration'] for s in d.values()))
 
-        def gtotal_drivertime(g, d):
-            driver_time = (sum(s['overhead'] for s in d.values())
-                           + sum(s['duration'] for s in d.values()))
-            return int(1000 * driver_time)
+        def throttle_wait_ns(d):
+            return sum(s['throttle_wait'] for s in d.values())
 
         def gtotal_loop_overhead(g, d):
-            driver_time = gtotal_drivertime(g, d)
-            onnext_time = int(1000 * g['on_next'])
-            age = int(1000 * (time.time() - self._born))
-            return age - driver_time - onnext_time
+            age = _clock.perf_ns() - self._born
+            return _clock.ns2ms(age - drivertime_ns(d) - throttle_wait_ns(d)
+                                - g['on_next'])
 
         # grand totals in times: driver time, loop overhead
-        self.add_formula('gtotal_drivertime', gtotal_drivertime)
+        self.add_formula('gtotal_drivertime',
+                         lambda g, d: _clock.ns2ms(drivertime_ns(d)))
+        self.add_formula('gtotal_throttle_wait',
+                         lambda g, d: _clock.ns2ms(throttle_wait_ns(d)))
         self.add_formula('gtotal_loop_overhead', gtotal_loop_overhead)
         self.add_formula('gtotal_loop_onnext',
-                         lambda g, d: int(1000 * g['on_next']))
+                         lambda g, d: _clock.ns2ms(g['on_next']))
+
+        # data copies saved by sharing them among cases
+        self.add_formula(
+            'copies_avoided',
+            lambda g, d: 2 * g.get('cases', 0) - g.get('copies', 0)
+        )
 
         # average (per driver call) overhead/duration
         self.add_formula(
@@ -822,6 +2483,13 @@ class StatCounter(object):
         else:
             self.driver_stats[dname][vname] = value
 
+    def record_for(self, dclass, vname, value):
+        """Record a value into driver histogram."""
+        key = (dclass.__name__, vname)
+        if key not in self.histograms:
+            self.histograms[key] = LatencyHistogram()
+        self.histograms[key].record(value)
+
     def count(self, vname):
         """Alias to add(vname, 1)"""
         self.add(vname, 1)
@@ -836,10 +2504,398 @@ class StatCounter(object):
         for dname, dstats in self.driver_stats.iteritems():
             for key, value in dstats.iteritems():
                 stats[dname + "_" + key] = value
+        for (dname, vname), hist in self.histograms.iteritems():
+            prefix = "%s_%s_" % (dname, vname)
+            for pct in self.PERCENTILES:
+                stats[prefix + "p%d" % pct] = round(
+                    1000 * hist.percentile(pct), 3)
+            stats[prefix + "max"] = round(1000 * hist.max, 3)
         stats.update(self._computed_stats())
         return stats
 
 
+class ProgressReporter(object):
+    """Periodic progress reports for long `regression_test` runs.
+
+    Every `interval` seconds, a report is composed as a dict containing:
+
+        elapsed         - seconds since start
+        argsets         - argsets done so far
+        total           - total argsets (None if source is not sized)
+        argsets_per_sec - overall throughput
+        cases_per_sec   - ditto for cases (comparisons)
+        eta             - estimated seconds to go (None if unknown)
+        distinct_errors - distinct errors found so far
+        latency_ms      - dict with mean duration per call by driver
+                          (leaving out warm-up calls)
+
+    The report is passed to `callback` and/or appended as a JSON line
+    to file `fname`.  One last report (with `final` set to True) is
+    made when the test finishes.
+
+    Only a clock check is made per argset, the report itself is composed
+    once per interval, so the cost is negligible even for fast drivers.
+    """
+
+    def __init__(self, callback=None, fname=None, interval=10):
+        self.callback = callback
+        self.fname = fname
+        self.interval = interval
+        self.total = None
+        self._start = None
+        self._next = None
+
+    def _emit(self, report):
+        if self.callback:
+            self.callback(report)
+        if self.fname:
+            with open(self.fname, 'a') as fh:
+                fh.write(json.dumps(report, sort_keys=True) + "\n")
+
+    def start(self, total=None):
+        """Start measuring; `total` is total number of argsets, if known."""
+        self.total = total
+        self._start = _clock.monotonic()
+        self._next = self._start + self.interval
+
+    def update(self, tracker, counter):
+        """Report if interval has passed; called after each argset."""
+        now = _clock.monotonic()
+        if now >= self._next:
+            self._next = now + self.interval
+            self._emit(self.report(tracker, counter, now))
+
+    def finish(self, tracker, counter):
+        """Make the final report."""
+        report = self.report(tracker, counter)
+        report['final'] = True
+        self._emit(report)
+
+    def report(self, tracker, counter, now=None):
+        """Compose progress report from `Tracker` and `StatCounter`."""
+        elapsed = (now or _clock.monotonic()) - self._start
+        argsets = tracker.argsets_done
+        aps = argsets / elapsed if elapsed else None
+        eta = None
+        if self.total is not None and aps:
+            eta = max(0, self.total - argsets) / aps
+        return {
+            'elapsed': elapsed,
+            'argsets': argsets,
+            'total': self.total,
+            'argsets_per_sec': aps,
+            'cases_per_sec': (counter.generic_stats.get('cases', 0) / elapsed
+                              if elapsed else None),
+            'eta': eta,
+            'distinct_errors': len(tracker._db),
+            # warm-up calls are not in 'duration'
+            'latency_ms': dict(
+                (dname, _clock.ns2ms(ds['duration']
+                                     / (ds['calls'] - ds['warmup_calls'])))
+                for dname, ds in counter.driver_stats.iteritems()
+                if ds['calls'] > ds['warmup_calls']
+            ),
+        }
+
+
+class ChromeTraceExporter(object):
+    """Trace listener collecting events in Chrome trace-event format.
+
+    Pass instance in `listeners` argument to `regression_test` and
+    after the test, save the trace using `write()`.  The file can
+    then be opened in a trace viewer such as chrome://tracing or
+    Perfetto UI.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._pid = os.getpid()
+
+    def __call__(self, name, phase, ts, args=None):
+        event = {
+            'name': name,
+            'cat': 'hoover',
+            'ph': phase,
+            'ts': int(ts * 1000000),
+            'pid': self._pid,
+            'tid': threading.current_thread().ident,
+        }
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def write(self, fname):
+        """Write collected events as JSON to file `fname`."""
+        with open(fname, 'w') as fh:
+            json.dump({'traceEvents': self.events}, fh)
+
+
+class RunProfiler(object):
+    """Profiler for `regression_test()` runs.
+
+    Pass instance as `profile` argument to `regression_test()`.  During
+    the run, the engine is profiled using `cProfile`, and with
+    `per_driver`, calls of each driver class are profiled separately,
+    so that drivers don't clutter up the engine profile and vice-versa.
+
+    For lower overhead, set `sampling_interval` (in seconds): instead
+    of cProfile, a thread then periodically samples stack of the thread
+    running the test, and the samples are kept as collapsed stacks
+    (format used by flame graph tools).
+
+    After the run, `write()` saves "engine.pstats" and "DriverName.pstats"
+    (or ".collapsed" files) to given directory.  Time spent in each stage
+    of the loop is available from `stage_stats()` (in ns) and is also
+    added to the stats by `regression_test()`.
+
+    Only the thread running `regression_test()` is profiled.  Drivers
+    with "call_timeout" run in helper threads (see `hoover.DriverLimits`),
+    so their code is missing from the profiles; their time still counts
+    in the "drivers" stage.
+    """
+
+    ENGINE = 'engine'
+
+    def __init__(self, per_driver=True, sampling_interval=None):
+        self.per_driver = per_driver
+        self.sampling_interval = sampling_interval
+        self.profiles = {}
+        self.samples = {}
+        self._stage_ns = {}
+        self._started = {}
+        self._owner = self.ENGINE
+        self._run_ns = 0
+        self._start_ns = None
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def _profile_for(self, owner):
+        if owner not in self.profiles:
+            self.profiles[owner] = cProfile.Profile()
+        return self.profiles[owner]
+
+    def _switch(self, owner):
+        if not self.sampling_interval:
+            self._profile_for(self._owner).disable()
+            self._profile_for(owner).enable()
+        self._owner = owner
+
+    def _sample(self, ident):
+        while not self._stopped.wait(self.sampling_interval):
+            frame = sys._current_frames().get(ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s:%s" % (os.path.basename(code.co_filename),
+                                        code.co_name))
+                frame = frame.f_back
+            owner = self.samples.setdefault(self._owner,
+                                            collections.Counter())
+            owner[";".join(reversed(stack))] += 1
+
+    def start(self):
+        """Start profiling; called by `regression_test()`."""
+        self._start_ns = _clock.perf_ns()
+        self._owner = self.ENGINE
+        if self.sampling_interval:
+            self._stopped.clear()
+            self._sampler = threading.Thread(
+                target=self._sample, args=(threading.current_thread().ident,))
+            self._sampler.daemon = True
+            self._sampler.start()
+        else:
+            self._profile_for(self.ENGINE).enable()
+
+    def stop(self):
+        """Stop profiling; called by `regression_test()`."""
+        if self.sampling_interval:
+            self._stopped.set()
+            self._sampler.join()
+        else:
+            self._profile_for(self._owner).disable()
+        self._run_ns += _clock.perf_ns() - self._start_ns
+
+    def __call__(self, name, phase, ts, args=None):
+        if phase == 'B':
+            self._started[name] = _clock.s2ns(ts)
+            if self.per_driver and name.startswith('call:'):
+                self._switch(name[5:])
+        else:
+            self.add_stage(name, _clock.s2ns(ts) - self._started.pop(name))
+            if self.per_driver and name.startswith('call:'):
+                self._switch(self.ENGINE)
+
+    def add_stage(self, stage, ns):
+        """Add time in ns to a stage."""
+        self._stage_ns[stage] = self._stage_ns.get(stage, 0) + ns
+
+    def stage_stats(self):
+        """Return dict with time spent in each stage in ns.
+
+        Driver calls are summed up as "drivers", time not attributed
+        to any stage is "other"."""
+        stats = {'drivers': 0}
+        for stage, ns in self._stage_ns.iteritems():
+            if stage.startswith('call:'):
+                stats['drivers'] += ns
+            elif stage != 'argset':
+                stats[stage] = ns
+        stats['other'] = self._run_ns - sum(stats.values())
+        return stats
+
+    def write(self, prefix='.'):
+        """Write profiles to directory `prefix`; return list of paths."""
+        paths = []
+        for owner, prof in self.profiles.iteritems():
+            path = os.path.join(prefix, owner + '.pstats')
+            prof.dump_stats(path)
+            paths.append(path)
+        for owner, stacks in self.samples.iteritems():
+            path = os.path.join(prefix, owner + '.collapsed')
+            with open(path, 'w') as fh:
+                for stack, count in sorted(stacks.iteritems()):
+                    fh.write("%s %d\n" % (stack, count))
+            paths.append(path)
+        return sorted(paths)
+
+
+def _memory():
+    """Return tuple of current and peak memory use in bytes.
+
+    Uses `tracemalloc` if it is tracing, otherwise the resident set size
+    of the process (current from /proc, where available).  The latter
+    means a `getrusage()` call and reading /proc/self/statm each time."""
+    if tracemalloc and tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()
+    current = peak = 0
+    if resource:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open('/proc/self/statm') as fh:
+            current = int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        current = peak
+    return current, max(current, peak)
+
+
+class MemoryAccountant(object):
+    """Memory accounting for long `regression_test()` runs.
+
+    Pass instance as `memory` argument to `regression_test()`.  Memory
+    in use is then measured at start and end of each stage of the loop
+    (see `listeners` in `regression_test()`), and for each stage ("hacks",
+    "match", "cleanup", "diff", "tracker", and "call:DriverName" for each
+    driver class), total growth (memory still allocated after the stage, e.g.
+    argsets kept by `Tracker`) and the highest peak (temporary memory
+    needed by the stage) are kept.  They are added to the stats as
+    "mem_<stage>_growth" and "mem_<stage>_peak" (driver stages named
+    after the driver class), in bytes, along with "mem_current" and
+    "mem_peak" for the whole process.
+
+    Memory is measured using `tracemalloc` where available (Python 3.4+);
+    it is started with `frames` frames of traceback, unless already
+    tracing.  Then, each `interval` argsets, a snapshot is taken and
+    compared to the previous one, and `top` source lines that allocated
+    most memory in between are stored in `growth` (see `format_report()`).
+
+    Without `tracemalloc`, resident set size of the process is used,
+    which is much coarser and does not allow for the snapshots.
+    Still, at each interval, current and peak memory use is appended to
+    `samples`, so that steady growth can be spotted.
+
+    Note that memory is measured at every begin and end event, that is
+    several times per argset and twice per driver call.  Without
+    `tracemalloc`, each measurement is a `getrusage()` call and a read
+    of /proc/self/statm (around 10 microseconds), which can noticeably
+    slow down runs with fast drivers.
+    """
+
+    def __init__(self, interval=1000, top=10, frames=1):
+        self.interval = interval
+        self.top = top
+        self.frames = frames
+        self.stages = {}
+        self.samples = []
+        self.growth = []
+        self._begin = {}
+        self._argsets = 0
+        self._next_sample = interval
+        self._snapshot = None
+        self._started_tracing = False
+
+    def _take_snapshot(self):
+        if tracemalloc and tracemalloc.is_tracing():
+            return tracemalloc.take_snapshot()
+
+    def start(self):
+        """Start accounting; called by `regression_test()`."""
+        if tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        self._snapshot = self._take_snapshot()
+        self.sample()
+
+    def stop(self):
+        """Stop accounting; called by `regression_test()`."""
+        self.sample()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def sample(self):
+        """Record current memory use and growth since last sample."""
+        current, peak = _memory()
+        self.samples.append((self._argsets, current, peak))
+        snapshot = self._take_snapshot()
+        if snapshot and self._snapshot:
+            diffs = snapshot.compare_to(self._snapshot, 'lineno')
+            self.growth.append((self._argsets, [
+                (str(d.traceback), d.size_diff, d.count_diff)
+                for d in diffs[:self.top] if d.size_diff > 0
+            ]))
+        self._snapshot = snapshot
+
+    def __call__(self, name, phase, ts, args=None):
+        current, peak = _memory()
+        if phase == 'B':
+            self._begin[name] = (current, peak,
+                                 args.get('size', 1) if args else 1)
+            return
+        begin, begin_peak, size = self._begin.pop(name)
+        stage = self.stages.setdefault(name, {'growth': 0, 'peak': 0})
+        stage['growth'] += current - begin
+        if peak > begin_peak:
+            stage['peak'] = max(stage['peak'], peak - begin)
+        if name == 'argset':
+            self._argsets += size
+            if self._argsets >= self._next_sample:
+                self._next_sample += self.interval
+                self.sample()
+
+    def getstats(self):
+        """Return stats as dict."""
+        current, peak = _memory()
+        stats = {'mem_current': current, 'mem_peak': peak}
+        for name, stage in self.stages.iteritems():
+            if name.startswith('call:'):
+                name = name[5:]
+            stats['mem_%s_growth' % name] = stage['growth']
+            stats['mem_%s_peak' % name] = stage['peak']
+        return stats
+
+    def format_report(self):
+        """Return memory samples and growth as string."""
+        lines = ["memory use (argsets: current, peak):"]
+        for argsets, current, peak in self.samples:
+            lines.append("  %d: %d, %d" % (argsets, current, peak))
+        for argsets, diffs in self.growth:
+            lines.append("top growth until %d argsets:" % argsets)
+            for where, size_diff, count_diff in diffs:
+                lines.append("  %s: +%d B (+%d blocks)"
+                             % (where, size_diff, count_diff))
+        return "\n".join(lines)
+
+
 class Tracker(dict):
     """Error tracker to allow for usable reports from huge regression tests.
 
@@ -877,6 +2933,11 @@ class Tracker(dict):
             named as first 7 chars of its SHA1 (inspired by Git).
 
             Note that you need to pass an existing writable folder path.
+
+    Performance errors (argsets where a driver was too slow compared to
+    another one) are tracked separately using `update_perf()`, and have
+    their own EIDs, stats, section in `format_report()` and CSV export
+    in `write_perf_csv()`.
     """
 
     ##
@@ -884,8 +2945,10 @@ class Tracker(dict):
     #
 
     def __init__(self):
-        self._start = time.time()
+        self._start = _clock.monotonic()
         self._db = {}
+        self._perf_db = {}
+        self.perf_summary = {}
         self.tests_done = 0
         self.tests_passed = 0
         self.argsets_done = 0
@@ -905,9 +2968,13 @@ class Tracker(dict):
             self._db[errstr] = []
         self._db[errstr].append(argset)
 
-    def _format_error(self, errstr, max_aa=0):
+    def _format_error(self, errstr, max_aa=0, perf=False):
         """Format single error for output."""
-        argsets_affected = self._db[errstr]
+        if perf:
+            argsets_affected = ["%s %s" % (argset, durations)
+                                for argset, durations in self._perf_db[errstr]]
+        else:
+            argsets_affected = self._db[errstr]
         num_aa = len(argsets_affected)
 
         # trim if list is too long for Jenkins
@@ -919,10 +2986,11 @@ class Tracker(dict):
 
         # format error
         formatted_aa = "\n".join([str(arg) for arg in argsets_shown])
-        return ("~~~ ERROR FOUND (%s) ~~~~~~~~~~~~~~~~~~~~~~~~~\n"
+        return ("~~~ %s FOUND (%s) ~~~~~~~~~~~~~~~~~~~~~~~~~\n"
                 "--- error string: -----------------------------------\n%s\n"
                 "--- argsets affected (%d) ---------------------------\n%s\n"
-                % (self._eid(errstr), errstr, num_aa, formatted_aa))
+                % ("PERFORMANCE ERROR" if perf else "ERROR",
+                   self._eid(errstr), errstr, num_aa, formatted_aa))
 
     ##
     #  public methods
@@ -936,11 +3004,25 @@ class Tracker(dict):
         """Return complete report formatted as string."""
         error_list = "\n".join([self._format_error(e, max_aa=max_aa)
                                 for e in self._db])
-        return ("Found %(total_errors)s (%(distinct_errors)s distinct) errors"
-                " in %(tests_done)s tests with %(argsets)s argsets"
-                " (duration: %(time)ss):"
-                % self.getstats()
-                + "\n\n" + error_list)
+        report = ("Found %(total_errors)s (%(distinct_errors)s distinct)"
+                  " errors in %(tests_done)s tests with %(argsets)s argsets"
+                  " (duration: %(time)ss):"
+                  % self.getstats()
+                  + "\n\n" + error_list)
+        if self._perf_db or self.perf_summary:
+            perf_list = "\n".join([self._format_error(e, max_aa=max_aa,
+                                                      perf=True)
+                                   for e in self._perf_db])
+            summary = "\n".join(["%s: %s ratio %.3f"
+                                 % ("FAIL" if s['slower'] else "ok", e,
+                                    s['ratio'] or 0)
+                                 for e, s
+                                 in sorted(self.perf_summary.items())])
+            report += ("\nFound %(perf_errors)s (%(distinct_perf_errors)s"
+                       " distinct) performance errors:"
+                       % self.getstats()
+                       + "\n\n" + summary + "\n\n" + perf_list)
+        return report
 
     def getstats(self):
         """Return basic and driver stats
@@ -953,17 +3035,21 @@ class Tracker(dict):
             total_errors - how many times `Tracker.update()` saw an
                            error, i.e. how many argsets are in DB
             time         - how long since init (seconds)
+            distinct_perf_errors, perf_errors - same as above for
+                           performance errors
         """
 
-        def total_errors():
-            return reduce(lambda x, y: x + len(y), self._db.values(), 0)
+        def total_errors(db):
+            return reduce(lambda x, y: x + len(y), db.values(), 0)
 
         stats = {
             "argsets": self.argsets_done,
             "tests_done": self.tests_done,
             "distinct_errors": len(self._db),
-            "total_errors": total_errors(),
-            "time": int(time.time() - self._start)
+            "total_errors": total_errors(self._db),
+            "distinct_perf_errors": len(self._perf_db),
+            "perf_errors": total_errors(self._perf_db),
+            "time": int(_clock.monotonic() - self._start)
         }
         stats.update(self.driver_stats)
         return stats
@@ -976,9 +3062,34 @@ class Tracker(dict):
         sorting and analysis.
         """
         self.tests_done += 1
+        if error:
+            self.add_error(error, argset)
+
+    def add_error(self, error, argset):
+        """Record error of argset that is not a test result.
+
+        Like `update()` with an error, but `tests_done` is left alone,
+        e.g. for a driver call that timed out, so that no test was made.
+        """
+        self._insert(str(error), argset)
+
+    def update_perf(self, error, argset, durations=None):
+        """Update tracker with performance test result.
+
+        Works like `update()`, except that the argset is inserted to
+        separate DB of performance errors, optionally along with dict
+        of driver durations (keyed by driver name) to be included in
+        report and CSV.
+        """
         if error:
             errstr = str(error)
-            self._insert(errstr, argset)
+            if errstr not in self._perf_db:
+                self._perf_db[errstr] = []
+            self._perf_db[errstr].append((argset, durations or {}))
+
+    def perf_errors_found(self):
+        """Return true if any performance error was recorded."""
+        return bool(self._perf_db)
 
     def write_stats_csv(self, fname):
         """Write stats to a simple one row (plus header) CSV."""
@@ -1013,6 +3124,45 @@ class Tracker(dict):
                 for argset in self._db[errstr]:
                     cw.writerow(argset)
 
+    def write_args_jsonl(self, prefix=''):
+        """Write out a set of JSON-lines files, one per distinctive error.
+
+        Same as `write_args_csv()`, except that the files are named
+        "EID.jsonl" and contain one argset per line as JSON, which keeps
+        structure and types of the argsets, so that they can be read
+        back using `hoover.JsonlArgsetSource`."""
+
+        for errstr in self._db:
+            fname = '%s/%s.jsonl' % (prefix, self._eid(errstr))
+            with open(fname, 'a') as fh:
+                for argset in self._db[errstr]:
+                    fh.write(json.dumps(argset, sort_keys=True,
+                                        default=_json_default) + "\n")
+
+    def write_perf_csv(self, prefix=''):
+        """Write out a set of CSV files, one per distinctive performance error.
+
+        Same as `write_args_csv()`, except that the CSVs list argsets
+        affected by performance errors, with one added column per driver
+        with its duration (named "DriverName_duration")."""
+
+        colnames = set()
+        for affected in self._perf_db.itervalues():
+            for argset, durations in affected:
+                colnames.update(argset.keys())
+                colnames.update(d + '_duration' for d in durations)
+        all_colnames = sorted(colnames)
+
+        for errstr, affected in self._perf_db.iteritems():
+            with open(self._csv_fname(errstr, prefix), 'a') as fh:
+                cw = csv.DictWriter(fh, all_colnames)
+                cw.writerow(dict(zip(all_colnames, all_colnames)))  # header
+                for argset, durations in affected:
+                    row = dict(argset)
+                    for dname, duration in durations.iteritems():
+                        row[dname + '_duration'] = duration
+                    cw.writerow(row)
+
 
 def dataMatch(pattern, data, rmax=10, _r=0):
     """Check if data structure matches a pattern data structure.
@@ -1022,49 +3172,141 @@ def dataMatch(pattern, data, rmax=10, _r=0):
     For scalars, simple `==` is used.  Lists are converted to sets and
     "to match" means "to have a matching subset (e.g. `[1, 2, 3, 4]`
     matches `[3, 2]`).  Both lists and dictionaries are matched recursively.
+
+    If you match the same pattern many times, use `hoover.compilePattern`
+    instead.
     """
+    return compilePattern(pattern, rmax=rmax, _r=_r)(data)
 
-    def listMatch(pattern, data):
-        """Match list-like objects"""
-        assert all([hasattr(o, 'append') for o in [pattern, data]])
-        results = []
-        for pv in pattern:
-            if any([dataMatch(pv, dv, _r=_r+1) for dv in data]):
-                results.append(True)
-            else:
-                results.append(False)
-        return all(results)
 
-    def dictMatch(pattern, data):
-        """Match dict-like objects"""
-        assert all([hasattr(o, 'iteritems') for o in [pattern, data]])
-        results = []
-        try:
-            for pk, pv in pattern.iteritems():
-                results.append(dataMatch(pv, data[pk], _r=_r+1))
-        except KeyError:
-            results.append(False)
-        return all(results)
+# lists with fewer non-container patterns are matched by linear search
+_SET_MATCH_MIN = 4
 
-    if _r == rmax:
+
+def compilePattern(pattern, rmax=10, _r=0):
+    """Compile pattern to a function matching data the same way as `dataMatch`.
+
+    The pattern structure is examined only once, so the returned function
+    can be used repeatedly without the overhead.  Dicts and lists are
+    dispatched by type, all checks short-circuit on first mismatch and
+    in lists, hashable non-container items are looked up in a set made
+    from the data.
+
+    As with `dataMatch`, RuntimeError is raised if matching would need to
+    go deeper than `rmax` levels, unless the data are equal to the pattern
+    on the way down.
+    """
+    return _compile_pattern(pattern, rmax, _r)[0]
+
+
+def _compile_pattern(pattern, rmax, _r):
+    """Return matcher for `compilePattern` and whether it can hit rmax"""
+
+    def is_dict(o):
+        return hasattr(o, 'iteritems')
+
+    def is_list(o):
+        return hasattr(o, 'append')
+
+    def over_limit(data):
         raise RuntimeError("recursion limit hit")
 
-    result = None
-    if pattern == data:
-        result = True
-    else:
-        for handler in [dictMatch, listMatch]:
+    def scalar_match(data):
+        return pattern == data
+
+    def dict_match(data):
+        if not is_dict(data):
+            return pattern == data
+        for pk, pmatch in items:
             try:
-                result = handler(pattern, data)
-            except AssertionError:
-                continue
-    return result
+                dv = data[pk]
+            except KeyError:
+                return False
+            if not pmatch(dv):
+                return False
+        return True
+
+    def list_match(data):
+        if not is_list(data):
+            return pattern == data
+        if len(plain) < _SET_MATCH_MIN:
+            for pv in plain:
+                if pv not in data:
+                    return False
+        elif plain:
+            hashed = set()
+            for dv in data:
+                try:
+                    hashed.add(dv)
+                except TypeError:
+                    pass        # unhashable can't equal a plain value
+            for pv in plain:
+                try:
+                    found = pv in hashed
+                except TypeError:
+                    found = pv in data
+                if not found:
+                    return False
+        for pmatch in nested:
+            if not any(pmatch(dv) for dv in data):
+                return False
+        return True
+
+    def guarded(match):
+        # equal data need not be descended, so they can't hit the limit
+        def guarded_match(data):
+            return pattern == data or match(data)
+        return guarded_match
+
+    if _r == rmax:
+        return over_limit, True
+
+    limited = False
+
+    if is_dict(pattern):
+        items = []
+        for pk, pv in pattern.iteritems():
+            pmatch, plimited = _compile_pattern(pv, rmax, _r+1)
+            items.append((pk, pmatch))
+            limited = limited or plimited
+        match = dict_match
+
+    elif is_list(pattern):
+        plain = []
+        nested = []
+        for pv in pattern:
+            if _r + 1 < rmax and not (is_dict(pv) or is_list(pv)):
+                plain.append(pv)
+            else:
+                pmatch, plimited = _compile_pattern(pv, rmax, _r+1)
+                nested.append(pmatch)
+                limited = limited or plimited
+        match = list_match
+
+    else:
+        return scalar_match, False
+
+    return (guarded(match) if limited else match), limited
 
 
 def jsDump(data):
     """A human-readable JSON dump."""
     return json.dumps(data, sort_keys=True, indent=4,
-                      separators=(',', ': '))
+                      separators=(',', ': '), default=_json_default)
+
+
+def jsDigest(data):
+    """Digest of canonical JSON dump of data, or None if not serializable.
+
+    Two structures have the same digest exactly when their `jsDump()`
+    is the same, i.e. when `jsDiff()` of them would be empty.
+    """
+    try:
+        dump = json.dumps(data, sort_keys=True, separators=(',', ':'),
+                          default=_json_default)
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha1(dump).hexdigest()
 
 
 def jsDiff(dira, dirb, namea="A", nameb="B", chara="a", charb="b"):
@@ -1228,6 +3470,116 @@ def jsDiff(dira, dirb, namea="A", nameb="B", chara="a", charb="b"):
     return "\n".join(compress([line for line in udiff]))
 
 
+class CompactArgset(object):
+    """Read-only, memory-efficient argument set.
+
+    Behaves as a read-only mapping (and is registered as
+    `collections.Mapping`), but only holds a tuple of keys, which is
+    shared among all argsets generated from the same scheme, and a tuple
+    of values, with no per-instance `__dict__`.  This makes it much
+    cheaper than a dict when many argsets are generated or kept (e.g. by
+    `hoover.Tracker`).
+
+    Keys are expected to be sorted, so that equal argsets have equal
+    hashes.  Argsets are hashable if their values are, can be pickled,
+    compared to dicts, and written by `csv.DictWriter`.  Use `to_dict()`
+    to convert to (nested) dict e.g. for JSON.  Being read-only, they
+    can't be hacked, so `regression_test` gives cases dict copies of
+    them when hacks are used.
+
+    Key lookup is linear; this is fine for argsets of tens of keys.
+    """
+
+    __slots__ = ('_keys', '_values')
+
+    def __init__(self, keys, values):
+        self._keys = keys
+        self._values = values
+
+    @classmethod
+    def from_dict(cls, dct):
+        """Create from dict, converting nested dicts as well."""
+        keys = tuple(sorted(dct))
+        return cls(keys, tuple(cls.from_dict(dct[k])
+                               if isinstance(dct[k], dict) else dct[k]
+                               for k in keys))
+
+    def to_dict(self):
+        """Convert to dict, converting nested argsets as well."""
+        return dict((k, v.to_dict() if isinstance(v, CompactArgset) else v)
+                    for k, v in zip(self._keys, self._values))
+
+    def __getitem__(self, key):
+        try:
+            return self._values[self._keys.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self._keys, self._values)
+
+    def iterkeys(self):
+        return iter(self._keys)
+
+    def itervalues(self):
+        return iter(self._values)
+
+    def iteritems(self):
+        return itertools.izip(self._keys, self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, CompactArgset):
+            return (self._keys == other._keys
+                    and self._values == other._values)
+        if isinstance(other, collections.Mapping):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        return hash((self._keys, self._values))
+
+    def __reduce__(self):
+        return (CompactArgset, (self._keys, self._values))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+collections.Mapping.register(CompactArgset)
+
+
+def _json_default(obj):
+    """Let `json` encode `hoover.CompactArgset`"""
+    if isinstance(obj, CompactArgset):
+        return obj.to_dict()
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
 class Cartman(object):
     """Create argument sets from ranges (or ay iterators) of values.
 
@@ -1309,6 +3661,30 @@ class Cartman(object):
 
     In future, however, this might change, though, mainly in case
     optimization became possible based on what was used.
+
+    Combinations known to be invalid can be pruned right away instead of
+    being generated only to be bailed out by drivers.  Pass `constraints`,
+    a list of tuples `(paths, fn)`, where `paths` is a list of paths
+    to iterated values in the argset (in `hoover.DictPath` format, e.g.
+    "/op" or "/size/width"), and `fn` is a function that gets the values
+    as positional arguments and returns true if the combination is to be
+    pruned:
+
+        c = Cartman(source, scheme, constraints=[
+            (['/op', '/b'], lambda op, b: op == 'div' and b == 0),
+        ])
+
+    Iterables constrained this way are iterated first ("outer-most"), so
+    that each constraint is checked as soon as all its values are known,
+    and the whole product of the remaining iterables is skipped if the
+    constraint prunes the combination.  Note that this changes order of
+    argsets compared to unconstrained `Cartman`.  `len()` gives number
+    of argsets after pruning; this requires iterating over the product of
+    constrained iterables.
+
+    With `compact=True`, argsets are generated as `hoover.CompactArgset`
+    instead of dicts, which saves a lot of memory and allocations in big
+    sweeps.
     """
 
 
@@ -1325,9 +3701,12 @@ class Cartman(object):
     class Iterable(_BaseMark):
         pass
 
-    def __init__(self, source, scheme, recursion_limit=10, _r=0):
+    def __init__(self, source, scheme, recursion_limit=10, _r=0,
+                 constraints=None, compact=False):
         self.source = source
         self.scheme = scheme
+        self.constraints = constraints or []
+        self.compact = compact
         self.recursion_limit = recursion_limit
         self._r = _r
         if self._r > self.recursion_limit:
@@ -1343,7 +3722,9 @@ class Cartman(object):
 
     def __deepcopy__(self, memo):
         return Cartman(deepcopy(self.source, memo),
-                       deepcopy(self.scheme, memo))
+                       deepcopy(self.scheme, memo),
+                       constraints=list(self.constraints),
+                       compact=self.compact)
 
     def _is_mark(self, subscheme):
         try:
@@ -1359,6 +3740,33 @@ class Cartman(object):
         if self._is_mark(subscheme):
             return issubclass(subscheme, Cartman.Iterable)
 
+    def _len_for(self, key):
+        subscheme = self.scheme[key]
+        subsource = self.source[key]
+        if self._means_scalar(subscheme):
+            return 1
+        elif self._means_iterable(subscheme):
+            return len(subsource)
+        else:
+            return len(Cartman(subsource, subscheme, _r=self._r+1))
+
+    def __nonzero__(self):
+        # do not let bool() fall back to __len__, which can be expensive
+        # or fail
+        return True
+
+    def __len__(self):
+        """Number of argsets; TypeError if an iterable is not sized."""
+        if self.constraints:
+            return self._pruned_len()
+        size = 1
+        for key in self.scheme.keys():
+            try:
+                size *= self._len_for(key)
+            except KeyError:
+                pass    # ignore that subsource mentioned by scheme is missing
+        return size
+
     def _get_iterable_for(self, key):
         subscheme = self.scheme[key]
         subsource = self.source[key]
@@ -1367,7 +3775,8 @@ class Cartman(object):
         elif self._means_iterable(subscheme):
             return subsource
         else:   # try to use it as scheme
-            return iter(Cartman(subsource, subscheme, _r=self._r+1))
+            return iter(Cartman(subsource, subscheme, _r=self._r+1,
+                                compact=self.compact))
 
     def __iter__(self):
 
@@ -1375,6 +3784,8 @@ class Cartman(object):
         iterables = []
 
         keys = self.scheme.keys()
+        if self.compact:
+            keys = sorted(keys)
 
         for key in keys:
             try:
@@ -1384,11 +3795,261 @@ class Cartman(object):
             else:
                 names.append(key)
 
+        if self.constraints:
+            for argset in self._pruned_iter():
+                yield argset
+            return
+
+        if self.compact:
+            names = tuple(names)
+            for values in itertools.product(*iterables):
+                yield CompactArgset(names, values)
+            return
+
         for values in itertools.product(*iterables):
             yield dict(zip(names, values))
 
+    ##
+    # Constraint pruning
+    #
+
+    def _axes(self, prefix=()):
+        """Flatten scheme to list of `(path, source)` for each leaf and
+        list of paths to nested dicts"""
+        leaves = []
+        dicts = []
+        for key in self.scheme.keys():
+            try:
+                subscheme = self.scheme[key]
+                subsource = self.source[key]
+            except KeyError:
+                continue    # ignore missing subsource, as above
+            path = prefix + (key,)
+            if self._means_scalar(subscheme):
+                leaves.append((path, [subsource]))
+            elif self._means_iterable(subscheme):
+                leaves.append((path, subsource))
+            else:
+                sub = Cartman(subsource, subscheme, _r=self._r+1)
+                subleaves, subdicts = sub._axes(path)
+                dicts.append(path)
+                dicts.extend(subdicts)
+                leaves.extend(subleaves)
+        return leaves, dicts
+
+    def _plan(self):
+        """Order leaves with constrained ones first and assign checks
+
+        Returns `(leaves, dicts, checks)` where `checks[i]` is list
+        of `(fn, indexes)` to call when i-th leaf is bound; only first
+        `len(checks)` leaves are constrained."""
+        leaves, dicts = self._axes()
+        index = dict((path, i) for i, (path, _) in enumerate(leaves))
+        constrained = []
+        resolved = []
+        for paths, fn in self.constraints:
+            idxs = []
+            for path in paths:
+                keys = tuple(DictPath.Path(path, DictPath.DIV)
+                             .stripped().split(DictPath.DIV))
+                if keys not in index:
+                    raise ValueError("constraint path not in scheme: %s"
+                                     % path)
+                idxs.append(index[keys])
+                if index[keys] not in constrained:
+                    constrained.append(index[keys])
+            resolved.append((fn, idxs))
+        order = constrained + [i for i in range(len(leaves))
+                               if i not in constrained]
+        pos = dict((old, new) for new, old in enumerate(order))
+        checks = [[] for i in constrained]
+        for fn, idxs in resolved:
+            new_idxs = [pos[i] for i in idxs]
+            checks[max(new_idxs)].append((fn, new_idxs))
+        return [leaves[i] for i in order], dicts, checks
+
+    def _prefixes(self, sources, checks):
+        """Generate value tuples of constrained leaves that pass checks"""
+        depth = len(checks)
+
+        def walk(i, prefix):
+            if i == depth:
+                yield prefix
+                return
+            for value in sources[i]:
+                values = prefix + (value,)
+                pruned = False
+                for fn, idxs in checks[i]:
+                    if fn(*[values[j] for j in idxs]):
+                        pruned = True
+                        break
+                if not pruned:
+                    for result in walk(i + 1, values):
+                        yield result
+
+        return walk(0, ())
+
+    def _builder(self, paths, dicts):
+        """Return function to build argset from values of leaves"""
+        tree = {}
+        for path in dicts:
+            node = tree
+            for key in path[:-1]:
+                node = node[key]
+            node[path[-1]] = {}
+        for i, path in enumerate(paths):
+            node = tree
+            for key in path[:-1]:
+                node = node[key]
+            node[path[-1]] = i
+
+        def compile_node(node):
+            keys = tuple(sorted(node)) if self.compact else tuple(node)
+            parts = [compile_node(node[k]) if isinstance(node[k], dict)
+                     else node[k] for k in keys]
+
+            def values_of(values):
+                return tuple(p(values) if callable(p) else values[p]
+                             for p in parts)
+
+            if self.compact:
+                return lambda values: CompactArgset(keys, values_of(values))
+            return lambda values: dict(zip(keys, values_of(values)))
+
+        return compile_node(tree)
+
+    def _pruned_iter(self):
+        leaves, dicts, checks = self._plan()
+        build = self._builder([path for path, _ in leaves], dicts)
+        sources = [list(src) for _, src in leaves]
+        rest = sources[len(checks):]
+        for prefix in self._prefixes(sources, checks):
+            for suffix in itertools.product(*rest):
+                yield build(prefix + suffix)
+
+    def _pruned_len(self):
+        leaves, _, checks = self._plan()
+        sizes = [len(src) for _, src in leaves]
+        sources = [src for _, src in leaves]
+        size = sum(1 for _ in self._prefixes(sources, checks))
+        for n in sizes[len(checks):]:
+            size *= n
+        return size
+
     def getstats(self):
         return {}
 
     def fmtstats(self):
         return ""
+
+
+class _FileArgsetSource(object):
+    """Base for argset sources reading files lazily
+
+    Sub-classes implement `_read(fh)`, generating argsets (as dicts) from
+    open file `fh`.
+    """
+
+    def __init__(self, fnames, types=None, compact=False):
+        self.fnames = [fnames] if isinstance(fnames, basestring) else fnames
+        self.types = types or {}
+        self.compact = compact
+
+    def _restore(self, key, value):
+        return self.types[key](value) if key in self.types else value
+
+    def __iter__(self):
+        for fname in self.fnames:
+            with open(fname) as fh:
+                for argset in self._read(fh):
+                    if self.compact:
+                        argset = CompactArgset.from_dict(argset)
+                    yield argset
+
+
+class CsvArgsetSource(_FileArgsetSource):
+    """Read argsets from CSV files, e.g. as written by `Tracker`.
+
+    Iterating over the instance reads argsets lazily from files in
+    `fnames` (a path or a list of paths), one argset per row, with
+    column names from the header row as keys; this can be then passed
+    as `argsrc` to `hoover.regression_test()`.  E.g. to re-run argsets
+    of all errors found by previous run:
+
+        tracker.write_args_csv('errors')
+        # ...fix stuff...
+        argsrc = hoover.CsvArgsetSource(glob.glob('errors/*.csv'))
+
+    Since CSV only holds strings, types are restored by evaluating each
+    value as Python literal (so that "1" becomes int, "True" bool,
+    "{'a': [1]}" dict...); values that are not literals stay strings and
+    empty values become `None`, which is how `Tracker` writes them.  To
+    override this for some keys, pass `types`, dict of functions to
+    convert the string, keyed by column name (e.g. `{'zip': str}`).
+
+    Pass list of `columns` to only take some keys (e.g. to skip
+    durations in CSVs from `Tracker.write_perf_csv()`).  Rows repeating
+    the header (as appended by repeated `Tracker` writes to the same
+    file) are skipped.  With `compact=True`, `hoover.CompactArgset`
+    instances are generated instead of dicts.
+    """
+
+    def __init__(self, fnames, types=None, columns=None, compact=False):
+        super(CsvArgsetSource, self).__init__(fnames, types, compact)
+        self.columns = columns
+
+    def _restore(self, key, value):
+        if key in self.types:
+            return self.types[key](value)
+        if value == '':
+            return None
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+
+    def _read(self, fh):
+        reader = csv.reader(fh)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = self.columns or header
+        for row in reader:
+            if row == header:
+                continue
+            values = dict(zip(header, row))
+            yield dict((key, self._restore(key, values.get(key, '')))
+                       for key in columns)
+
+
+class JsonlArgsetSource(_FileArgsetSource):
+    """Read argsets from JSON-lines files.
+
+    Works like `hoover.CsvArgsetSource`, except that each (non-empty)
+    line of the files is expected to hold one argset as JSON object,
+    e.g. as written by `Tracker.write_args_jsonl()`.  Since JSON keeps
+    types of values (except tuples), `types` are only needed for special
+    cases.  Strings are UTF-8 encoded `str`, as in argsets from CSV or
+    `hoover.Cartman`, rather than `unicode`.
+    """
+
+    @classmethod
+    def _encoded(cls, value):
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        if isinstance(value, list):
+            return [cls._encoded(v) for v in value]
+        if isinstance(value, dict):
+            return dict((cls._encoded(k), cls._encoded(v))
+                        for k, v in value.iteritems())
+        return value
+
+    def _read(self, fh):
+        for line in fh:
+            if not line.strip():
+                continue
+            argset = self._encoded(json.loads(line))
+            for key in self.types:
+                if key in argset:
+                    argset[key] = self._restore(key, argset[key])
+            yield argset
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# flake8: noqa
+
+import time
+import unittest
+from sznqalibs import bottleneck
+
+
+class AdaptiveThrottleTest(unittest.TestCase):
+
+    def setUp(self):
+        super(AdaptiveThrottleTest, self).setUp()
+        self.t = bottleneck.AdaptiveThrottle(target_latency=0.1,
+                                             min_load=2, max_load=10,
+                                             initial_load=4)
+
+    def test_Increase(self):
+        self.t.feedback(0.05)
+        self.t.feedback(0.05)
+        self.assertEqual(6, self.t.max_load)
+        self.assertEqual(6, self.t.frame.MAX_LOAD)
+
+    def test_IncreaseCapped(self):
+        for _ in range(20):
+            self.t.feedback(0.05)
+        self.assertEqual(10, self.t.max_load)
+
+    def test_DecreaseOnLatency(self):
+        self.t.feedback(0.5)
+        self.assertEqual(2, self.t.max_load)
+
+    def test_DecreaseOnError(self):
+        self.t._set_load(8)
+        self.t.feedback(0.01, ok=False)
+        self.assertEqual(4, self.t.max_load)
+
+    def test_DecreaseOncePerFrame(self):
+        self.t._set_load(8)
+        self.t.feedback(0.5)
+        self.t.feedback(0.5)
+        self.assertEqual(4, self.t.max_load)
+
+    def test_Rate(self):
+        t = bottleneck.AdaptiveThrottle(target_latency=0.1, initial_load=30,
+                                        frame_size=60)
+        self.assertEqual(0.5, t.rate)
+
+    def test_BadDecrease(self):
+        fn = lambda: bottleneck.AdaptiveThrottle(0.1, decrease=2)
+        self.assertRaises(ValueError, fn)
+
+
+class ThrottleStatsTest(unittest.TestCase):
+
+    def test_Record(self):
+        st = bottleneck.ThrottleStats()
+        for waited in [0, 0, 0.005, 0.5, 20]:
+            st.record(waited)
+        stats = st.getstats()
+        self.assertEqual(5, stats['permits'])
+        self.assertEqual(3, stats['waits'])
+        self.assertEqual(20, stats['wait_max'])
+        self.assertEqual(20.505, stats['wait_total'])
+        self.assertEqual({'<=0.001': 2, '<=0.01': 1, '<=0.1': 0, '<=1': 1,
+                          '<=10': 0, '>10': 1}, stats['wait_histogram'])
+
+    def test_Merge(self):
+        a = bottleneck.ThrottleStats()
+        b = bottleneck.ThrottleStats()
+        a.record(0)
+        b.record(2)
+        b.record(0.05)
+        stats = a.merge(b).getstats()
+        self.assertEqual(3, stats['permits'])
+        self.assertEqual(2, stats['wait_max'])
+        self.assertEqual(1, stats['wait_histogram']['<=0.1'])
+
+    def test_ThrottleCounts(self):
+        t = bottleneck.Throttle(2, 0.05)
+        for _ in range(3):
+            t.wait()
+        stats = t.getstats()
+        self.assertEqual(3, stats['permits'])
+        self.assertEqual(1, stats['waits'])
+        self.assertTrue(0 < stats['closed_ratio'] <= 1)
+
+    def test_WaitSleeps(self):
+        t = bottleneck.Throttle(1, 0.2)
+        t.wait()
+        wall, cpu = time.time(), time.clock()
+        t.wait()
+        self.assertGreater(time.time() - wall, 0.15)
+        self.assertLess(time.clock() - cpu, 0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,9 +2,23 @@
 # flake8: noqa
 
 import unittest
+from sznqalibs import bottleneck
 from sznqalibs import hoover
 import copy
+import csv
 import json
+import operator
+import os
+import pickle
+import pstats
+import BaseHTTPServer
+import shutil
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import urlparse
 import unittest
 
 
@@ -548,6 +562,190 @@ class CartmanTest(unittest.TestCase):
 
         self.assertRaises(ValueError, fn)
 
+    def test_Len(self):
+        scheme = {
+            'a': hoover.Cartman.Iterable,
+            'b': hoover.Cartman.Scalar,
+            'x': {
+                'h1': hoover.Cartman.Iterable,
+                'h2': hoover.Cartman.Iterable,
+            },
+            'MIA': hoover.Cartman.Iterable,
+        }
+        source = {
+            'a': [1, 2, 3],
+            'b': ['i', 'ii', 'iii'],
+            'x': {'h1': [101, 102], 'h2': xrange(5)}
+        }
+        cm = hoover.Cartman(source, scheme)
+        self.assertEqual(30, len(cm))
+        self.assertEqual(30, len(list(cm)))
+
+    def test_LenUnsized(self):
+        cm = hoover.Cartman({'a': iter([1, 2])},
+                            {'a': hoover.Cartman.Iterable})
+        self.assertRaises(TypeError, len, cm)
+        self.assertTrue(cm)
+
+    def test_Constraints(self):
+        scheme = {
+            'op': hoover.Cartman.Iterable,
+            'a': hoover.Cartman.Iterable,
+            'x': {
+                'b': hoover.Cartman.Iterable,
+                'c': hoover.Cartman.Scalar,
+            },
+        }
+        source = {
+            'op': ['add', 'div'],
+            'a': range(3),
+            'x': {'b': range(4), 'c': 'C'},
+        }
+        seen = []
+
+        def div_zero(op, b):
+            seen.append((op, b))
+            return op == 'div' and b == 0
+
+        cm = hoover.Cartman(source, scheme, constraints=[
+            (['/op', '/x/b'], div_zero),
+        ])
+        oracle = [argset for argset in hoover.Cartman(source, scheme)
+                  if not (argset['op'] == 'div' and argset['x']['b'] == 0)]
+        result = [argset for argset in cm]
+        self.assertEqual(len(oracle), len(result))
+        self.assertEqual([], self.sdiff(oracle, result))
+        # pruned before iterating 'a'
+        self.assertEqual(8, len(seen))
+        self.assertEqual(21, len(cm))
+
+    def test_ConstraintBadPath(self):
+        cm = hoover.Cartman({'a': [1]}, {'a': hoover.Cartman.Iterable},
+                            constraints=[(['/b'], bool)])
+        self.assertRaises(ValueError, list, cm)
+
+
+    def test_Compact(self):
+        scheme = {
+            'b': hoover.Cartman.Iterable,
+            'a': hoover.Cartman.Scalar,
+            'x': {'h1': hoover.Cartman.Iterable},
+        }
+        source = {'a': 'A', 'b': [1, 2, 3], 'x': {'h1': [True, False]}}
+        plain = list(hoover.Cartman(source, scheme))
+        compact = list(hoover.Cartman(source, scheme, compact=True))
+        self.assertTrue(all(isinstance(a, hoover.CompactArgset)
+                            for a in compact))
+        self.assertEqual(sorted(plain), sorted(a.to_dict() for a in compact))
+        self.assertIs(compact[0]._keys, compact[1]._keys)
+        self.assertEqual(6, len(set(compact)))
+
+    def test_CompactConstrained(self):
+        scheme = {
+            'b': hoover.Cartman.Iterable,
+            'x': {'h1': hoover.Cartman.Iterable},
+        }
+        source = {'b': [1, 2, 3], 'x': {'h1': [True, False]}}
+        constraints = [(['/x/h1', '/b'], lambda h1, b: h1 and b > 1)]
+        plain = list(hoover.Cartman(source, scheme, constraints=constraints))
+        compact = list(hoover.Cartman(source, scheme, compact=True,
+                                      constraints=constraints))
+        self.assertEqual(4, len(compact))
+        self.assertEqual(sorted(plain), sorted(a.to_dict() for a in compact))
+        self.assertIsInstance(compact[0]['x'], hoover.CompactArgset)
+
+
+class CompactArgsetTest(unittest.TestCase):
+
+    def setUp(self):
+        super(CompactArgsetTest, self).setUp()
+        self.dct = {'a': 1, 'b': 'x', 'c': {'d': [1, 2]}}
+        self.argset = hoover.CompactArgset.from_dict(self.dct)
+
+    def test_Mapping(self):
+        self.assertEqual(1, self.argset['a'])
+        self.assertEqual([1, 2], self.argset['c']['d'])
+        self.assertRaises(KeyError, lambda: self.argset['z'])
+        self.assertEqual(None, self.argset.get('z'))
+        self.assertIn('b', self.argset)
+        self.assertEqual(['a', 'b', 'c'], list(self.argset))
+        self.assertEqual(3, len(self.argset))
+        self.assertEqual(self.dct, self.argset)
+        self.assertEqual(self.dct, self.argset.to_dict())
+        self.assertEqual(self.dct, eval(repr(self.argset)))
+        self.assertNotEqual({'a': 1}, self.argset)
+
+    def test_Slots(self):
+        self.assertFalse(hasattr(self.argset, '__dict__'))
+        self.assertRaises(AttributeError, setattr, self.argset, 'x', 1)
+
+    def test_Hashable(self):
+        flat = hoover.CompactArgset.from_dict({'a': 1, 'b': (1, 2)})
+        self.assertEqual(hash(flat),
+                         hash(hoover.CompactArgset(('a', 'b'), (1, (1, 2)))))
+        self.assertRaises(TypeError, hash, self.argset)
+
+    def test_Pickle(self):
+        for protocol in range(3):
+            copied = pickle.loads(pickle.dumps(self.argset, protocol))
+            self.assertEqual(self.argset, copied)
+            self.assertIsInstance(copied, hoover.CompactArgset)
+
+    def test_Json(self):
+        self.assertEqual(self.dct, json.loads(hoover.jsDump(self.argset)))
+
+    def test_Csv(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            tracker = hoover.Tracker()
+            tracker.update("some error", self.argset)
+            tracker.write_args_csv(tmp)
+            fname, = os.listdir(tmp)
+            with open(os.path.join(tmp, fname)) as fh:
+                rows = list(csv.DictReader(fh))
+            self.assertEqual([{'a': '1', 'b': 'x', 'c': "{'d': [1, 2]}"}],
+                             rows)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_InRegressionTest(self):
+
+        class MyDriver(hoover.BaseTestDriver):
+
+            def _get_data(self):
+                self.data['x'] = self._args['x'] * 3
+
+        tracker = hoover.regression_test(
+            hoover.Cartman({'x': range(5)}, {'x': hoover.Cartman.Iterable},
+                           compact=True),
+            [(operator.eq, MyDriver, BatchDriverTest.OracleDriver)], {})
+        self.assertTrue(tracker.errors_found())
+        self.assertIsInstance(tracker._db.values()[0][0],
+                              hoover.CompactArgset)
+
+    def test_Hacked(self):
+
+        class MyDriver(hoover.BaseTestDriver):
+
+            def _get_data(self):
+                self.data['x'] = self._args['x'] * 3
+
+        argsrc = hoover.Cartman({'x': range(5), 'y': 1.234},
+                                {'x': hoover.Cartman.Iterable,
+                                 'y': hoover.Cartman.Scalar},
+                                compact=True)
+        tracker = hoover.regression_test(
+            argsrc, [(operator.eq, MyDriver, BatchDriverTest.OracleDriver)],
+            {}, apply_hacks=[[{'argsets': [{'argset': {'x': 1}}],
+                               'remove': ['/argset/x'],
+                               'round': {1: ['/argset/y']}}]])
+        stats = tracker.getstats()
+        self.assertEqual(1, stats['hacked_cases'])
+        argsets = sum(tracker._db.values(), [])
+        self.assertEqual(list(argsrc)[1:],
+                         sorted(argsets, key=lambda a: a['x']))
+        self.assertIsInstance(argsets[0], hoover.CompactArgset)
+
 
 class RuleOpTest(unittest.TestCase):
 
@@ -864,5 +1062,1616 @@ class DataMatch(unittest.TestCase):
         self.assertFalse(hoover.dataMatch(p, r))
 
 
+class DriverThrottleTest(unittest.TestCase):
+
+    class FeedbackRecorder(object):
+
+        def __init__(self):
+            self.waits = 0
+            self.fed = []
+
+        def wait(self):
+            self.waits += 1
+
+        def feedback(self, latency, ok=True):
+            self.fed.append((latency, ok))
+
+    def test_FedAutomatically(self):
+
+        class SlowDriver(hoover.BaseTestDriver):
+            throttle = self.FeedbackRecorder()
+
+            def _get_data(self):
+                self.duration = 0.25
+                self.data['x'] = 1
+
+        d = SlowDriver()
+        d.setup({})
+        d.run({})
+        self.assertEqual(1, SlowDriver.throttle.waits)
+        self.assertEqual([(0.25, True)], SlowDriver.throttle.fed)
+
+    def test_FedOnError(self):
+
+        class BadDriver(hoover.BaseTestDriver):
+            throttle = self.FeedbackRecorder()
+
+            def _get_data(self):
+                raise ValueError("no luck")
+
+        d = BadDriver()
+        d.setup({})
+        self.assertRaises(hoover.DriverError, d.run, {})
+        self.assertFalse(BadDriver.throttle.fed[0][1])
+
+    def test_PlainThrottle(self):
+
+        class PlainDriver(hoover.BaseTestDriver):
+            throttle = bottleneck.Throttle(100)
+
+            def _get_data(self):
+                self.data['x'] = 1
+
+        d = PlainDriver()
+        d.setup({})
+        d.run({})
+        self.assertEqual({'x': 1}, d.data)
+
+
+class DriverLimitsTest(unittest.TestCase):
+
+    class OracleDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x']
+
+    class ResultDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x']
+
+    def setUp(self):
+        super(DriverLimitsTest, self).setUp()
+        self.argsrc = [{'x': i} for i in range(5)]
+        self.tests = [(operator.eq, self.OracleDriver, self.ResultDriver)]
+
+    def test_FromSettings(self):
+        limits = hoover.DriverLimits.from_settings(self.ResultDriver, {
+            'ResultDriver.max_rps': 10,
+            'ResultDriver.max_concurrency': 2,
+            'OracleDriver.max_rps': 1,
+        })
+        self.assertEqual(10, limits.throttle.max_load)
+        self.assertEqual(1, limits.throttle.frame_size)
+        self.assertTrue(limits.semaphore)
+
+    def test_FractionalRate(self):
+        limits = hoover.DriverLimits(max_rps=0.5)
+        self.assertEqual(1, limits.throttle.max_load)
+        self.assertEqual(2, limits.throttle.frame_size)
+
+    def test_NoLimits(self):
+        self.assertFalse(hoover.DriverLimits.from_settings(
+            self.ResultDriver, {'ResultDriver.foo': 1}))
+
+    def test_ConcurrencyReleased(self):
+        limits = hoover.DriverLimits(max_concurrency=1)
+        for _ in range(3):
+            limits.acquire()
+            limits.release()
+        self.assertTrue(limits.semaphore.acquire(False))
+
+    def test_SharedByThreads(self):
+        limits = hoover.DriverLimits(max_rps=5)
+        passed = []
+        start = time.time()
+
+        def call():
+            limits.acquire()
+            passed.append(time.time() - start)
+            limits.release()
+
+        threads = [threading.Thread(target=call) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(8, len(passed))
+        self.assertEqual(5, len([t for t in passed if t < 0.9]))
+
+    def test_WaitReportedSeparately(self):
+        settings = {'ResultDriver.max_rps': 1000,
+                    'ResultDriver.max_concurrency': 1}
+        tracker = hoover.regression_test(self.argsrc, self.tests, settings)
+        stats = tracker.getstats()
+        self.assertFalse(tracker.errors_found())
+        self.assertEqual(5, stats['ResultDriver_calls'])
+        self.assertIn('ResultDriver_throttle_wait', stats)
+        self.assertEqual(0, stats['OracleDriver_throttle_wait'])
+        self.assertIn('gtotal_throttle_wait', stats)
+        self.assertIn('ResultDriver_duration_p99', stats)
+
+
+class DriverTimeoutTest(unittest.TestCase):
+
+    release = threading.Event()
+
+    class OracleDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x']
+
+    class HangingDriver(hoover.BaseTestDriver):
+
+        cancelled = []
+
+        def _get_data(self):
+            if self._args['x'] == 2:
+                DriverTimeoutTest.release.wait(5)
+            self.data['x'] = self._args['x']
+
+        def _get_data_batch(self, argsets):
+            if any(a['x'] == 2 for a in argsets):
+                DriverTimeoutTest.release.wait(5)
+            return [{'x': a['x']} for a in argsets]
+
+        def cancel(self):
+            self.cancelled.append(self._args)
+
+    def setUp(self):
+        super(DriverTimeoutTest, self).setUp()
+        self.release.clear()
+        del self.HangingDriver.cancelled[:]
+        self.argsrc = [{'x': i} for i in range(4)]
+        self.tests = [(operator.eq, self.OracleDriver, self.HangingDriver)]
+        self.settings = {'HangingDriver.call_timeout': 0.05}
+
+    def tearDown(self):
+        self.release.set()
+        super(DriverTimeoutTest, self).tearDown()
+
+    def test_FromSettings(self):
+        limits = hoover.DriverLimits.from_settings(self.HangingDriver,
+                                                   self.settings)
+        self.assertEqual(0.05, limits.timeout)
+        self.assertTrue(limits)
+
+    def test_TimedOut(self):
+        tracker = hoover.regression_test(self.argsrc, self.tests,
+                                         self.settings)
+        stats = tracker.getstats()
+        self.assertEqual(["DriverTimeout: HangingDriver did not finish"
+                          " within 0.05s"], tracker._db.keys())
+        self.assertEqual([{'x': 2}], tracker._db.values()[0])
+        self.assertEqual(4, tracker.argsets_done)
+        self.assertEqual(3, stats['tests_done'])
+        self.assertEqual(3, stats['HangingDriver_calls'])
+        self.assertEqual(1, stats['HangingDriver_timeouts'])
+        self.assertEqual([{'x': 2}], self.HangingDriver.cancelled)
+
+    def test_Batch(self):
+        tracker = hoover.regression_test(self.argsrc, self.tests,
+                                         self.settings, batch_size=2)
+        stats = tracker.getstats()
+        self.assertEqual([{'x': 2}, {'x': 3}], tracker._db.values()[0])
+        self.assertEqual(2, stats['tests_done'])
+        self.assertEqual(2, stats['HangingDriver_calls'])
+        self.assertEqual(2, stats['HangingDriver_timeouts'])
+
+    def test_ErrorsPassed(self):
+
+        class BadDriver(hoover.BaseTestDriver):
+
+            def _get_data(self):
+                raise ValueError("no luck")
+
+        limits = hoover.DriverLimits(timeout=1)
+        d = BadDriver()
+        d.setup({})
+        self.assertRaises(hoover.DriverError, hoover._call, d, d.run, {},
+                          limits)
+
+    def test_PermitHeld(self):
+        limits = hoover.DriverLimits(max_concurrency=1, timeout=0.05)
+        d = self.HangingDriver()
+        d.setup({})
+        self.assertRaises(hoover.DriverTimeout, hoover._call, d, d.run,
+                          {'x': 2}, limits)
+        self.assertFalse(limits.semaphore.acquire(False))
+        self.release.set()
+        d = self.HangingDriver()
+        d.setup({})
+        hoover._call(d, d.run, {'x': 3}, limits)
+        self.assertEqual({'x': 3}, d.data)
+
+
+class WarmupTest(unittest.TestCase):
+
+    class OracleDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.duration = 0.001
+            self.data['x'] = self._args['x']
+
+    class ColdDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.duration = 0.1 if self._args['x'] < 3 else 0.001
+            self.data['x'] = self._args['x']
+
+    def feed(self, warmup, durations):
+        return [warmup.update(d) for d in durations]
+
+    def test_Calls(self):
+        self.assertEqual([True, True, False, False],
+                         self.feed(hoover.Warmup(calls=2), [1, 1, 1, 1]))
+
+    def test_NoWarmup(self):
+        self.assertEqual([False], self.feed(hoover.Warmup(), [1]))
+
+    def test_Window(self):
+        durations = [100, 50, 10, 1, 1, 1.05, 0.95, 1, 1]
+        warmup = hoover.Warmup(window=2)
+        self.assertEqual([True] * 6 + [False] * 3,
+                         self.feed(warmup, durations))
+        self.assertEqual(7, warmup.seen)
+
+    def test_MaxCalls(self):
+        warmup = hoover.Warmup(window=2, max_calls=3)
+        self.assertEqual([True, True, True, False, False],
+                         self.feed(warmup, [1, 10, 100, 1000, 10000]))
+
+    def test_Copy(self):
+        warmup = hoover.Warmup(calls=1)
+        warmup.update(1)
+        self.assertEqual([True, False], self.feed(warmup.copy(), [1, 1]))
+
+    def test_InRegressionTest(self):
+        tracker = hoover.regression_test(
+            [{'x': i} for i in range(10)],
+            [(operator.eq, self.OracleDriver, self.ColdDriver)],
+            {}, perf_ratio=2, warmup=3)
+        stats = tracker.getstats()
+        self.assertEqual(10, stats['ColdDriver_calls'])
+        self.assertEqual(3, stats['ColdDriver_warmup_calls'])
+        self.assertEqual(300, stats['ColdDriver_warmup_duration'])
+        self.assertEqual(100, stats['ColdDriver_warmup_duration_per_call'])
+        self.assertEqual(1, stats['ColdDriver_duration_per_call'])
+        self.assertEqual(1, stats['ColdDriver_duration_p99'])
+        self.assertIn('ColdDriver_warmup_duration_p99', stats)
+        self.assertFalse(tracker.perf_errors_found())
+
+    def test_SkewedWithout(self):
+        tracker = hoover.regression_test(
+            [{'x': i} for i in range(10)],
+            [(operator.eq, self.OracleDriver, self.ColdDriver)],
+            {}, perf_ratio=2)
+        stats = tracker.getstats()
+        self.assertEqual(0, stats['ColdDriver_warmup_calls'])
+        self.assertEqual(30.7, stats['ColdDriver_duration_per_call'])
+        self.assertTrue(tracker.perf_errors_found())
+
+    def test_Progress(self):
+        reports = []
+        hoover.regression_test(
+            [{'x': i} for i in range(10)],
+            [(operator.eq, self.OracleDriver, self.ColdDriver)],
+            {}, warmup=3, progress=hoover.ProgressReporter(reports.append))
+        latency = reports[-1]['latency_ms']
+        self.assertAlmostEqual(1, latency['ColdDriver'])
+        self.assertAlmostEqual(1, latency['OracleDriver'])
+
+    def test_ProgressAllWarmup(self):
+        reports = []
+        hoover.regression_test(
+            [{'x': i} for i in range(2)],
+            [(operator.eq, self.OracleDriver, self.ColdDriver)],
+            {}, warmup=3, progress=hoover.ProgressReporter(reports.append))
+        self.assertEqual({}, reports[-1]['latency_ms'])
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def setUp(self):
+        super(LatencyHistogramTest, self).setUp()
+        self.h = hoover.LatencyHistogram()
+        for _ in range(98):
+            self.h.record(0.001)
+        self.h.record(5.0)
+        self.h.record(5.0)
+
+    def assertClose(self, a, b):
+        self.assertTrue(abs(a - b) <= b * 0.01, "%r !~ %r" % (a, b))
+
+    def test_Percentiles(self):
+        self.assertClose(self.h.percentile(50), 0.001)
+        self.assertClose(self.h.percentile(90), 0.001)
+        self.assertClose(self.h.percentile(99), 5.0)
+        self.assertEqual(5.0, self.h.max)
+
+    def test_Empty(self):
+        self.assertEqual(None, hoover.LatencyHistogram().percentile(50))
+
+    def test_Tiny(self):
+        h = hoover.LatencyHistogram()
+        h.record(0)
+        self.assertEqual(0, h.percentile(50))
+
+    def test_BoundedBuckets(self):
+        h = hoover.LatencyHistogram()
+        for n in range(10000):
+            h.record(0.001 + n * 1e-8)
+        self.assertTrue(len(h.buckets) < 20)
+
+    def test_Merge(self):
+        other = hoover.LatencyHistogram()
+        for _ in range(100):
+            other.record(7.0)
+        self.h.merge(other)
+        self.assertEqual(200, self.h.count)
+        self.assertEqual(7.0, self.h.max)
+        self.assertClose(self.h.percentile(90), 7.0)
+
+    def test_MergeMismatch(self):
+        other = hoover.LatencyHistogram(precision=0.1)
+        self.assertRaises(ValueError, self.h.merge, other)
+
+    def test_InStats(self):
+        class FooDriver(hoover.BaseTestDriver):
+            pass
+        counter = hoover.StatCounter()
+        for v in [0.002, 0.002, 0.002, 1.5]:
+            counter.record_for(FooDriver, 'duration', v)
+        stats = counter.all_stats()
+        self.assertAlmostEqual(2, stats['FooDriver_duration_p50'], delta=0.02)
+        self.assertEqual(1500, stats['FooDriver_duration_p99'])
+        self.assertEqual(1500, stats['FooDriver_duration_max'])
+
+
+class StatCounterTest(unittest.TestCase):
+
+    class FooDriver(hoover.BaseTestDriver):
+        pass
+
+    def test_SubMillisecond(self):
+        counter = hoover.StatCounter()
+        for _ in range(4):
+            counter.count_for(self.FooDriver, 'calls')
+            counter.add_for(self.FooDriver, 'duration', 250000)
+        counter.add('on_next', 1500)
+        counter.add('cases', 4)
+        counter.add('hacked_cases', 0)
+        stats = counter.all_stats()
+        self.assertEqual(1.0, stats['FooDriver_duration'])
+        self.assertEqual(0.25, stats['FooDriver_duration_per_call'])
+        self.assertEqual(0.002, stats['gtotal_loop_onnext'])
+
+    def test_DriverDurationNs(self):
+
+        class OwnTimeDriver(hoover.BaseTestDriver):
+
+            def _get_data(self):
+                self.duration = 0.0005
+
+        d = OwnTimeDriver()
+        d.setup({})
+        d.run({})
+        self.assertEqual(500000, d.duration_ns)
+
+    def test_MeasuredDurationNs(self):
+        d = DriverLimitsTest.OracleDriver()
+        d.setup({})
+        d.run({'x': 1})
+        self.assertTrue(isinstance(d.duration_ns, (int, long)))
+        self.assertEqual(d.duration, d.duration_ns / 1e9)
+
+
+class PerfRegressionTest(unittest.TestCase):
+
+    class OracleDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.duration = 0.010
+            self.data['x'] = self._args['x']
+
+    class ResultDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.duration = 0.100 if self._args['x'] == 3 else 0.011
+            self.data['x'] = self._args['x']
+
+    def setUp(self):
+        super(PerfRegressionTest, self).setUp()
+        self.argsrc = [{'x': i} for i in range(5)]
+        self.tests = [(operator.eq, self.OracleDriver, self.ResultDriver)]
+
+    def test_Disabled(self):
+        tracker = hoover.regression_test(self.argsrc, self.tests, {})
+        self.assertFalse(tracker.perf_errors_found())
+        self.assertEqual({}, tracker.perf_summary)
+
+    def test_SlowArgset(self):
+        tracker = hoover.regression_test(self.argsrc, self.tests, {},
+                                         perf_ratio=2)
+        stats = tracker.getstats()
+        self.assertFalse(tracker.errors_found())
+        self.assertTrue(tracker.perf_errors_found())
+        self.assertEqual(1, stats['perf_errors'])
+        self.assertEqual(0, stats['total_errors'])
+        (errstr, affected), = tracker._perf_db.items()
+        self.assertEqual([({'x': 3}, {'OracleDriver': 0.010,
+                                      'ResultDriver': 0.100})], affected)
+        self.assertIn("PERFORMANCE ERROR FOUND (%s)" % tracker._eid(errstr),
+                      tracker.format_report())
+
+    def test_Summary(self):
+        tracker = hoover.regression_test(self.argsrc, self.tests, {},
+                                         perf_ratio=1.5)
+        summary, = tracker.perf_summary.values()
+        self.assertAlmostEqual(0.144 / 0.05, summary['ratio'])
+        self.assertTrue(summary['slower'])
+
+    def test_Threshold(self):
+        tracker = hoover.regression_test(self.argsrc, self.tests, {},
+                                         perf_ratio=1, perf_threshold=0.5)
+        self.assertFalse(tracker.perf_errors_found())
+        summary, = tracker.perf_summary.values()
+        self.assertFalse(summary['slower'])
+
+    def test_ThresholdSummary(self):
+        # no argset is slower by more than threshold, so neither are means
+        tracker = hoover.regression_test(self.argsrc, self.tests, {},
+                                         perf_ratio=1, perf_threshold=0.092)
+        self.assertFalse(tracker.perf_errors_found())
+        summary, = tracker.perf_summary.values()
+        self.assertFalse(summary['slower'])
+
+    def test_Csv(self):
+        tracker = hoover.regression_test(self.argsrc, self.tests, {},
+                                         perf_ratio=2)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            tracker.write_perf_csv(tmpdir)
+            errstr, = tracker._perf_db.keys()
+            with open(tracker._csv_fname(errstr, tmpdir)) as fh:
+                rows = list(csv.DictReader(fh))
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual([{'x': '3', 'OracleDriver_duration': '0.01',
+                           'ResultDriver_duration': '0.1'}], rows)
+
+
+class TracingTest(unittest.TestCase):
+
+    class OracleDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x']
+
+    class ResultDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x'] % 2
+
+    def setUp(self):
+        super(TracingTest, self).setUp()
+        self.tests = [(operator.eq, self.OracleDriver, self.ResultDriver)]
+
+    def test_Events(self):
+        seen = []
+        listener = lambda name, phase, ts, args: seen.append((name, phase))
+        hoover.regression_test([{'x': 1}, {'x': 2}], self.tests, {},
+                               listeners=[listener])
+        first = seen[:seen.index(('argset', 'E')) + 1]
+        self.assertEqual(('argset', 'B'), first[0])
+        self.assertIn(('call:OracleDriver', 'B'), first)
+        self.assertIn(('call:ResultDriver', 'E'), first)
+        self.assertIn(('match', 'E'), first)
+        self.assertIn(('tracker', 'E'), first)
+        self.assertNotIn(('diff', 'B'), first)
+        self.assertIn(('diff', 'E'), seen)
+        self.assertEqual(len([e for e in seen if e[1] == 'B']),
+                         len([e for e in seen if e[1] == 'E']))
+
+    def test_ChromeTrace(self):
+        exporter = hoover.ChromeTraceExporter()
+        hoover.regression_test([{'x': 1}], self.tests, {},
+                               listeners=[exporter])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = tmpdir + '/trace.json'
+            exporter.write(fname)
+            with open(fname) as fh:
+                events = json.load(fh)['traceEvents']
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual('argset', events[0]['name'])
+        self.assertEqual('B', events[0]['ph'])
+        self.assertEqual({'n': 0, 'size': 1}, events[0]['args'])
+        timestamps = [e['ts'] for e in events]
+        self.assertEqual(sorted(timestamps), timestamps)
+
+
+class RunProfilerTest(unittest.TestCase):
+
+    class OracleDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = oracle_work(self._args['x'])
+
+    class ResultDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            time.sleep(0.002)
+            self.data['x'] = self._args['x'] if self._args['x'] else 1
+
+    def setUp(self):
+        super(RunProfilerTest, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.argsrc = [{'x': i} for i in range(20)]
+        self.tests = [(operator.eq, self.OracleDriver, self.ResultDriver)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        super(RunProfilerTest, self).tearDown()
+
+    def functions(self, fname):
+        return set(fn for _, _, fn in pstats.Stats(fname).stats)
+
+    def test_Cprofile(self):
+        profile = hoover.RunProfiler()
+        tracker = hoover.regression_test(
+            self.argsrc, self.tests, {},
+            apply_hacks=[[{'round': {2: ['/oracle/x']}}]], profile=profile)
+        paths = profile.write(self.tmp)
+        self.assertEqual(['OracleDriver.pstats', 'ResultDriver.pstats',
+                          'engine.pstats'],
+                         [os.path.basename(p) for p in paths])
+        engine = self.functions(os.path.join(self.tmp, 'engine.pstats'))
+        oracle = self.functions(os.path.join(self.tmp, 'OracleDriver.pstats'))
+        self.assertIn('oracle_work', oracle)
+        self.assertNotIn('oracle_work', engine)
+        self.assertIn('jsDiff', engine)
+        stats = tracker.getstats()
+        for stage in ['drivers', 'copy', 'hacks', 'match', 'diff',
+                      'tracker', 'other']:
+            self.assertIn('stage_' + stage, stats)
+        self.assertGreater(stats['stage_drivers'], 40)
+
+    def test_Engine(self):
+        profile = hoover.RunProfiler(per_driver=False)
+        hoover.regression_test(self.argsrc, self.tests, {}, profile=profile)
+        paths = profile.write(self.tmp)
+        self.assertEqual(['engine.pstats'],
+                         [os.path.basename(p) for p in paths])
+        self.assertIn('oracle_work', self.functions(paths[0]))
+
+    def test_Sampling(self):
+        profile = hoover.RunProfiler(sampling_interval=0.001)
+        hoover.regression_test(self.argsrc, self.tests, {}, profile=profile)
+        profile.write(self.tmp)
+        with open(os.path.join(self.tmp, 'ResultDriver.collapsed')) as fh:
+            lines = fh.readlines()
+        self.assertTrue(any('test_hoover.py:_get_data' in line
+                            for line in lines))
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+
+    def test_StoppedOnError(self):
+
+        def argsrc():
+            yield {'x': 1}
+            raise ValueError("no more")
+
+        profile = hoover.RunProfiler()
+        self.assertRaises(ValueError, hoover.regression_test, argsrc(),
+                          self.tests, {}, profile=profile)
+        self.assertIsNone(sys.getprofile())
+        self.assertGreater(profile.stage_stats()['drivers'], 0)
+
+    def test_CleanupStage(self):
+        profile = hoover.RunProfiler(per_driver=False)
+        tracker = hoover.regression_test(
+            self.argsrc, [(hoover.dataMatch, self.OracleDriver,
+                           self.ResultDriver)], {},
+            cleanup_hack=[{'remove': ['/oracle/y']}], profile=profile)
+        stats = tracker.getstats()
+        self.assertIn('stage_cleanup', stats)
+        self.assertGreater(stats['stage_copy'], 0)
+        self.assertGreaterEqual(stats['stage_cleanup'], 0)
+
+
+class MemoryAccountantTest(unittest.TestCase):
+
+    class HungryDriver(hoover.BaseTestDriver):
+
+        kept = []
+
+        def _get_data(self):
+            self.kept.append(bytearray(1024 * 1024))
+            self.data['x'] = self._args['x']
+
+    def test_Stats(self):
+        memory = hoover.MemoryAccountant(interval=5)
+        tracker = hoover.regression_test(
+            [{'x': i} for i in range(10)],
+            [(operator.eq, self.HungryDriver, RunProfilerTest.OracleDriver)],
+            {}, memory=memory)
+        self.HungryDriver.kept = []
+        stats = tracker.getstats()
+        self.assertGreater(stats['mem_peak'], 0)
+        self.assertGreater(stats['mem_current'], 0)
+        self.assertGreaterEqual(stats['mem_HungryDriver_growth'],
+                                5 * 1024 * 1024)
+        for stage in ['hacks', 'match', 'tracker', 'OracleDriver']:
+            self.assertIn('mem_%s_growth' % stage, stats)
+            self.assertIn('mem_%s_peak' % stage, stats)
+        self.assertEqual([0, 5, 10, 10], [s[0] for s in memory.samples])
+        self.assertIn("memory use", memory.format_report())
+
+    def test_Batches(self):
+        memory = hoover.MemoryAccountant(interval=4)
+        hoover.regression_test(
+            [{'x': i} for i in range(10)],
+            [(operator.eq, BatchDriverTest.OracleDriver,
+              BatchDriverTest.OracleDriver)],
+            {}, memory=memory, batch_size=3)
+        self.assertEqual([0, 6, 9, 10], [s[0] for s in memory.samples])
+
+
+def oracle_work(x):
+    return x
+
+
+class ProgressReporterTest(unittest.TestCase):
+
+    class OracleDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x']
+
+    class ResultDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x'] % 3
+
+    def setUp(self):
+        super(ProgressReporterTest, self).setUp()
+        self.tests = [(operator.eq, self.OracleDriver, self.ResultDriver)]
+        self.argsrc = hoover.Cartman({'x': range(6)},
+                                     {'x': hoover.Cartman.Iterable})
+
+    def test_Callback(self):
+        reports = []
+        progress = hoover.ProgressReporter(callback=reports.append,
+                                           interval=0)
+        hoover.regression_test(self.argsrc, self.tests, {},
+                               progress=progress)
+        self.assertEqual(7, len(reports))
+        self.assertEqual(6, reports[0]['total'])
+        self.assertEqual(1, reports[0]['argsets'])
+        self.assertTrue(reports[-1]['final'])
+        self.assertEqual(0, reports[-1]['eta'])
+        self.assertEqual(3, reports[-1]['distinct_errors'])
+        self.assertEqual(set(['OracleDriver', 'ResultDriver']),
+                         set(reports[-1]['latency_ms']))
+
+    def test_Amortised(self):
+        reports = []
+        progress = hoover.ProgressReporter(callback=reports.append,
+                                           interval=3600)
+        hoover.regression_test(self.argsrc, self.tests, {},
+                               progress=progress)
+        self.assertEqual(1, len(reports))
+
+    def test_JsonLines(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = tmpdir + '/progress.jsonl'
+            progress = hoover.ProgressReporter(fname=fname, interval=0)
+            hoover.regression_test(iter([{'x': 1}, {'x': 2}]), self.tests,
+                                   {}, progress=progress)
+            with open(fname) as fh:
+                reports = [json.loads(line) for line in fh]
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(3, len(reports))
+        self.assertEqual(None, reports[-1]['total'])
+        self.assertEqual(None, reports[-1]['eta'])
+
+
+class CompilePatternTest(unittest.TestCase):
+
+    def test_ManyScalars_Ok(self):
+        m = hoover.compilePattern(range(0, 100, 10))
+        self.assertTrue(m(range(200)))
+
+    def test_ManyScalars_Nok(self):
+        m = hoover.compilePattern(range(0, 100, 10))
+        self.assertFalse(m(range(50)))
+
+    def test_ManyScalarsUnhashableData(self):
+        m = hoover.compilePattern([1, 2, 3, 4, 5, {'a': 1}])
+        self.assertTrue(m([{'a': 1, 'b': 2}, [9], 5, 4, 3, 2, 1]))
+        self.assertFalse(m([{'a': 2}, [9], 5, 4, 3, 2, 1]))
+
+    def test_EqualNumbers(self):
+        m = hoover.compilePattern([1, 2, 3, 4, 5.0])
+        self.assertTrue(m([5, 4, 3, 2.0, 1]))
+
+    def test_Reusable(self):
+        m = hoover.compilePattern({'oname': 'A', 'argset': {'x': [1, 2]}})
+        self.assertTrue(m({'oname': 'A', 'argset': {'x': [2, 1, 0]}}))
+        self.assertFalse(m({'oname': 'B', 'argset': {'x': [2, 1, 0]}}))
+        self.assertFalse(m({'oname': 'A', 'argset': {}}))
+
+    def test_TypeMismatch(self):
+        self.assertFalse(hoover.compilePattern({1: 2})([1, 2]))
+        self.assertFalse(hoover.compilePattern([1, 2])({1: 2}))
+
+    def test_RecursionLimit(self):
+        m = hoover.compilePattern({'a': {'b': 1}}, rmax=2)
+        self.assertRaises(RuntimeError, m, {'a': {'b': 2}})
+        self.assertRaises(RuntimeError, m, {'a': {'b': 2}, 'c': 3})
+
+    def test_RecursionLimitEqual(self):
+        m = hoover.compilePattern({'a': {'b': 1}, 'c': [2]}, rmax=2)
+        self.assertTrue(m({'a': {'b': 1}, 'c': [2]}))
+        self.assertRaises(RuntimeError, m, {'a': {'b': 1}, 'c': [2, 3]})
+        self.assertTrue(hoover.dataMatch([[[1]]], [[[1]]], rmax=1))
+
+
+class CompiledRuleTest(unittest.TestCase):
+
+    def setUp(self):
+        super(CompiledRuleTest, self).setUp()
+        self.case = hoover.TinyCase({
+            'argset': {'a': 1},
+            'oracle': {'x': 1.234},
+            'result': {'x': 1.2341},
+            'oname': 'O',
+            'rname': 'R',
+        })
+
+    def test_IsRule(self):
+        rule = hoover.CompiledRule({'round': {2: ['/oracle/x']}})
+        self.assertEqual({2: ['/oracle/x']}, rule['round'])
+        self.assertTrue(rule.matches(self.case))
+
+    def test_Matches(self):
+        rule = hoover.CompiledRule({'drivers': [{'rname': 'X'},
+                                                {'rname': 'R'}],
+                                    'argsets': [{'argset': {'a': 1}}]})
+        self.assertTrue(rule.matches(self.case))
+
+    def test_NoMatch(self):
+        rule = hoover.CompiledRule({'drivers': [{'rname': 'R'}],
+                                    'argsets': [{'argset': {'a': 2}}]})
+        self.assertFalse(rule.matches(self.case))
+
+    def test_HackCompiled(self):
+        ruleset = hoover.TinyCase.compile_ruleset([
+            {'drivers': [{'oname': 'O'}],
+             'round': {2: ['/oracle/x', '/result/x']}},
+            {'drivers': [{'oname': 'X'}],
+             'remove': ['/oracle/x']},
+        ])
+        self.assertTrue(self.case.hack(ruleset))
+        self.assertEqual(self.case['oracle'], self.case['result'])
+        self.assertIs(ruleset[0],
+                      hoover.TinyCase.compile_ruleset(ruleset)[0])
+
+
+class CaseBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        super(CaseBatchTest, self).setUp()
+        self.cases = [
+            hoover.TinyCase({
+                'argset': {'n': n},
+                'oracle': {'f': n / 3.0, 's': 'x', 'junk': 1,
+                           'd': {'a': None, 'b': 1}},
+                'result': {'f': n / 3.0 + 0.0001, 's': 'y',
+                           'd': {'b': 1, 'c': None}},
+                'oname': 'O',
+                'rname': 'R' if n % 2 else 'S',
+            })
+            for n in range(6)
+        ]
+        del self.cases[4]['result']['f']
+        self.ruleset = [
+            {'round': {3: ['/oracle/f', '/result/f']}},
+            {'drivers': [{'rname': 'R'}],
+             'format_str': {'%.1f': ['/oracle/f', '/result/f']},
+             'exchange': {('y', 'x'): ['/result/s']},
+             'remove': ['/oracle/junk', '/result/nope']},
+            {'argsets': [{'argset': {'n': 2}}, {'argset': {'n': 4}}],
+             'even_up': [('/oracle/d', '/result/d'),
+                         ('/oracle/nope', '/result/d')]},
+        ]
+
+    def test_SameAsTinyCase(self):
+        oracle = copy.deepcopy(self.cases)
+        for case in oracle:
+            case.hack(self.ruleset)
+        hoover.CaseBatch(self.cases).hack(self.ruleset)
+        self.assertEqual(oracle, self.cases)
+
+    def test_Mask(self):
+        rules = [{'drivers': [{'rname': 'R'}], 'remove': ['/oracle/junk']}]
+        mask = hoover.CaseBatch(self.cases).hack(rules)
+        self.assertEqual([False, True, False, True, False, True], mask)
+        self.assertNotIn('junk', self.cases[1]['oracle'])
+        self.assertIn('junk', self.cases[0]['oracle'])
+
+    def test_Empty(self):
+        self.assertEqual([], hoover.CaseBatch([]).hack(self.ruleset))
+
+    def test_CustomAction(self):
+
+        class MyCase(hoover.TinyCase):
+
+            def a_upper(self, action):
+                for path in action:
+                    self.setpath(path, self.getpath(path).upper())
+
+            known_actions = dict(hoover.TinyCase.known_actions,
+                                 upper=a_upper)
+
+        cases = [MyCase(c) for c in self.cases]
+        hoover.CaseBatch(cases).hack([{'drivers': [{'rname': 'S'}],
+                                       'upper': ['/result/s']}])
+        self.assertEqual(['Y', 'y', 'Y', 'y', 'Y', 'y'],
+                         [c['result']['s'] for c in cases])
+
+    def test_InRegressionTest(self):
+
+        class OracleDriver(hoover.BaseTestDriver):
+
+            def _get_data(self):
+                self.data['f'] = self._args['n'] / 3.0
+
+        class ResultDriver(hoover.BaseTestDriver):
+
+            def _get_data(self):
+                self.data['f'] = self._args['n'] / 3.0 + 0.0001
+
+        tracker = hoover.regression_test(
+            [{'n': n} for n in range(4)],
+            [(operator.eq, OracleDriver, ResultDriver)], {},
+            apply_hacks=[[{'round': {2: ['/oracle/f', '/result/f']}}]])
+        stats = tracker.getstats()
+        self.assertFalse(tracker.errors_found())
+        self.assertEqual(4, stats['hacks'])
+        self.assertEqual(100, stats['cases_hacked'])
+
+
+
+class SharedCaseBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        super(SharedCaseBatchTest, self).setUp()
+        # one oracle compared to three results, as regression_test does
+        self.data = {
+            'O': {'f': 1 / 3.0, 's': 'x', 'junk': 1, 'd': {'a': None}},
+            'R': {'f': 1 / 3.0 + 0.0001, 's': 'y', 'd': {'b': None}},
+            'S': {'f': 1 / 3.0, 's': 'y', 'd': {}},
+            'T': {'f': 1 / 3.0, 's': 'x', 'd': {}},
+        }
+        self.pristine = copy.deepcopy(self.data)
+        self.cases = [
+            hoover.TinyCase({
+                'argset': {'n': 1},
+                'oracle': self.data['O'],
+                'result': self.data[rname],
+                'oname': 'O',
+                'rname': rname,
+            })
+            for rname in 'RST'
+        ]
+        self.keys = [{'oracle': 'O', 'result': c['rname']}
+                     for c in self.cases]
+
+    def check(self, *rulesets, **kwargs):
+        oracle = [copy.deepcopy(case) for case in self.cases]
+        batch = hoover.SharedCaseBatch(self.cases, self.keys, **kwargs)
+        for ruleset in rulesets:
+            for case in oracle:
+                case.hack(ruleset)
+            batch.hack(ruleset)
+        self.assertEqual(oracle, self.cases)
+        self.assertEqual(self.pristine, self.data)
+        return batch
+
+    def test_Untouched(self):
+        batch = self.check([{'drivers': [{'rname': 'X'}],
+                             'remove': ['/oracle/junk']}])
+        self.assertEqual(0, batch.copies)
+        self.assertIs(self.cases[0]['oracle'], self.cases[2]['oracle'])
+
+    def test_OracleReused(self):
+        batch = self.check([{'round': {3: ['/oracle/f', '/result/f']}},
+                            {'remove': ['/oracle/junk']}])
+        # oracle copied once for each rule, results once each
+        self.assertEqual(5, batch.copies)
+        self.assertEqual(4, batch.reused)
+        self.assertIs(self.cases[0]['oracle'], self.cases[2]['oracle'])
+
+    def test_SeveralRulesets(self):
+        # rulesets are compiled in each hack() call, so the compiled
+        # rules do not outlive it
+        actions = [{'remove': ['/oracle/s']},
+                   {'remove': ['/oracle/junk']},
+                   {'round': {2: ['/oracle/f']}}]
+        rulesets = []
+        for rname, action in zip('RST', actions):
+            rule = {'drivers': [{'rname': rname}]}
+            rule.update(action)
+            rulesets.append([rule])
+        self.check(*rulesets)
+        self.assertNotIn('s', self.cases[0]['oracle'])
+        self.assertIn('s', self.cases[1]['oracle'])
+
+    def test_Eager(self):
+        batch = self.check([{'drivers': [{'rname': 'R'}],
+                             'remove': ['/oracle/junk']}], lazy=False)
+        self.assertEqual(6, batch.copies)
+        self.assertIsNot(self.cases[1]['oracle'], self.cases[2]['oracle'])
+
+    def test_Partial(self):
+        batch = self.check([{'drivers': [{'rname': 'R'}, {'rname': 'S'}],
+                             'exchange': {('y', 'x'): ['/result/s']},
+                             'remove': ['/oracle/junk']},
+                            {'remove': ['/oracle/junk']}])
+        self.assertIs(self.cases[0]['oracle'], self.cases[1]['oracle'])
+        self.assertIsNot(self.cases[0]['oracle'], self.cases[2]['oracle'])
+        self.assertEqual(5, batch.copies)
+
+    def test_CrossSides(self):
+        batch = self.check([{'drivers': [{'rname': 'R'}],
+                             'even_up': [('/oracle/d', '/result/d')]},
+                            {'remove': ['/oracle/junk']}])
+        self.assertIsNot(self.cases[0]['oracle'], self.cases[1]['oracle'])
+        self.assertEqual(3, batch.copies)
+
+    def test_Privatize(self):
+        batch = hoover.SharedCaseBatch(self.cases, self.keys)
+        batch.privatize(1)
+        self.cases[1]['oracle']['f'] = None
+        self.assertEqual(self.pristine, self.data)
+        self.assertEqual(2, batch.copies)
+
+    def test_InRegressionTest(self):
+
+        class OracleDriver(hoover.BaseTestDriver):
+
+            def _get_data(self):
+                self.data['f'] = self._args['n'] / 3.0
+
+        class ResultDriver(hoover.BaseTestDriver):
+
+            def _get_data(self):
+                self.data['f'] = self._args['n'] / 3.0 + 0.0001
+
+        class OtherDriver(ResultDriver):
+            pass
+
+        argsrc = [{'n': n} for n in range(4)]
+        tests = [(operator.eq, OracleDriver, ResultDriver),
+                 (operator.eq, OracleDriver, OtherDriver)]
+        hacks = [[{'round': {2: ['/oracle/f', '/result/f']}}]]
+        tracker = hoover.regression_test(argsrc, tests, {},
+                                         apply_hacks=hacks, share_data=True)
+        stats = tracker.getstats()
+        self.assertFalse(tracker.errors_found())
+        self.assertEqual(12, stats['copies'])
+        self.assertEqual(4, stats['views_reused'])
+        self.assertEqual(4, stats['copies_avoided'])
+
+        tracker = hoover.regression_test(argsrc, tests, {},
+                                         apply_hacks=hacks)
+        stats = tracker.getstats()
+        self.assertFalse(tracker.errors_found())
+        self.assertEqual(16, stats['copies'])
+        self.assertEqual(0, stats['copies_avoided'])
+
+        tracker = hoover.regression_test(argsrc, tests, {})
+        self.assertTrue(tracker.errors_found())
+        self.assertEqual(0, tracker.getstats()['copies'])
+
+
+class BailoutTest(unittest.TestCase):
+
+    def setUp(self):
+        super(BailoutTest, self).setUp()
+        self.calls = []
+
+        def no_div_zero(args):
+            self.calls.append(args)
+            return args['op'] == 'div' and args['b'] == 0
+
+        self.fn = no_div_zero
+
+    def test_Cheap(self):
+
+        class MyDriver(hoover.BaseTestDriver):
+            bailouts = [self.fn]
+
+        try:
+            MyDriver.check_values({'op': 'div', 'b': 0})
+        except NotImplementedError as e:
+            self.assertIs(self.fn, e.fn)
+            self.assertIn("def no_div_zero(args):", str(e))
+        else:
+            self.fail("no bailout")
+
+    def test_Memo(self):
+
+        class MyDriver(hoover.BaseTestDriver):
+            bailouts = [hoover.bailout_reads('op', 'b')(self.fn)]
+
+        for a in range(3):
+            for b in range(3):
+                try:
+                    MyDriver.check_values({'op': 'div', 'a': a, 'b': b})
+                except hoover.Bailout as e:
+                    self.assertEqual(0, b)
+                    self.assertIn("def no_div_zero(args):", e.source)
+        self.assertEqual(3, len(self.calls))
+
+    def test_MemoUnhashable(self):
+        memo = hoover.bailout_reads('op', 'b')(self.fn)
+        self.assertFalse(memo({'op': ['add'], 'b': 0}))
+        self.assertFalse(memo({'op': ['add'], 'b': 0}))
+        self.assertEqual(2, len(self.calls))
+        self.assertEqual({}, memo.memo)
+
+    def test_InRegressionTest(self):
+
+        class MyDriver(hoover.BaseTestDriver):
+
+            bailouts = [hoover.bailout_reads('op', 'b')(self.fn)]
+
+            def _get_data(self):
+                self.data['x'] = self._args['a']
+
+        tracker = hoover.regression_test(
+            hoover.Cartman({'op': ['div', 'mul'], 'a': range(5),
+                            'b': range(5)},
+                           {'op': hoover.Cartman.Iterable,
+                            'a': hoover.Cartman.Iterable,
+                            'b': hoover.Cartman.Iterable}),
+            [(operator.eq, MyDriver, MyDriver)], {})
+        stats = tracker.getstats()
+        self.assertEqual(5, stats['MyDriver_bailouts'])
+        self.assertEqual(10, len(self.calls))
+
+
+class BatchDriverTest(unittest.TestCase):
+
+    class OracleDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x'] * 2
+
+    class BatchDriver(hoover.BaseTestDriver):
+
+        batches = []
+        bailouts = [lambda a: a['x'] == 4]
+
+        def _get_data_batch(self, argsets):
+            self.batches.append(len(argsets))
+            self.duration = 0.003 * len(argsets)
+            return [{'x': a['x'] * 2 if a['x'] != 5 else 0} for a in argsets]
+
+        def _normalize_data(self):
+            self.data['x'] = int(self.data['x'])
+
+    def setUp(self):
+        super(BatchDriverTest, self).setUp()
+        self.BatchDriver.batches = []
+        self.argsrc = [{'x': i} for i in range(8)]
+        self.tests = [(operator.eq, self.OracleDriver, self.BatchDriver)]
+
+    def test_Batches(self):
+        tracker = hoover.regression_test(self.argsrc, self.tests, {},
+                                         batch_size=3)
+        stats = tracker.getstats()
+        self.assertEqual([3, 2, 2], self.BatchDriver.batches)
+        self.assertEqual(8, stats['argsets'])
+        self.assertEqual(7, stats['tests_done'])
+        self.assertEqual(7, stats['BatchDriver_calls'])
+        self.assertEqual(3, stats['BatchDriver_batches'])
+        self.assertEqual(1, stats['BatchDriver_bailouts'])
+        self.assertEqual(3.0, stats['BatchDriver_duration_per_call'])
+        self.assertEqual(1, stats['total_errors'])
+        self.assertEqual([{'x': 5}], tracker._db.values()[0])
+
+    def test_RunBatch(self):
+        d = self.BatchDriver()
+        d.setup({})
+        drivers = d.run_batch([{'x': 1}, {'x': 2}])
+        self.assertEqual([{'x': 2}, {'x': 4}], [dd.data for dd in drivers])
+        self.assertEqual([3000000, 3000000],
+                         [dd.duration_ns for dd in drivers])
+        self.assertEqual(6000000, d.duration_ns)
+
+    def test_RunBatchMismatch(self):
+
+        class BadDriver(hoover.BaseTestDriver):
+
+            def _get_data_batch(self, argsets):
+                return []
+
+        d = BadDriver()
+        d.setup({})
+        self.assertRaises(hoover.DriverError, d.run_batch, [{'x': 1}])
+
+    def test_Apportion(self):
+        self.assertEqual([4, 3, 3], hoover._apportion(10, 3))
+        self.assertEqual(-7, sum(hoover._apportion(-7, 3)))
+
+
+class PersistentProcessDriverTest(unittest.TestCase):
+
+    WORKER = (
+        "import json, os, sys\n"
+        "for line in iter(sys.stdin.readline, ''):\n"
+        "    args = json.loads(line)\n"
+        "    if args.get('x') == 13:\n"
+        "        sys.exit(1)\n"
+        "    if args.get('x') == 99:\n"
+        "        sys.stdin.readline()\n"
+        "    if args.get('x') == 77:\n"
+        "        print('oops')\n"
+        "    print(json.dumps({'x': args['x'] * 2, 'pid': os.getpid()}))\n"
+        "    sys.stdout.flush()\n"
+    )
+
+    class DoublerDriver(hoover.PersistentProcessDriver):
+
+        def _normalize_data(self):
+            self.data['_pid'] = self.data.pop('pid')
+
+    def setUp(self):
+        super(PersistentProcessDriverTest, self).setUp()
+        self.settings = {
+            'DoublerDriver.cmd': [sys.executable, '-c', self.WORKER],
+        }
+
+    def tearDown(self):
+        hoover.PersistentProcessDriver.close_pools()
+        super(PersistentProcessDriverTest, self).tearDown()
+
+    def run_driver(self, args):
+        d = self.DoublerDriver()
+        d.setup(self.settings, only_own=True)
+        d.run(args)
+        return d
+
+    def test_Reused(self):
+        self.assertEqual({'x': 2}, self.run_driver({'x': 1}).data)
+        self.assertEqual({'x': 4}, self.run_driver({'x': 2}).data)
+        pool, = hoover.PersistentProcessDriver._pools.values()
+        self.assertEqual(0, pool.restarts)
+        self.assertEqual(1, len(pool._workers))
+
+    def test_Restart(self):
+        self.run_driver({'x': 1})
+        self.assertRaises(hoover.DriverError, self.run_driver, {'x': 13})
+        self.assertEqual({'x': 6}, self.run_driver({'x': 3}).data)
+        pool, = hoover.PersistentProcessDriver._pools.values()
+        self.assertEqual(1, pool.restarts)
+
+    def test_DeadWhileIdle(self):
+        self.run_driver({'x': 1})
+        pool, = hoover.PersistentProcessDriver._pools.values()
+        pool._workers[0].kill()
+        pool._workers[0].wait()
+        self.assertEqual({'x': 10}, self.run_driver({'x': 5}).data)
+
+    def test_InvalidResponse(self):
+        self.assertRaises(hoover.DriverError, self.run_driver, {'x': 77})
+        self.assertEqual({'x': 6}, self.run_driver({'x': 3}).data)
+        pool, = hoover.PersistentProcessDriver._pools.values()
+        self.assertEqual(1, pool.restarts)
+
+    def test_Timeout(self):
+        self.settings['DoublerDriver.timeout'] = 0.1
+        self.assertRaises(hoover.DriverError, self.run_driver, {'x': 99})
+        self.assertEqual({'x': 6}, self.run_driver({'x': 3}).data)
+
+    def test_NoFdLeak(self):
+        self.run_driver({'x': 1})
+        fds = len(os.listdir('/proc/self/fd'))
+        for _ in range(5):
+            self.assertRaises(hoover.DriverError, self.run_driver, {'x': 13})
+        self.assertEqual(fds, len(os.listdir('/proc/self/fd')))
+
+    def test_PoolSize(self):
+        self.settings['DoublerDriver.pool_size'] = 3
+        self.run_driver({'x': 1})
+        pool, = hoover.PersistentProcessDriver._pools.values()
+        self.assertEqual(3, len(pool._workers))
+
+    def test_LateCancel(self):
+        d = self.run_driver({'x': 1})
+        self.assertIsNone(d._worker)
+        d.cancel()
+        pool, = hoover.PersistentProcessDriver._pools.values()
+        pool.kill(pool._workers[0])
+        self.assertEqual({'x': 6}, self.run_driver({'x': 3}).data)
+        self.assertEqual(0, pool.restarts)
+
+    def test_InRegressionTest(self):
+        tracker = hoover.regression_test(
+            [{'x': i} for i in range(10)],
+            [(operator.eq, BatchDriverTest.OracleDriver, self.DoublerDriver)],
+            self.settings)
+        self.assertFalse(tracker.errors_found())
+
+    def test_Cancel(self):
+        self.settings['DoublerDriver.call_timeout'] = 0.2
+        tracker = hoover.regression_test(
+            [{'x': 1}, {'x': 99}, {'x': 3}],
+            [(operator.eq, BatchDriverTest.OracleDriver, self.DoublerDriver)],
+            self.settings)
+        self.assertEqual(1, tracker.getstats()['DoublerDriver_timeouts'])
+        self.assertEqual(1, len(tracker._db))
+        pool, = hoover.PersistentProcessDriver._pools.values()
+        self.assertEqual(1, pool.restarts)
+
+
+class HttpTestDriverTest(unittest.TestCase):
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.server.clients.add(self.client_address)
+            parsed = urlparse.urlparse(self.path)
+            args = dict(urlparse.parse_qsl(parsed.query))
+            if parsed.path == '/hang':
+                self.server.released.wait(5)
+                self.close_connection = 1
+                return
+            status = 500 if parsed.path == '/fail' else 200
+            body = json.dumps({'x': int(args.get('x', 0)) * 2})
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            if args.get('x') == '7':
+                self.close_connection = 1    # without telling the client
+
+        def log_message(self, *args):
+            pass
+
+    class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    class DoublerDriver(hoover.HttpTestDriver):
+
+        def _decode_data(self):
+            self.data.update(json.loads(self.data['_body']))
+
+    def setUp(self):
+        super(HttpTestDriverTest, self).setUp()
+        self.server = self.Server(('127.0.0.1', 0), self.Handler)
+        self.server.clients = set()
+        self.server.released = threading.Event()
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.01})
+        self.thread.daemon = True
+        self.thread.start()
+        self.uri = 'http://127.0.0.1:%d/calc' % self.server.server_port
+        self.settings = {'DoublerDriver.uri': self.uri}
+
+    def tearDown(self):
+        self.server.released.set()
+        self.server.shutdown()
+        self.server.server_close()
+        super(HttpTestDriverTest, self).tearDown()
+
+    def run_driver(self, args):
+        d = self.DoublerDriver()
+        d.setup(self.settings, only_own=True)
+        d.run(args)
+        return d
+
+    def test_Data(self):
+        d = self.run_driver({'x': 21})
+        self.assertEqual({'x': 42}, d.data)
+        self.assertTrue(0 < d.timings['ttfb'] <= d.duration)
+
+    def test_KeepAlive(self):
+        for x in range(5):
+            self.assertEqual({'x': x * 2}, self.run_driver({'x': x}).data)
+        self.assertEqual(1, len(self.server.clients))
+
+    def test_RetryClosed(self):
+        self.run_driver({'x': 7})
+        self.assertEqual({'x': 2}, self.run_driver({'x': 1}).data)
+        self.assertEqual(2, len(self.server.clients))
+
+    def test_NoRetry(self):
+        self.settings['DoublerDriver.retries'] = 0
+        self.run_driver({'x': 7})
+        self.assertRaises(hoover.DriverError, self.run_driver, {'x': 1})
+
+    def test_BadStatus(self):
+        self.settings['DoublerDriver.uri'] = self.uri.replace('calc', 'fail')
+        self.assertRaises(hoover.DriverError, self.run_driver, {'x': 1})
+
+    def test_TtfbInStats(self):
+        tracker = hoover.regression_test(
+            [{'x': i} for i in range(5)],
+            [(operator.eq, BatchDriverTest.OracleDriver, self.DoublerDriver)],
+            self.settings)
+        stats = tracker.getstats()
+        self.assertFalse(tracker.errors_found())
+        self.assertIn('DoublerDriver_ttfb_p99', stats)
+
+    def test_Cancel(self):
+        self.settings['DoublerDriver.uri'] = self.uri.replace('calc', 'hang')
+        d = self.DoublerDriver()
+        d.setup(self.settings, only_own=True)
+        limits = hoover.DriverLimits(timeout=0.1)
+        self.assertRaises(hoover.DriverTimeout, hoover._call, d, d.run,
+                          {'x': 1}, limits)
+        start = time.time()
+        while d._conn is not None and time.time() - start < 2:
+            time.sleep(0.01)
+        self.assertIsNone(d._conn)      # request failed without retries
+        self.assertLess(time.time() - start, 2)
+
+    def test_CancelledBefore(self):
+        d = self.DoublerDriver()
+        d.setup(self.settings, only_own=True)
+        d.cancel()
+        self.assertRaises(hoover.DriverError, d.run, {'x': 1})
+        self.assertEqual(set(), self.server.clients)
+
+
+class DigestTest(unittest.TestCase):
+
+    class OracleDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x']
+            self.data['ys'] = range(self._args['x'])
+
+    class ResultDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x'] if self._args['x'] != 3 else 0
+            self.data['ys'] = range(self._args['x'])
+
+    class TupleDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x']
+            self.data['ys'] = tuple(range(self._args['x']))
+
+    def setUp(self):
+        super(DigestTest, self).setUp()
+        self.argsrc = [{'x': i} for i in range(5)]
+
+    def test_Digest(self):
+        self.assertEqual(hoover.jsDigest({'a': [1, 2], 'b': None}),
+                         hoover.jsDigest({'b': None, 'a': [1, 2]}))
+        self.assertNotEqual(hoover.jsDigest({'a': 1}),
+                            hoover.jsDigest({'a': 1.0}))
+        self.assertIsNone(hoover.jsDigest({'a': object()}))
+
+    def test_NotOnMatch(self):
+        digested = []
+        orig = hoover.jsDigest
+
+        def spy(data):
+            digested.append(data)
+            return orig(data)
+
+        hoover.jsDigest = spy
+        try:
+            tracker = hoover.regression_test(
+                self.argsrc,
+                [(operator.eq, self.OracleDriver, self.ResultDriver)], {})
+        finally:
+            hoover.jsDigest = orig
+        stats = tracker.getstats()
+        self.assertEqual(2, len(digested))      # only the failed pair
+        self.assertNotIn('diffs_skipped', stats)
+        self.assertEqual(1, stats['total_errors'])
+        self.assertEqual([{'x': 3}], tracker._db.values()[0])
+
+    def test_DiffSkipped(self):
+        # tuples are not equal to lists, but their dumps are
+        tracker = hoover.regression_test(
+            self.argsrc,
+            [(lambda a, b: a is b, self.OracleDriver, self.TupleDriver)], {})
+        stats = tracker.getstats()
+        self.assertFalse(tracker.errors_found())
+        self.assertEqual(5, stats['diffs_skipped'])
+
+
+class ResultStoreTest(unittest.TestCase):
+
+    class OracleDriver(hoover.BaseTestDriver):
+
+        calls = []
+
+        def _get_data(self):
+            self.calls.append(self._args)
+            self.data['x'] = self._args['x'] * 2
+            self.data['_hidden'] = True
+
+        def _get_data_batch(self, argsets):
+            return [{'x': a['x'] * 2} for a in argsets]
+
+    class ResultDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x'] * 2 if self._args['x'] else 1
+
+    def setUp(self):
+        super(ResultStoreTest, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmp, 'oracle.jsonl')
+        self.OracleDriver.calls = []
+        self.argsrc = [{'x': i, 'y': [i]} for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        super(ResultStoreTest, self).tearDown()
+
+    def test_PutGet(self):
+        store = hoover.ResultStore(self.fname)
+        store.put({'a': 1, 'b': 2}, {'r': [1]})
+        store.put({'a': 2}, {'r': None})
+        self.assertEqual({'r': [1]}, store.get({'b': 2, 'a': 1}))
+        store.put({'a': 3}, {'r': 3})
+        self.assertEqual({'r': 3}, store.get({'a': 3}))
+        self.assertRaises(KeyError, store.get, {'a': 4})
+        self.assertIn({'a': 2}, store)
+        store.close()
+        store = hoover.ResultStore(self.fname)
+        self.assertEqual(3, len(store))
+        self.assertEqual({'r': None}, store.get({'a': 2}))
+
+    def test_Append(self):
+        store = hoover.ResultStore(self.fname)
+        store.put({'a': 1}, 1)
+        store.close()
+        store = hoover.ResultStore(self.fname)
+        self.assertEqual(1, store.get({'a': 1}))
+        store.put({'a': 1}, 'one')
+        store.put({'a': 2}, 2)
+        self.assertEqual('one', store.get({'a': 1}))
+        self.assertEqual(2, store.get({'a': 2}))
+
+    def test_Truncated(self):
+        store = hoover.ResultStore(self.fname)
+        store.put({'a': 1}, 1)
+        store.put({'a': 2}, 2)
+        store.close()
+        with open(self.fname, 'r+b') as fh:
+            fh.truncate(os.path.getsize(self.fname) - 2)
+        with open(store.index_fname, 'ab') as fh:
+            fh.write("deadbeef 12")
+        store = hoover.ResultStore(self.fname)
+        self.assertEqual(1, len(store))
+        self.assertEqual(1, store.get({'a': 1}))
+
+    def test_RecordReplay(self):
+        store = hoover.ResultStore(self.fname)
+        recorder = store.recorder(self.OracleDriver)
+        self.assertEqual('OracleDriver', recorder.__name__)
+        tracker = hoover.regression_test(
+            self.argsrc, [(operator.eq, recorder, self.ResultDriver)], {})
+        self.assertEqual(1, tracker.getstats()['total_errors'])
+        self.assertEqual(5, len(self.OracleDriver.calls))
+        store.close()
+
+        class OracleReplay(hoover.ReplayDriver):
+            pass
+
+        replayed = hoover.regression_test(
+            self.argsrc, [(operator.eq, OracleReplay, self.ResultDriver)],
+            {'OracleReplay.store': self.fname})
+        self.assertEqual(5, len(self.OracleDriver.calls))
+        self.assertEqual(tracker._db.values(), replayed._db.values())
+
+    def test_RecordBatch(self):
+        store = hoover.ResultStore(self.fname)
+        hoover.regression_test(
+            self.argsrc,
+            [(operator.eq, store.recorder(self.OracleDriver),
+              self.ResultDriver)], {}, batch_size=5)
+        self.assertEqual([], self.OracleDriver.calls)
+        self.assertEqual({'x': 8}, store.get(self.argsrc[4]))
+
+    def test_ReplayMissing(self):
+
+        class OracleReplay(hoover.ReplayDriver):
+            pass
+
+        d = OracleReplay()
+        d.setup({'OracleReplay.store': self.fname}, only_own=True)
+        self.assertRaises(hoover.DriverError, d.run, {'x': 1})
+
+
+
+class ArgsetSourceTest(unittest.TestCase):
+
+    class OracleDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x']
+
+    class ResultDriver(hoover.BaseTestDriver):
+
+        def _get_data(self):
+            self.data['x'] = self._args['x'] if self._args['x'] % 3 else 0.5
+
+    def setUp(self):
+        super(ArgsetSourceTest, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.argsrc = [{'x': i, 's': 'a%d' % i, 'l': {'n': [i, None]},
+                        'b': bool(i % 2), 'z': None}
+                       for i in range(10)]
+        self.tests = [(operator.eq, self.OracleDriver, self.ResultDriver)]
+        self.tracker = hoover.regression_test(self.argsrc, self.tests, {})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        super(ArgsetSourceTest, self).tearDown()
+
+    def failing(self):
+        return sorted(a for affected in self.tracker._db.values()
+                      for a in affected)
+
+    def fnames(self, ext):
+        return [os.path.join(self.tmp, f) for f in os.listdir(self.tmp)
+                if f.endswith(ext)]
+
+    def test_Csv(self):
+        self.tracker.write_args_csv(self.tmp)
+        self.tracker.write_args_csv(self.tmp)     # appends second header
+        src = hoover.CsvArgsetSource(self.fnames('.csv'))
+        self.assertEqual(sorted(self.failing() * 2), sorted(src))
+        rerun = hoover.regression_test(src, self.tests, {})
+        self.assertEqual(8, rerun.getstats()['total_errors'])
+
+    def test_CsvTypes(self):
+        self.tracker.write_args_csv(self.tmp)
+        src = hoover.CsvArgsetSource(self.fnames('.csv'),
+                                     types={'x': str}, columns=['x', 's'])
+        self.assertEqual([{'x': str(i), 's': 'a%d' % i} for i in (0, 3, 6, 9)],
+                         sorted(src))
+
+    def test_Lazy(self):
+        src = hoover.CsvArgsetSource(os.path.join(self.tmp, 'nope.csv'))
+        self.assertRaises(IOError, list, src)
+
+    def test_Jsonl(self):
+        self.tracker.write_args_jsonl(self.tmp)
+        src = hoover.JsonlArgsetSource(self.fnames('.jsonl'), compact=True)
+        argsets = list(src)
+        self.assertIsInstance(argsets[0], hoover.CompactArgset)
+        self.assertEqual(self.failing(), sorted(a.to_dict() for a in argsets))
+
+    def test_JsonlStrings(self):
+        fname = os.path.join(self.tmp, 'args.jsonl')
+        with open(fname, 'w') as fh:
+            fh.write('{"s": "a", "l": ["b", {"c": "\\u00e9"}]}\n')
+        argset, = hoover.JsonlArgsetSource(fname)
+        self.assertEqual({'s': 'a', 'l': ['b', {'c': '\xc3\xa9'}]}, argset)
+        self.assertIs(str, type(argset.keys()[0]))
+        self.assertIs(str, type(argset['s']))
+        self.assertIs(str, type(argset['l'][1]['c']))
+
+
 if __name__ == "__main__":
     unittest.main()